@@ -4,18 +4,392 @@
 - `Era5_land`
 - `GPM_IMERG_Early`
 - `GFS_atmos`
+
+各数据集的描述文件统一由`registry`在首次使用时读取并缓存。
 """
 
 from ..common import minio_paras, fs
 import os
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 import json
 
 bucket_name = minio_paras["bucket_name"]
 
 
+class CatalogIndex:
+    """
+    数据清单的时空索引，建立一次后可批量搜索
+
+    各数据集的范围存入STRtree，起止时间按起始时间排序存为数组，
+    多个aoi及时间窗口在一次向量化计算中完成筛选和裁剪。
+
+    Method:
+        search(aoi, start_time, end_time): 搜索单个aoi（多个要素合并为一个范围）
+        bulk_search(aois, start_times, end_times): 批量搜索多个aoi及时间窗口
+    """
+
+    def __init__(self, records):
+        """
+        Args:
+            records (list): 数据清单，每项为包含bbox、start_time、end_time的dict，其余键作为属性列输出
+        """
+
+        starts = np.array(
+            [np.datetime64(r["start_time"], "s") for r in records],
+            dtype="datetime64[s]",
+        )
+        order = np.argsort(starts, kind="stable")
+        records = [records[i] for i in order]
+
+        self._starts = starts[order]
+        self._ends = np.array(
+            [np.datetime64(r["end_time"], "s") for r in records],
+            dtype="datetime64[s]",
+        )
+        bboxes = np.array([r["bbox"] for r in records], dtype=float).reshape(-1, 4)
+        self._geometries = shapely.box(
+            bboxes[:, 0], bboxes[:, 1], bboxes[:, 2], bboxes[:, 3]
+        )
+        self._tree = shapely.STRtree(self._geometries)
+        self._attrs = pd.DataFrame(
+            [
+                {
+                    k: v
+                    for k, v in r.items()
+                    if k not in ("bbox", "start_time", "end_time")
+                }
+                for r in records
+            ]
+        )
+
+    def __len__(self):
+        return len(self._starts)
+
+    def search(self, aoi, start_time=None, end_time=None):
+        """
+        查询并获取数据清单
+
+        Args:
+            aoi (GeoDataFrame|Geometry): 矢量数据范围
+            start_time (datatime64): 查询的起始时间
+            end_time (datatime64): 查询的终止时间
+
+        Returns:
+            datalist (GeoDataFrame): 符合条件的数据清单
+        """
+
+        if isinstance(aoi, (gpd.GeoDataFrame, gpd.GeoSeries)):
+            aoi = shapely.union_all(self._to_geometries(aoi))
+
+        datalist = self.bulk_search([aoi], start_time, end_time)
+        return datalist.drop(columns="aoi")
+
+    def bulk_search(self, aois, start_times=None, end_times=None):
+        """
+        批量查询并获取数据清单
+
+        Args:
+            aois (GeoDataFrame|GeoSeries|list): 多个矢量数据范围，每个要素为一次查询
+            start_times (datatime64|list): 查询的起始时间，可为单个值或与aois等长的数组
+            end_times (datatime64|list): 查询的终止时间，可为单个值或与aois等长的数组
+
+        Returns:
+            datalist (GeoDataFrame): 符合条件的数据清单，aoi列为查询要素的序号
+        """
+
+        geometries = self._to_geometries(aois)
+        n = len(geometries)
+        starts = self._to_times(start_times, n)
+        ends = self._to_times(end_times, n)
+
+        query, entry = self._tree.query(geometries, predicate="intersects")
+
+        # 起始时间已排序，晚于查询终止时间的数据集可直接用二分查找排除
+        limit = np.searchsorted(self._starts, ends, side="right")
+        limit[np.isnat(ends)] = len(self._starts)
+        keep = entry < limit[query]
+        query, entry = query[keep], entry[keep]
+
+        start = np.where(
+            np.isnat(starts[query]),
+            self._starts[entry],
+            np.maximum(self._starts[entry], starts[query]),
+        )
+        end = np.where(
+            np.isnat(ends[query]),
+            self._ends[entry],
+            np.minimum(self._ends[entry], ends[query]),
+        )
+        keep = start <= end
+        query, entry, start, end = query[keep], entry[keep], start[keep], end[keep]
+
+        clipped = shapely.intersection(self._geometries[entry], geometries[query])
+        keep = ~shapely.is_empty(clipped)
+
+        datalist = self._attrs.iloc[entry[keep]].reset_index(drop=True)
+        datalist.insert(0, "aoi", query[keep])
+        datalist["start_time"] = np.datetime_as_string(start[keep], unit="s")
+        datalist["end_time"] = np.datetime_as_string(end[keep], unit="s")
+
+        return gpd.GeoDataFrame(
+            datalist, geometry=clipped[keep], crs="EPSG:4326"
+        )
+
+    def _to_geometries(self, aois):
+        if isinstance(aois, (gpd.GeoDataFrame, gpd.GeoSeries)):
+            if aois.crs is not None and not aois.crs.equals("EPSG:4326"):
+                aois = aois.to_crs("EPSG:4326")
+            return np.asarray(aois.geometry.values, dtype=object)
+        return np.asarray(aois, dtype=object).reshape(-1)
+
+    def _to_times(self, times, n):
+        if times is None:
+            return np.full(n, np.datetime64("NaT"), dtype="datetime64[s]")
+        times = np.asarray(times, dtype="datetime64[s]")
+        if times.ndim == 0:
+            return np.full(n, times)
+        return times
+
+
+class CatalogRegistry:
+    """
+    minio服务器中所有数据集的统一目录
+
+    自动发现各数据集在wis（geodata）和camels（camdata）中的版本，描述文件在首次使用时才并发读取，
+    读取结果缓存后供所有catalog共享。
+
+    Attributes:
+        collections (list): 已发现的数据集名称
+
+    Method:
+        datasets(collection_id): 获取数据集在minio服务器中的范围
+        load(collection_ids): 并发读取数据集描述文件
+        refresh(): 清空缓存
+        close(): 关闭读取描述文件的线程池
+        search(aoi, start_time, end_time, collection_ids): 跨数据集搜索
+        bulk_search(aois, start_times, end_times, collection_ids): 跨数据集批量搜索
+    """
+
+    def __init__(self, max_workers=8):
+        self._variants = {"wis": "geodata", "camels": "camdata"}
+        # 数据集名称前缀 -> [(描述文件相对路径, 时间分辨率)]
+        self._descriptors = {
+            "era5-land": [("era5_land/era5l.json", None)],
+            "gpm-imerg-early": [
+                ("gpm/gpm.json", "30 minutes"),
+                ("gpm1d/gpm1d.json", "1 day"),
+            ],
+            "gfs_atmos": [("gfs/gfs.json", None)],
+        }
+        self._max_workers = max_workers
+        self._executor = None
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._index = None
+
+    def _family(self, collection_id):
+        family = collection_id.split(".")[0]
+        if family not in self._descriptors:
+            raise Exception(f"未知的数据集：{collection_id}")
+        return family
+
+    def _paths(self, family):
+        return [
+            (variant, os.path.join(bucket_name, f"{prefix}/{path}"), resolution)
+            for variant, prefix in self._variants.items()
+            for path, resolution in self._descriptors[family]
+        ]
+
+    def _read(self, path):
+        try:
+            with fs.open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # 该版本的数据集不存在
+            return None
+
+    def _get(self, paths):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+            for path in paths:
+                if path not in self._cache:
+                    self._cache[path] = self._executor.submit(self._read, path)
+            futures = {path: self._cache[path] for path in paths}
+
+        contents = {}
+        for path, future in futures.items():
+            try:
+                contents[path] = future.result()
+            except Exception:
+                # 读取失败时不缓存，下次重新读取
+                with self._lock:
+                    if self._cache.get(path) is future:
+                        del self._cache[path]
+                raise
+        return contents
+
+    def load(self, collection_ids=None):
+        """
+        并发读取数据集描述文件，已读取的直接使用缓存
+
+        Args:
+            collection_ids (list): 数据集名称，默认为全部
+        """
+
+        if collection_ids is None:
+            families = list(self._descriptors.keys())
+        else:
+            families = {self._family(cid) for cid in collection_ids}
+        paths = [path for family in families for _, path, _ in self._paths(family)]
+        self._get(paths)
+
+    def refresh(self):
+        """
+        清空缓存，下次使用时重新读取描述文件
+        """
+
+        with self._lock:
+            self._cache = {}
+            self._index = None
+
+    def close(self):
+        """
+        关闭读取描述文件的线程池，之后再次使用时重新创建
+        """
+
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    @property
+    def collections(self):
+        self.load()
+        collections = []
+        for family in self._descriptors.keys():
+            if family == "gfs_atmos":
+                variables = []
+                for _, path, _ in self._paths(family):
+                    gfs = self._get([path])[path]
+                    if gfs is not None:
+                        variables += [v for v in gfs.keys() if v not in variables]
+                collections += [f"{family}.{v}" for v in variables]
+            else:
+                collections.append(family)
+        return collections
+
+    def datasets(self, collection_id):
+        """
+        获取数据集在minio服务器中的范围
+
+        Args:
+            collection_id (str): 数据集名称，如era5-land、gpm-imerg-early、gfs_atmos.tp
+
+        Returns:
+            datasets (dict): wis、camels中的已有数据集
+        """
+
+        family = self._family(collection_id)
+        paths = self._paths(family)
+        contents = self._get([path for _, path, _ in paths])
+
+        dss = {}
+        for variant, path, resolution in paths:
+            cont = contents[path]
+            if cont is None:
+                continue
+
+            if family == "gfs_atmos":
+                variable = collection_id.split(".", 1)[1]
+                if variable in cont:
+                    dss[variant] = cont[variable]
+                continue
+
+            ds = {}
+            if resolution is not None:
+                ds["time_resolution"] = resolution
+            ds["start_time"] = np.datetime64(cont["start"])
+            ds["end_time"] = np.datetime64(cont["end"])
+            ds["bbox"] = cont["bbox"]
+
+            if len(self._descriptors[family]) > 1:
+                dss.setdefault(variant, []).append(ds)
+            else:
+                dss[variant] = ds
+
+        return dss
+
+    def _get_records(self, collection_ids):
+        records = []
+        for cid in collection_ids:
+            for key, value in self.datasets(cid).items():
+                if isinstance(value, dict):
+                    value = [value]
+                for v in value:
+                    record = {"id": cid, "dataset": key}
+                    if "time_resolution" in v:
+                        record["time_resolution"] = v["time_resolution"]
+                    record["start_time"] = v.get("start_time", v.get("start"))
+                    record["end_time"] = v.get("end_time", v.get("end"))
+                    record["bbox"] = v["bbox"]
+                    records.append(record)
+        return records
+
+    def _get_index(self, collection_ids):
+        if collection_ids is not None:
+            return CatalogIndex(self._get_records(collection_ids))
+        if self._index is None:
+            self._index = CatalogIndex(self._get_records(self.collections))
+        return self._index
+
+    def search(self, aoi, start_time=None, end_time=None, collection_ids=None):
+        """
+        跨数据集查询并获取数据清单
+
+        Args:
+            aoi (GeoDataFrame): 矢量数据范围
+            start_time (datatime64): 查询的起始时间
+            end_time (datatime64): 查询的终止时间
+            collection_ids (list): 数据集名称，默认为全部
+
+        Returns:
+            datalist (GeoDataFrame): 符合条件的数据清单
+        """
+
+        return self._get_index(collection_ids).search(aoi, start_time, end_time)
+
+    def bulk_search(
+        self, aois, start_times=None, end_times=None, collection_ids=None
+    ):
+        """
+        跨数据集批量查询并获取数据清单
+
+        Args:
+            aois (GeoDataFrame|GeoSeries|list): 多个矢量数据范围，每个要素为一次查询
+            start_times (datatime64|list): 查询的起始时间，可为单个值或与aois等长的数组
+            end_times (datatime64|list): 查询的终止时间，可为单个值或与aois等长的数组
+            collection_ids (list): 数据集名称，默认为全部
+
+        Returns:
+            datalist (GeoDataFrame): 符合条件的数据清单，aoi列为查询要素的序号
+        """
+
+        return self._get_index(collection_ids).bulk_search(
+            aois, start_times, end_times
+        )
+
+
+registry = CatalogRegistry()
+atexit.register(registry.close)
+
+
 class ERA5LCatalog:
     """
     用于获取era5-land的数据源信息，并搜索minio服务器中的数据范围
@@ -30,6 +404,7 @@ class ERA5LCatalog:
 
     Method:
         search(aoi, start_time, end_time): 搜索minio服务器中的数据范围
+        bulk_search(aois, start_times, end_times): 批量搜索多个aoi及时间窗口
     """
 
     def __init__(self):
@@ -39,20 +414,11 @@ class ERA5LCatalog:
         self._spatialresolution = "0.1 x 0.1; Native resolution is 9 km."
         self._temporalresolution = "hourly"
 
-        self._datasets = self._get_datasets()
+        self._datasets = None
+        self._index = None
 
     def _get_datasets(self):
-        dss = {}
-
-        ds = {}
-        with fs.open(os.path.join(bucket_name, "geodata/era5_land/era5l.json")) as f:
-            era5 = json.load(f)
-            ds["start_time"] = np.datetime64(era5["start"])
-            ds["end_time"] = np.datetime64(era5["end"])
-            ds["bbox"] = era5["bbox"]
-        dss["wis"] = ds
-
-        return dss
+        return registry.datasets(self._collection_id)
 
     @property
     def collection_id(self):
@@ -76,8 +442,30 @@ class ERA5LCatalog:
 
     @property
     def datasets(self):
+        if self._datasets is None:
+            self._datasets = self._get_datasets()
         return self._datasets
 
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = CatalogIndex(self._get_records())
+        return self._index
+
+    def _get_records(self):
+        records = []
+        for key, value in self.datasets.items():
+            records.append(
+                {
+                    "id": self._collection_id,
+                    "dataset": key,
+                    "start_time": value["start_time"],
+                    "end_time": value["end_time"],
+                    "bbox": value["bbox"],
+                }
+            )
+        return records
+
     def search(self, aoi, start_time=None, end_time=None):
         """
         查询并获取数据清单
@@ -91,40 +479,22 @@ class ERA5LCatalog:
             datalist (GeoDataFrame): 符合条件的数据清单
         """
 
-        clips = []
-
-        for key, value in self._datasets.items():
-            start = start_time
-            end = end_time
-            if start_time is None:
-                start = value["start_time"]
-            if end_time is None:
-                end = value["end_time"]
+        return self.index.search(aoi, start_time, end_time)
 
-            if start < value["start_time"]:
-                start = value["start_time"]
-            if end > value["end_time"]:
-                end = value["end_time"]
+    def bulk_search(self, aois, start_times=None, end_times=None):
+        """
+        批量查询并获取数据清单
 
-            if start <= end:
-                df = pd.DataFrame(
-                    {
-                        "id": [self._collection_id],
-                        "dataset": [key],
-                        "start_time": [str(start)],
-                        "end_time": [str(end)],
-                        "geometry": [
-                            f"POLYGON(({value['bbox'][0]} {value['bbox'][3]},{value['bbox'][0]} {value['bbox'][1]},\
-                                     {value['bbox'][2]} {value['bbox'][1]},{value['bbox'][2]} {value['bbox'][3]},{value['bbox'][0]} {value['bbox'][3]}))"
-                        ],
-                    }
-                )
-                df["geometry"] = gpd.GeoSeries.from_wkt(df["geometry"])
-                gdf = gpd.GeoDataFrame(df, geometry="geometry", crs="EPSG:4326")
+        Args:
+            aois (GeoDataFrame|GeoSeries|list): 多个矢量数据范围，每个要素为一次查询
+            start_times (datatime64|list): 查询的起始时间，可为单个值或与aois等长的数组
+            end_times (datatime64|list): 查询的终止时间，可为单个值或与aois等长的数组
 
-                clips.append(gdf.clip(aoi))
+        Returns:
+            datalist (GeoDataFrame): 符合条件的数据清单，aoi列为查询要素的序号
+        """
 
-        return pd.concat(clips)
+        return self.index.bulk_search(aois, start_times, end_times)
 
 
 class GPMCatalog:
@@ -141,6 +511,7 @@ class GPMCatalog:
 
     Method:
         search(aoi, start_time, end_time): 搜索minio服务器中的数据范围
+        bulk_search(aois, start_times, end_times): 批量搜索多个aoi及时间窗口
     """
 
     def __init__(self):
@@ -152,51 +523,11 @@ class GPMCatalog:
         self._spatialresolution = "0.1 x 0.1; Native resolution is 9 km. (60°S-60°N)"
         self._temporalresolution = "half-hourly; 1 day"
 
-        self._datasets = self._get_datasets()
+        self._datasets = None
+        self._index = None
 
     def _get_datasets(self):
-        dss = {}
-        lds = []
-        ds = {}
-        with fs.open(os.path.join(bucket_name, "geodata/gpm/gpm.json")) as f:
-            gpm = json.load(f)
-            ds["time_resolution"] = "30 minutes"
-            ds["start_time"] = np.datetime64(gpm["start"])
-            ds["end_time"] = np.datetime64(gpm["end"])
-            ds["bbox"] = gpm["bbox"]
-        lds.append(ds)
-
-        ds = {}
-        with fs.open(os.path.join(bucket_name, "geodata/gpm1d/gpm1d.json")) as f:
-            gpm = json.load(f)
-            ds["time_resolution"] = "1 day"
-            ds["start_time"] = np.datetime64(gpm["start"])
-            ds["end_time"] = np.datetime64(gpm["end"])
-            ds["bbox"] = gpm["bbox"]
-        lds.append(ds)
-        dss["wis"] = lds
-
-        lds = []
-        ds = {}
-        with fs.open(os.path.join(bucket_name, "camdata/gpm/gpm.json")) as f:
-            gpm = json.load(f)
-            ds["time_resolution"] = "30 minutes"
-            ds["start_time"] = np.datetime64(gpm["start"])
-            ds["end_time"] = np.datetime64(gpm["end"])
-            ds["bbox"] = gpm["bbox"]
-        lds.append(ds)
-
-        ds = {}
-        with fs.open(os.path.join(bucket_name, "camdata/gpm1d/gpm1d.json")) as f:
-            gpm = json.load(f)
-            ds["time_resolution"] = "1 day"
-            ds["start_time"] = np.datetime64(gpm["start"])
-            ds["end_time"] = np.datetime64(gpm["end"])
-            ds["bbox"] = gpm["bbox"]
-        lds.append(ds)
-        dss["camels"] = lds
-
-        return dss
+        return registry.datasets(self._collection_id)
 
     @property
     def collection_id(self):
@@ -220,8 +551,32 @@ class GPMCatalog:
 
     @property
     def datasets(self):
+        if self._datasets is None:
+            self._datasets = self._get_datasets()
         return self._datasets
 
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = CatalogIndex(self._get_records())
+        return self._index
+
+    def _get_records(self):
+        records = []
+        for key, value in self.datasets.items():
+            for v in value:
+                records.append(
+                    {
+                        "id": self._collection_id,
+                        "dataset": key,
+                        "time_resolution": v["time_resolution"],
+                        "start_time": v["start_time"],
+                        "end_time": v["end_time"],
+                        "bbox": v["bbox"],
+                    }
+                )
+        return records
+
     def search(self, aoi, start_time=None, end_time=None):
         """
         查询并获取数据清单
@@ -235,42 +590,22 @@ class GPMCatalog:
             datalist (GeoDataFrame): 符合条件的数据清单
         """
 
-        clips = []
+        return self.index.search(aoi, start_time, end_time)
 
-        for key, value in self._datasets.items():
-            for v in value:
-                start = start_time
-                end = end_time
-                if start_time is None:
-                    start = v["start_time"]
-                if end_time is None:
-                    end = v["end_time"]
-
-                if start < v["start_time"]:
-                    start = v["start_time"]
-                if end > v["end_time"]:
-                    end = v["end_time"]
-
-                if start <= end:
-                    df = pd.DataFrame(
-                        {
-                            "id": [self._collection_id],
-                            "dataset": [key],
-                            "time_resolution": v["time_resolution"],
-                            "start_time": [str(start)],
-                            "end_time": [str(end)],
-                            "geometry": [
-                                f"POLYGON(({v['bbox'][0]} {v['bbox'][3]},{v['bbox'][0]} {v['bbox'][1]},\
-                                         {v['bbox'][2]} {v['bbox'][1]},{v['bbox'][2]} {v['bbox'][3]},{v['bbox'][0]} {v['bbox'][3]}))"
-                            ],
-                        }
-                    )
-                    df["geometry"] = gpd.GeoSeries.from_wkt(df["geometry"])
-                    gdf = gpd.GeoDataFrame(df, geometry="geometry", crs="EPSG:4326")
-
-                    clips.append(gdf.clip(aoi))
-
-        return pd.concat(clips)
+    def bulk_search(self, aois, start_times=None, end_times=None):
+        """
+        批量查询并获取数据清单
+
+        Args:
+            aois (GeoDataFrame|GeoSeries|list): 多个矢量数据范围，每个要素为一次查询
+            start_times (datatime64|list): 查询的起始时间，可为单个值或与aois等长的数组
+            end_times (datatime64|list): 查询的终止时间，可为单个值或与aois等长的数组
+
+        Returns:
+            datalist (GeoDataFrame): 符合条件的数据清单，aoi列为查询要素的序号
+        """
+
+        return self.index.bulk_search(aois, start_times, end_times)
 
 
 class GFSCatalog:
@@ -287,6 +622,7 @@ class GFSCatalog:
 
     Method:
         search(aoi, start_time, end_time): 搜索minio服务器中的数据范围
+        bulk_search(aois, start_times, end_times): 批量搜索多个aoi及时间窗口
     """
 
     def __init__(self, variable="tp"):
@@ -299,17 +635,11 @@ class GFSCatalog:
         self._spatialresolution = "0.25 x 0.25"
         self._temporalresolution = "hourly; 1-120h"
 
-        self._datasets = self._get_datasets()
+        self._datasets = None
+        self._index = None
 
     def _get_datasets(self):
-        dss = {}
-
-        ds = {}
-        with fs.open(os.path.join(bucket_name, "geodata/gfs/gfs.json")) as f:
-            gfs = json.load(f)
-        dss["wis"] = gfs[self._variable]
-
-        return dss
+        return registry.datasets(self._collection_id)
 
     @property
     def variable(self):
@@ -337,8 +667,31 @@ class GFSCatalog:
 
     @property
     def datasets(self):
+        if self._datasets is None:
+            self._datasets = self._get_datasets()
         return self._datasets
 
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = CatalogIndex(self._get_records())
+        return self._index
+
+    def _get_records(self):
+        records = []
+        for key, value in self.datasets.items():
+            for v in value:
+                records.append(
+                    {
+                        "id": self._collection_id,
+                        "dataset": key,
+                        "start_time": v["start"],
+                        "end_time": v["end"],
+                        "bbox": v["bbox"],
+                    }
+                )
+        return records
+
     def search(self, aoi, start_time=None, end_time=None):
         """
         查询并获取数据清单
@@ -352,38 +705,19 @@ class GFSCatalog:
             datalist (GeoDataFrame): 符合条件的数据清单
         """
 
-        clips = []
+        return self.index.search(aoi, start_time, end_time)
 
-        for key, value in self._datasets.items():
-            for v in value:
-                start = start_time
-                end = end_time
-                if start_time is None:
-                    start = np.datetime64(v["start"])
-                if end_time is None:
-                    end = np.datetime64(v["end"])
-
-                if start < np.datetime64(v["start"]):
-                    start = np.datetime64(v["start"])
-
-                if end > np.datetime64(v["end"]):
-                    end = np.datetime64(v["end"])
-
-                if start <= end:
-                    df = pd.DataFrame(
-                        {
-                            "id": [self._collection_id],
-                            "dataset": [key],
-                            "start_time": [str(start)],
-                            "end_time": [str(end)],
-                            "geometry": [
-                                f"POLYGON(({v['bbox'][0]} {v['bbox'][3]},{v['bbox'][0]} {v['bbox'][1]},{v['bbox'][2]} {v['bbox'][1]},{v['bbox'][2]} {v['bbox'][3]},{v['bbox'][0]} {v['bbox'][3]}))"
-                            ],
-                        }
-                    )
-                    df["geometry"] = gpd.GeoSeries.from_wkt(df["geometry"])
-                    gdf = gpd.GeoDataFrame(df, geometry="geometry", crs="EPSG:4326")
-
-                    clips.append(gdf.clip(aoi))
-
-        return pd.concat(clips)
+    def bulk_search(self, aois, start_times=None, end_times=None):
+        """
+        批量查询并获取数据清单
+
+        Args:
+            aois (GeoDataFrame|GeoSeries|list): 多个矢量数据范围，每个要素为一次查询
+            start_times (datatime64|list): 查询的起始时间，可为单个值或与aois等长的数组
+            end_times (datatime64|list): 查询的终止时间，可为单个值或与aois等长的数组
+
+        Returns:
+            datalist (GeoDataFrame): 符合条件的数据清单，aoi列为查询要素的序号
+        """
+
+        return self.index.bulk_search(aois, start_times, end_times)
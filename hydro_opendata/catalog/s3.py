@@ -1,21 +1,27 @@
-import requests as r
 import datetime
+import calendar
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from ..utils import validate
+from .stac import StacClient, client
 
 
 class LandsatCatalog:
-    def __init__(self):
-        self._root = (
-            "https://landsatlook.usgs.gov/stac-server"  # Landsat STAC API Endpoint
-        )
+    def __init__(
+        self,
+        root="https://landsatlook.usgs.gov/stac-server",  # Landsat STAC API Endpoint
+        max_workers=8,
+        stac_client=None,
+    ):
+        self._max_workers = max_workers
 
-        stac_response = r.get(self._root).json()
-        catalog_links = stac_response["links"]
-        self._search = [l["href"] for l in catalog_links if l["rel"] == "search"][
-            0
-        ]  # retreive search endpoint from STAC Catalogs
+        # 默认与其它STAC数据源共用同一个客户端，复用连接及缓存
+        if stac_client is None:
+            stac_client = client
+        self._client = stac_client
+
+        self.set_root(root)
 
     @property
     def root(self):
@@ -23,21 +29,50 @@ class LandsatCatalog:
 
     def set_root(self, url):
         self._root = url
+        self._search = self._client.search_link(self._root)
+
+    def _windows(self, start_date, end_date, interval):
+        windows = []
+        if interval == "day":
+            day = end_date.date()
+            while day >= start_date.date():
+                windows.append(
+                    day.strftime("%Y-%m-%d")
+                    + "T00:00:00Z/"
+                    + day.strftime("%Y-%m-%d")
+                    + "T23:59:59Z"
+                )
+                day -= datetime.timedelta(days=1)
+            return windows
 
-        stac_response = r.get(self._root).json()
-        catalog_links = stac_response["links"]
-        self._search = [l["href"] for l in catalog_links if l["rel"] == "search"][
-            0
-        ]  # retreive search endpoint from STAC Catalogs
-
-    def search(
-        self,
-        start_date: str = "1972-01-01",
-        end_date: str = None,
-        aoi=None,
-        bbox=None,
-        limit=1000,
-    ):
+        for y in range(end_date.year, start_date.year - 1, -1):
+            if interval == "month":
+                months = range(12, 0, -1)
+            else:
+                months = [None]
+
+            for m in months:
+                if m is None:
+                    first = datetime.date(y, 1, 1)
+                    last = datetime.date(y, 12, 31)
+                else:
+                    first = datetime.date(y, m, 1)
+                    last = datetime.date(y, m, calendar.monthrange(y, m)[1])
+
+                first = max(first, start_date.date())
+                last = min(last, end_date.date())
+                if first > last:
+                    continue
+
+                windows.append(
+                    first.strftime("%Y-%m-%d")
+                    + "T00:00:00Z/"
+                    + last.strftime("%Y-%m-%d")
+                    + "T23:59:59Z"
+                )
+        return windows
+
+    def _submit(self, executor, start_date, end_date, aoi, bbox, limit, interval):
         start_date = validate(start_date, "%Y-%m-%d", "start_date格式错误，应为yyyy-mm-dd")
         if end_date is None:
             end_date = datetime.date.today().strftime("%Y-%m-%d")
@@ -46,6 +81,9 @@ class LandsatCatalog:
         if start_date > end_date:
             raise ValueError("开始日期不能大于结束日期！")
 
+        if interval not in ["year", "month", "day"]:
+            raise ValueError("interval参数错误，应为year、month或day")
+
         params = {}
         params["limit"] = limit
 
@@ -56,43 +94,96 @@ class LandsatCatalog:
         else:
             params["bbox"] = bbox
 
-        landsat_dataset = []
+        return [
+            executor.submit(self._client.search, self._search, {**params, "datetime": dt})
+            for dt in self._windows(start_date, end_date, interval)
+        ]
 
-        # dt = f"{start_date.strftime("%Y-%m-%d")}T00:00:00Z/{end_date.strftime("%Y-%m-%d")}T23:59:59Z"
-        for y in range(end_date.year, start_date.year - 1, -1):
-            if y == start_date.year:
-                dt = start_date.strftime("%Y-%m-%d") + "T00:00:00Z"
-            else:
-                dt = f"{str(y)}-01-01T00:00:00Z"
+    def iter_search(
+        self,
+        start_date: str = "1972-01-01",
+        end_date: str = None,
+        aoi=None,
+        bbox=None,
+        limit=1000,
+        interval="year",
+    ):
+        """
+        按时间窗口并发搜索landsat数据，以生成器形式逐个返回feature
+
+        各时间窗口完成的先后顺序不定，feature按完成顺序返回。
+        同一时间窗口内的分页只能跟随next链接依次获取，结果分页较多时可用month或day缩小时间窗口以提高并发。
+
+        Args:
+            start_date (str): 开始日期，格式为yyyy-mm-dd
+            end_date (str): 结束日期，格式为yyyy-mm-dd，默认为今天
+            aoi (dict): 搜索范围，应符合GeoJSON的geometry属性格式
+            bbox (list): 搜索的矩形范围
+            limit (int): 每页返回的feature数量
+            interval (str): 时间窗口，year、month或day
+
+        Returns:
+            features (generator): 符合条件的feature
+        """
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = self._submit(
+                executor, start_date, end_date, aoi, bbox, limit, interval
+            )
+            for future in as_completed(futures):
+                for feature in future.result():
+                    yield feature
 
-            if y == end_date.year:
-                dt = dt + "/" + end_date.strftime("%Y-%m-%d") + "T23:59:59Z"
-            else:
-                dt = dt + f"/{str(y)}-12-31T23:59:59Z"
+    def search(
+        self,
+        start_date: str = "1972-01-01",
+        end_date: str = None,
+        aoi=None,
+        bbox=None,
+        limit=1000,
+        interval="year",
+    ):
+        """
+        按时间窗口并发搜索landsat数据
+
+        同一时间窗口内的分页只能跟随next链接依次获取，结果分页较多时可用month或day缩小时间窗口以提高并发。
 
-            params["datetime"] = dt
+        Args:
+            start_date (str): 开始日期，格式为yyyy-mm-dd
+            end_date (str): 结束日期，格式为yyyy-mm-dd，默认为今天
+            aoi (dict): 搜索范围，应符合GeoJSON的geometry属性格式
+            bbox (list): 搜索的矩形范围
+            limit (int): 每页返回的feature数量
+            interval (str): 时间窗口，year、month或day
 
-            query = r.post(
-                self._search,
-                json=params,
-            ).json()
-            try:
-                landsat_dataset += query["features"]
-            except:
-                raise Exception(query)
+        Returns:
+            features (list): 符合条件的feature，按时间窗口由近及远排列
+        """
+
+        landsat_dataset = []
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = self._submit(
+                executor, start_date, end_date, aoi, bbox, limit, interval
+            )
+            for future in futures:
+                landsat_dataset += future.result()
 
         return landsat_dataset
 
     def get_hrefs(self, ids):
-        hrefs = []
-        params = {}
-        params["ids"] = ids
+        """
+        获取feature中数据文件的链接，search返回过的feature直接从缓存中获取
 
-        query = r.post(
-            self._search,
-            json=params,
-        ).json()
-        for feature in query["features"]:
+        Args:
+            ids (list): feature的id
+
+        Returns:
+            hrefs (list): 每个feature的数据文件链接列表
+        """
+
+        hrefs = []
+        for feature in self._client.get_features(self._search, ids):
             feature_hrefs = []
             for key in feature["assets"].keys():
                 if "data" in feature["assets"][key]["roles"]:
@@ -109,14 +200,10 @@ from requests_oauthlib import OAuth2Session
 class SentinelCatalog:
     def __init__(self):
         self._root = "https://sh.dataspace.copernicus.eu/api/v1/catalog/1.0.0/"
-
-        stac_response = r.get(self._root).json()
-        catalog_links = stac_response["links"]
-        self._search = [l["href"] for l in catalog_links if l["rel"] == "search"][
-            0
-        ]  # retreive search endpoint from STAC Catalogs
+        self._search = client.search_link(self._root)
 
         self._oauth = None
+        self._client = None
 
     @property
     def root(self):
@@ -128,12 +215,7 @@ class SentinelCatalog:
 
     def set_root(self, url):
         self._root = url
-
-        stac_response = r.get(self._root).json()
-        catalog_links = stac_response["links"]
-        self._search = [l["href"] for l in catalog_links if l["rel"] == "search"][
-            0
-        ]  # retreive search endpoint from STAC Catalogs
+        self._search = client.search_link(self._root)
 
     def get_token(self, client_id=None, client_secret=None):
         if client_id is not None:
@@ -169,6 +251,8 @@ class SentinelCatalog:
         )
 
         self._oauth = oauth
+        # 搜索请求需要认证，使用带token的session
+        self._client = StacClient(session=oauth)
 
     def search(
         self,
@@ -211,30 +295,28 @@ class SentinelCatalog:
             for col in collections:
                 params["collections"] = [col]
 
-                try:
-                    query = self._oauth.post(
-                        self._search,
-                        json=params,
-                    ).json()
-                    sentinel_dataset += query["features"]
-                except:
-                    raise Exception(query)
-                    # print(query)
+                sentinel_dataset += self._client.search(self._search, dict(params))
 
-                d += delta
+            d += delta
 
         return sentinel_dataset
 
     def get_hrefs(self, ids):
-        hrefs = []
-        params = {}
-        params["ids"] = ids
+        """
+        获取feature中数据文件的链接，search返回过的feature直接从缓存中获取
 
-        query = self._oauth.post(
-            self._search,
-            json=params,
-        ).json()
-        for feature in query["features"]:
+        Args:
+            ids (list): feature的id
+
+        Returns:
+            hrefs (list): 每个feature的数据文件链接列表
+        """
+
+        if self._oauth is None:
+            raise ValueError("请验证token！")
+
+        hrefs = []
+        for feature in self._client.get_features(self._search, ids):
             feature_hrefs = []
             for key in feature["assets"].keys():
                 if "data" in feature["assets"][key]["roles"]:
@@ -0,0 +1,174 @@
+"""
+该模块提供STAC API的通用客户端，供`LandsatCatalog`、`SentinelCatalog`和`Alos_DEM`共用：
+
+- 复用keep-alive连接的session
+- 根目录、collection等文档按TTL缓存
+- 搜索得到的feature按搜索地址和id缓存（LRU，数量有上限），`get_features`优先从缓存中获取
+"""
+
+import time
+import threading
+from collections import OrderedDict
+import requests as r
+
+
+class StacClient:
+    """
+    STAC API客户端
+
+    Attributes:
+        session (Session): 发送请求所用的session
+
+    Method:
+        get(url): 获取根目录、collection等文档，结果按TTL缓存
+        search_link(root): 获取根目录中的搜索地址
+        search(url, params): 搜索并跟随next链接获取全部分页
+        get_features(url, ids): 按id获取feature，已缓存的不再查询
+    """
+
+    def __init__(self, session=None, max_workers=8, ttl=3600, max_features=10000):
+        """
+        Args:
+            session (Session): 已有的session，如OAuth2Session；默认新建
+            max_workers (int): 连接池大小，应不小于并发请求数
+            ttl (int): 文档缓存的有效期，单位为秒
+            max_features (int): 缓存的feature数量上限，超出时淘汰最久未使用的
+        """
+
+        if session is None:
+            session = r.Session()
+        adapter = r.adapters.HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        self._session = session
+        self._ttl = ttl
+        self._documents = {}
+        # (搜索地址, feature id) -> feature
+        self._features = OrderedDict()
+        self._max_features = max_features
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        return self._session
+
+    def get(self, url, ttl=None):
+        """
+        获取根目录、collection等文档，有效期内直接返回缓存
+
+        Args:
+            url (str): 文档地址
+            ttl (int): 缓存有效期，默认使用客户端设置
+
+        Returns:
+            document (dict): 文档内容
+        """
+
+        if ttl is None:
+            ttl = self._ttl
+
+        with self._lock:
+            cached = self._documents.get(url)
+        if cached is not None and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+
+        document = self._session.get(url).json()
+        with self._lock:
+            self._documents[url] = (time.monotonic(), document)
+        return document
+
+    def search_link(self, root):
+        """
+        获取根目录中的搜索地址
+
+        Args:
+            root (str): STAC根路径地址
+
+        Returns:
+            url (str): 搜索地址
+        """
+
+        catalog_links = self.get(root)["links"]
+        return [l["href"] for l in catalog_links if l["rel"] == "search"][
+            0
+        ]  # retreive search endpoint from STAC Catalogs
+
+    def _post(self, url, params):
+        query = self._session.post(url, json=params).json()
+        if "features" not in query:
+            raise Exception(query)
+        return query
+
+    def search(self, url, params):
+        """
+        搜索并跟随next链接获取全部分页，结果按id缓存
+
+        下一页的地址或token由上一页给出，分页只能依次获取；需要并发时应将搜索拆分为多个时间窗口分别调用
+
+        Args:
+            url (str): 搜索地址
+            params (dict): 搜索参数
+
+        Returns:
+            features (list): 符合条件的feature
+        """
+
+        features = []
+        query = self._post(url, params)
+        while True:
+            features += query["features"]
+
+            next_links = [l for l in query.get("links", []) if l["rel"] == "next"]
+            if len(next_links) == 0 or len(query["features"]) == 0:
+                break
+
+            link = next_links[0]
+            if link.get("method", "GET").upper() == "POST":
+                body = link.get("body", {})
+                if link.get("merge", False):
+                    body = {**params, **body}
+                query = self._post(link["href"], body)
+            else:
+                query = self._session.get(link["href"]).json()
+                if "features" not in query:
+                    raise Exception(query)
+
+        with self._lock:
+            for feature in features:
+                self._features[(url, feature["id"])] = feature
+                self._features.move_to_end((url, feature["id"]))
+            while len(self._features) > self._max_features:
+                self._features.popitem(last=False)
+
+        return features
+
+    def get_features(self, url, ids):
+        """
+        按id获取feature，已缓存的不再查询
+
+        Args:
+            url (str): 搜索地址
+            ids (list): feature的id
+
+        Returns:
+            features (list): 与ids顺序一致的feature，不存在的id被忽略
+        """
+
+        features = {}
+        with self._lock:
+            for i in ids:
+                if (url, i) in self._features:
+                    self._features.move_to_end((url, i))
+                    features[i] = self._features[(url, i)]
+        missing = [i for i in ids if i not in features]
+        if len(missing) > 0:
+            for feature in self.search(url, {"ids": missing, "limit": len(missing)}):
+                features[feature["id"]] = feature
+
+        return [features[i] for i in ids if i in features]
+
+
+client = StacClient()
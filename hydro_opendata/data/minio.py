@@ -4,42 +4,56 @@ from ..reader.minio import ERA5LReader, GPMReader, GFSReader
 
 class Era5L:
     def __init__(self):
-        self._catalog = ERA5LCatalog()
-        self._reader = ERA5LReader()
+        # catalog和reader在首次使用时才创建
+        self._catalog = None
+        self._reader = None
 
     @property
     def catalog(self):
+        if self._catalog is None:
+            self._catalog = ERA5LCatalog()
         return self._catalog
 
     @property
     def reader(self):
+        if self._reader is None:
+            self._reader = ERA5LReader()
         return self._reader
 
 
 class GPM:
     def __init__(self):
-        self._catalog = GPMCatalog()
-        self._reader = GPMReader()
+        self._catalog = None
+        self._reader = None
 
     @property
     def catalog(self):
+        if self._catalog is None:
+            self._catalog = GPMCatalog()
         return self._catalog
 
     @property
     def reader(self):
+        if self._reader is None:
+            self._reader = GPMReader()
         return self._reader
 
 
 class GFS:
     def __init__(self, variable="tp"):
-        self._catalog = GFSCatalog(variable)
-        self._reader = GFSReader()
-        self._reader.set_default_variable(self._catalog.variable)
+        self._variable = variable
+        self._catalog = None
+        self._reader = None
 
     @property
     def catalog(self):
+        if self._catalog is None:
+            self._catalog = GFSCatalog(self._variable)
         return self._catalog
 
     @property
     def reader(self):
+        if self._reader is None:
+            self._reader = GFSReader()
+            self._reader.set_default_variable(self._variable)
         return self._reader
@@ -13,8 +13,18 @@
 import requests
 import os
 import json
+import numpy as np
+import shapely
+import rasterio
+import rasterio.shutil
+from rasterio.features import geometry_mask
+from rasterio.merge import merge
+from rasterio.transform import from_origin
+from rasterio.windows import Window
 
-from .downloader import download_by_stream, download_sigletasking
+from .downloader import download_multitasking
+from ..utils import aoi_geometry
+from ..catalog.stac import client
 
 
 class Alos_DEM:
@@ -73,9 +83,7 @@ class Alos_DEM:
             return
 
         stac = self._sources[source]["url"]
-        stac_response = requests.get(stac).json()
-        catalog_links = stac_response["links"]
-        search = [l["href"] for l in catalog_links if l["rel"] == "search"][0]
+        search = client.search_link(stac)
 
         params = {"collections": [self._sources[source]["collection_name"]]}
         if bbox is not None:
@@ -83,34 +91,287 @@ class Alos_DEM:
         if intersects is not None:
             params["intersects"] = intersects
 
-        query = requests.post(search, json=params).json()
+        features = client.search(search, params)
 
-        features = query["features"]
-
-        for feat in features:
-            self._hrefs.append(feat["assets"]["data"]["href"])
+        # 每次搜索的结果替换上一次的结果
+        self._hrefs = [feat["assets"]["data"]["href"] for feat in features]
 
         return self._hrefs
 
-    def download(self, save_dir=".", cover=False):
+    def download(self, save_dir=".", cover=False, max_workers=8):
         """
-        下载列表中的dem数据
+        并发下载列表中的dem数据
 
         Args:
             save_dir (str): 本地保存目录
             cover (bool): 若文件已存在，是否覆盖
+            max_workers (int): 并发下载数
 
+        Returns:
+            file_paths (list): 本地文件路径，下载失败的为None
         """
 
-        if self._hrefs is not None:
-            for href in self._hrefs:
-                url = requests.utils.urlparse(href)
-                file_path = os.path.join(save_dir, url.path.split("/")[-1])
+        jobs = [(href, _local_path(href, save_dir)) for href in self._hrefs]
+
+        return download_multitasking(
+            jobs, max_workers=max_workers, per_host=max_workers, cover=cover
+        )
+
+    def mosaic(self, save_file, aoi=None, save_dir=".", **kwargs):
+        """
+        将已下载到save_dir的dem瓦片拼接并裁剪到aoi，写为COG
 
-                if os.path.exists(file_path) and not cover:
-                    continue
+        Args:
+            save_file (str): 输出的tif文件路径
+            aoi (GeoDataFrame|Geometry|list): 裁剪范围，可为矢量、shapely几何或[minx, miny, maxx, maxy]；默认不裁剪
+            save_dir (str): download时的本地保存目录
+            **kwargs: mosaic_dem的其余参数
+
+        Returns:
+            save_file (str): 输出的tif文件路径
+        """
 
-                if not os.path.exists(os.path.dirname(file_path)):
-                    os.makedirs(os.path.dirname(file_path))
+        files = [_local_path(href, save_dir) for href in self._hrefs]
+        files = [f for f in files if os.path.exists(f)]
+        if len(files) == 0:
+            raise Exception("没有已下载的dem瓦片，请先调用search和download")
+
+        return mosaic_dem(files, save_file, aoi=aoi, **kwargs)
+
+    def read(self, aoi, save_file=None, **kwargs):
+        """
+        只读取search结果中与aoi相交的COG块，不下载整个瓦片
+
+        Args:
+            aoi (GeoDataFrame|Geometry|list): 读取范围
+            save_file (str): 输出的tif文件路径；默认返回内存中的数组
+            **kwargs: read_dem的其余参数
+
+        Returns:
+            见read_dem
+        """
 
-                download_sigletasking(href, file_path)
+        if len(self._hrefs) == 0:
+            raise Exception("没有dem瓦片，请先调用search")
+
+        return read_dem(self._hrefs, aoi, save_file=save_file, **kwargs)
+
+
+def _local_path(href, save_dir):
+    url = requests.utils.urlparse(href)
+    return os.path.join(save_dir, url.path.split("/")[-1])
+
+
+def mosaic_dem(
+    files,
+    save_file,
+    aoi=None,
+    block_size=512,
+    compress="deflate",
+    nodata=None,
+):
+    """
+    将dem瓦片逐窗口拼接并裁剪到aoi，写为分块压缩、带金字塔的Cloud-Optimized GeoTIFF
+
+    输出按block_size大小的窗口依次生成，每个窗口只读取与其相交的瓦片，内存占用与瓦片数量和范围无关；
+    瓦片重叠处取排在前面的瓦片的值，aoi以外的像元为nodata。
+
+    Args:
+        files (list): 瓦片路径，需为同一坐标系和分辨率；也可为rasterio能打开的url
+        save_file (str): 输出的tif文件路径
+        aoi (GeoDataFrame|Geometry|list): 裁剪范围，可为矢量、shapely几何或[minx, miny, maxx, maxy]；默认不裁剪
+        block_size (int): 输出的分块大小，需为16的倍数
+        compress (str): 压缩方式，如deflate、lzw、zstd
+        nodata (float): 输出的nodata值，默认使用瓦片的nodata值
+
+    Returns:
+        save_file (str): 输出的tif文件路径
+    """
+
+    tmp_file = f"{save_file}.tmp.tif"
+    sources = [rasterio.open(f) for f in files]
+    try:
+        profile, geometry = _mosaic_profile(sources, aoi, nodata)
+        width, height = profile["width"], profile["height"]
+        profile.update(
+            driver="GTiff",
+            tiled=True,
+            blockxsize=block_size,
+            blockysize=block_size,
+            compress=compress,
+            BIGTIFF="IF_SAFER",
+        )
+        with rasterio.open(tmp_file, "w", **profile) as dst:
+            for row in range(0, height, block_size):
+                for col in range(0, width, block_size):
+                    window = Window(
+                        col,
+                        row,
+                        min(block_size, width - col),
+                        min(block_size, height - row),
+                    )
+                    data = _mosaic_window(
+                        sources,
+                        dst.window_transform(window),
+                        window,
+                        geometry,
+                        sources[0].res,
+                        profile["nodata"],
+                        profile["dtype"],
+                    )
+                    dst.write(data, 1, window=window)
+
+        # COG驱动按分块生成金字塔并把金字塔放在文件头部
+        rasterio.shutil.copy(
+            tmp_file,
+            save_file,
+            driver="COG",
+            COMPRESS=compress,
+            BLOCKSIZE=block_size,
+            OVERVIEWS="AUTO",
+            RESAMPLING="AVERAGE",
+            BIGTIFF="IF_SAFER",
+        )
+    finally:
+        for src in sources:
+            src.close()
+        # 写入或转换失败时也不留下临时文件
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return save_file
+
+
+# 远程读取COG时的GDAL设置：不列目录、缓存已读的块、合并相邻的range请求
+REMOTE_COG_OPTIONS = {
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.tiff,.TIF,.TIFF",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "GDAL_HTTP_MULTIPLEX": "YES",
+    "VSI_CACHE": "TRUE",
+    "GDAL_HTTP_MAX_RETRY": "3",
+    "GDAL_HTTP_RETRY_DELAY": "1",
+}
+
+
+def read_dem(
+    hrefs, aoi, save_file=None, block_size=512, compress="deflate", nodata=None
+):
+    """
+    通过range请求只读取远程COG瓦片中与aoi相交的块，不下载整个瓦片
+
+    Args:
+        hrefs (list): COG瓦片的url，如Alos_DEM.search的结果
+        aoi (GeoDataFrame|Geometry|list): 读取范围，可为矢量、shapely几何或[minx, miny, maxx, maxy]
+        save_file (str): 输出的tif文件路径；默认不写文件，返回内存中的数组
+        block_size (int): 写文件时的分块大小
+        compress (str): 写文件时的压缩方式
+        nodata (float): 输出的nodata值，默认使用瓦片的nodata值
+
+    Returns:
+        save_file (str): 指定save_file时，返回输出的COG路径
+        (data, profile) (tuple): 未指定save_file时，返回二维数组及其坐标系、仿射变换等信息
+    """
+
+    with rasterio.Env(**REMOTE_COG_OPTIONS):
+        if save_file is not None:
+            return mosaic_dem(
+                hrefs,
+                save_file,
+                aoi=aoi,
+                block_size=block_size,
+                compress=compress,
+                nodata=nodata,
+            )
+
+        sources = [rasterio.open(href) for href in hrefs]
+        try:
+            profile, geometry = _mosaic_profile(sources, aoi, nodata)
+            data = _mosaic_window(
+                sources,
+                profile["transform"],
+                Window(0, 0, profile["width"], profile["height"]),
+                geometry,
+                sources[0].res,
+                profile["nodata"],
+                profile["dtype"],
+            )
+        finally:
+            for src in sources:
+                src.close()
+        return data, profile
+
+
+def _mosaic_profile(sources, aoi, nodata):
+    """计算拼接结果的网格：瓦片范围与aoi外包矩形的交集，并对齐到瓦片的像元网格"""
+
+    first = sources[0]
+    crs, (res_x, res_y) = first.crs, first.res
+    if nodata is None:
+        nodata = first.nodata if first.nodata is not None else -9999
+
+    bounds = np.array([src.bounds for src in sources])
+    left, bottom = bounds[:, 0].min(), bounds[:, 1].min()
+    right, top = bounds[:, 2].max(), bounds[:, 3].max()
+    geometry = None
+    if aoi is not None:
+        geometry = aoi_geometry(aoi, crs)
+        a_left, a_bottom, a_right, a_top = geometry.bounds
+        # 对齐到瓦片的像元网格，round避免浮点误差多取一行或一列
+        left += np.floor(round(max(a_left - left, 0) / res_x, 6)) * res_x
+        top -= np.floor(round(max(top - a_top, 0) / res_y, 6)) * res_y
+        right = min(right, a_right)
+        bottom = max(bottom, a_bottom)
+    width = int(np.ceil(round((right - left) / res_x, 6)))
+    height = int(np.ceil(round((top - bottom) / res_y, 6)))
+    if width <= 0 or height <= 0:
+        raise Exception("aoi与dem瓦片不相交")
+
+    profile = {
+        "width": width,
+        "height": height,
+        "count": 1,
+        "dtype": first.dtypes[0],
+        "crs": crs,
+        "transform": from_origin(left, top, res_x, res_y),
+        "nodata": nodata,
+    }
+    return profile, geometry
+
+
+def _mosaic_window(sources, transform, window, geometry, res, nodata, dtype):
+    """生成输出的一个窗口：只读取与窗口相交的瓦片，并将aoi以外的像元设为nodata"""
+
+    res_x, res_y = res
+    shape = (int(window.height), int(window.width))
+    left, top = transform.c, transform.f
+    right, bottom = left + shape[1] * res_x, top - shape[0] * res_y
+    block = shapely.box(left, bottom, right, top)
+    data = np.full(shape, nodata, dtype=dtype)
+
+    if geometry is not None and not geometry.intersects(block):
+        return data
+    overlapping = [
+        src
+        for src in sources
+        if src.bounds.left < right
+        and src.bounds.right > left
+        and src.bounds.bottom < top
+        and src.bounds.top > bottom
+    ]
+    if len(overlapping) == 0:
+        return data
+
+    merged, _ = merge(
+        overlapping,
+        bounds=(left, bottom, right, top),
+        res=res,
+        nodata=nodata,
+        indexes=[1],
+    )
+    h, w = min(shape[0], merged.shape[1]), min(shape[1], merged.shape[2])
+    data[:h, :w] = merged[0, :h, :w]
+
+    if geometry is not None and not geometry.contains(block):
+        outside = geometry_mask([geometry], out_shape=shape, transform=transform)
+        data[outside] = nodata
+    return data
@@ -3,7 +3,7 @@ Author: Jianfeng Zhu
 Date: 2023-10-06 20:50:41
 LastEditTime: 2023-10-14 11:50:48
 LastEditors: Wenyu Ouyang
-Description: 该模块用于下载，通常是url链接或执行命令：`download_from_url` - 通过url链接下载文件；`download_by_stream` - 通过stream方式下载url链接；`download_singletasking` - 单函数线程下载文件，显示进度条
+Description: 该模块用于下载，通常是url链接或执行命令：`download_from_url` - 通过url链接下载文件；`download_by_stream` - 通过stream方式下载url链接；`download_singletasking` - 单函数线程下载文件，显示进度条；`download_by_ranges` - 按字节范围分段并发下载大文件；`download_resumable` - 断点续传下载文件；`download_ftp_files` - 复用FTP连接池并行下载多个文件
 FilePath: /hydro_opendata/hydro_opendata/downloader/downloader.py
 Copyright (c) 2023-2024 Jianfeng Zhu. All rights reserved.
 """
@@ -13,40 +13,493 @@ from zipfile import ZipFile
 
 import wget
 
-from ftplib import FTP
+from ftplib import FTP, error_perm, error_reply, error_temp
 import os
+import json
+import time
+import hashlib
+import queue
+from contextlib import contextmanager
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
-def download_ftp_file(ftp_url, path=None, retries=3):
-    # Parse the FTP URL
+def _sha256(file_name, chunk_size=1048576):
+    """Compute the sha256 hex digest of a local file."""
+    sha = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _write_manifest(file_name, size, checksum=False, ranges=None):
+    """
+    Record the size (and optionally sha256) of a download in `<file>.manifest`,
+    or the finished byte ranges of a partial one.
+    """
+    manifest = {"size": size}
+    if ranges is not None:
+        manifest["ranges"] = ranges
+    if checksum:
+        manifest["sha256"] = _sha256(file_name)
+    with open(f"{file_name}.manifest", "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def verify_file(file_name, size=None, sha256=None):
+    """
+    Checks a downloaded file against its sidecar manifest.
+
+    Parameters:
+    - file_name (str): The path to the downloaded file.
+    - size (int, optional): Expected size in bytes, defaults to the one in the manifest.
+    - sha256 (str, optional): Expected sha256 hex digest, defaults to the one in the manifest.
+
+    Returns:
+    - bool: True if the file exists and matches the manifest and the given values.
+    """
+    manifest_file = f"{file_name}.manifest"
+    if not os.path.exists(file_name) or not os.path.exists(manifest_file):
+        return False
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+
+    size = manifest.get("size") if size is None else size
+    if size is not None and os.path.getsize(file_name) != int(size):
+        return False
+    sha256 = manifest.get("sha256") if sha256 is None else sha256
+    if sha256 is not None and _sha256(file_name) != sha256:
+        return False
+    return True
+
+
+class FTPPool:
+    """
+    同一FTP主机的连接池，连接登录后可在多个文件间复用
+
+    Attributes:
+        host (str): FTP主机
+
+    Method:
+        acquire(): 取出一个可用连接，必要时新建并登录
+        release(ftp, broken): 归还连接，出错的连接直接关闭
+        connection(): 以上下文方式借用连接
+        sizes(file_paths): 用一个连接批量获取远程文件大小
+        grow(size): 增大最大连接数
+        close(): 关闭全部空闲连接
+    """
+
+    def __init__(self, host, size=4, user="", passwd=""):
+        """
+        Args:
+            host (str): FTP主机，可带端口，如"127.0.0.1:2121"
+            size (int): 最大连接数
+            user (str): 用户名，默认匿名登录
+            passwd (str): 密码
+        """
+
+        self._host = host
+        self._user = user
+        self._passwd = passwd
+        self._idle = queue.LifoQueue()
+        self._size = size
+        self._size_lock = threading.Lock()
+        self._slots = threading.Semaphore(size)
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def size(self):
+        return self._size
+
+    def grow(self, size):
+        """
+        增大最大连接数，小于当前值时不变
+
+        Args:
+            size (int): 最大连接数
+        """
+
+        with self._size_lock:
+            if size > self._size:
+                self._slots.release(size - self._size)
+                self._size = size
+
+    def _connect(self):
+        host, _, port = self._host.partition(":")
+        ftp = FTP(timeout=60)
+        ftp.connect(host, int(port) if port else 21)
+        ftp.login(self._user, self._passwd)
+        ftp.voidcmd("TYPE I")
+        return ftp
+
+    def acquire(self):
+        self._slots.acquire()
+        while True:
+            try:
+                ftp = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                # 空闲过久的连接可能已被服务器断开
+                ftp.voidcmd("NOOP")
+                return ftp
+            except Exception:
+                ftp.close()
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, ftp, broken=False):
+        if broken:
+            ftp.close()
+        else:
+            self._idle.put(ftp)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        ftp = self.acquire()
+        try:
+            yield ftp
+        except Exception:
+            self.release(ftp, broken=True)
+            raise
+        self.release(ftp)
+
+    def sizes(self, file_paths):
+        """
+        用一个连接批量获取远程文件大小
+
+        Args:
+            file_paths (list): 远程文件路径
+
+        Returns:
+            sizes (dict): 文件路径到字节数的映射，不存在的文件为None
+        """
+
+        sizes = {}
+        with self.connection() as ftp:
+            for file_path in file_paths:
+                try:
+                    sizes[file_path] = ftp.size(file_path)
+                except error_perm as e:
+                    print(f"{file_path}: {e}")
+                    sizes[file_path] = None
+        return sizes
+
+    def close(self):
+        while True:
+            try:
+                ftp = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                ftp.quit()
+            except Exception:
+                ftp.close()
+
+
+_ftp_pools = {}
+_ftp_pools_lock = threading.Lock()
+
+
+def get_ftp_pool(host, size=4):
+    """
+    Returns the shared FTP connection pool of a host, creating it on first use.
+
+    Parameters:
+    - host (str): The FTP host.
+    - size (int): Maximum number of connections; an existing smaller pool grows to it.
+
+    Returns:
+    - FTPPool: The pool of the host.
+    """
+    with _ftp_pools_lock:
+        if host not in _ftp_pools:
+            _ftp_pools[host] = FTPPool(host, size=size)
+        else:
+            _ftp_pools[host].grow(size)
+        return _ftp_pools[host]
+
+
+def _split_ftp_url(ftp_url):
     url_parts = ftp_url.replace("ftp://", "").split("/")
-    host = url_parts[0]
-    file_path = "/".join(url_parts[1:])
-    remote_filename = url_parts[-1]
+    return url_parts[0], "/".join(url_parts[1:]), url_parts[-1]
+
+
+def _retrieve_ftp_file(
+    pool, file_path, path, remote_file_size, retries, backoff, checksum
+):
+    """Retrieve one remote file into `<path>.part` with REST, then move it to path."""
+    part_path = f"{path}.part"
+    for attempt in range(retries):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset > remote_file_size:
+            offset = 0
+        try:
+            if offset < remote_file_size or not os.path.exists(part_path):
+                with pool.connection() as ftp:
+                    with open(part_path, "ab" if offset > 0 else "wb") as local_file:
+                        ftp.retrbinary(
+                            f"RETR {file_path}",
+                            local_file.write,
+                            rest=offset if offset > 0 else None,
+                        )
+        except (OSError, EOFError, error_perm, error_temp, error_reply) as e:
+            if isinstance(e, error_perm) and str(e).startswith("550"):
+                raise
+            print(f"Attempt {attempt + 1} failed: {e}")
+            time.sleep(backoff * 2**attempt)
+            continue
+
+        # Verify the downloaded file size
+        if os.path.getsize(part_path) == remote_file_size:
+            os.replace(part_path, path)
+            _write_manifest(path, remote_file_size, checksum)
+            return path
+        time.sleep(backoff * 2**attempt)
+
+    raise ValueError(
+        "Failed to download the file after multiple attempts. The file might be corrupted or incomplete."
+    )
+
+
+def _download_ftp_jobs(jobs, max_workers=4, retries=3, backoff=1, checksum=False):
+    """Download (ftp_url, path) jobs over pooled connections, one stat batch per host."""
+    results = [None] * len(jobs)
+    hosts = {}
+    for i, (ftp_url, path) in enumerate(jobs):
+        if verify_file(path):
+            results[i] = path
+            continue
+        host, file_path, _ = _split_ftp_url(ftp_url)
+        hosts.setdefault(host, []).append((i, file_path, path))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for host, todo in hosts.items():
+            pool = get_ftp_pool(host, size=max_workers)
+            # Get remote file sizes up front with a single connection
+            sizes = pool.sizes([file_path for _, file_path, _ in todo])
+            for i, file_path, path in todo:
+                remote_file_size = sizes[file_path]
+                if remote_file_size is None:
+                    continue
+                # Check if the file already exists at the specified path and has the same size as the remote file
+                if os.path.exists(path) and os.path.getsize(path) == remote_file_size:
+                    _write_manifest(path, remote_file_size, checksum)
+                    results[i] = path
+                    continue
+                futures[i] = executor.submit(
+                    _retrieve_ftp_file,
+                    pool,
+                    file_path,
+                    path,
+                    remote_file_size,
+                    retries,
+                    backoff,
+                    checksum,
+                )
+        for i, future in futures.items():
+            results[i] = future.result()
+
+    return results
+
+
+def download_ftp_file(ftp_url, path=None, retries=3, backoff=1, checksum=False):
+    """
+    Downloads a file from an anonymous FTP server, resuming interrupted transfers.
+
+    Data are written to `<path>.part` and continued with FTP REST after a failure;
+    retries wait `backoff * 2**attempt` seconds. A `<path>.manifest` is written
+    once the size matches the remote file. Connections are taken from the shared
+    pool of the host, see `get_ftp_pool`.
+
+    Parameters:
+    - ftp_url (str): The FTP URL of the file.
+    - path (str, optional): dir or file to save (default: current working directory).
+    - retries (int): Number of attempts.
+    - backoff (float): Base seconds of the exponential backoff between attempts.
+    - checksum (bool): Whether to record the sha256 in the manifest.
+
+    Returns:
+    - str: The path to the downloaded file.
+    """
+    # Parse the FTP URL
+    _, _, remote_filename = _split_ftp_url(ftp_url)
 
     # If path is a directory, specify the filename to save the downloaded file
     if path and os.path.isdir(path):
         path = os.path.join(path, remote_filename)
+    elif not path:
+        path = remote_filename
+
+    path = _download_ftp_jobs(
+        [(ftp_url, path)],
+        max_workers=1,
+        retries=retries,
+        backoff=backoff,
+        checksum=checksum,
+    )[0]
+    if path is None:
+        raise ValueError(f"{ftp_url} does not exist on the server.")
+    return path
+
+
+def download_ftp_files(
+    ftp_urls, save_dir=".", max_workers=4, retries=3, backoff=1, checksum=False
+):
+    """
+    Downloads many files from anonymous FTP servers in parallel.
 
-    # Connect to the FTP server
-    ftp = FTP(host)
-    ftp.login()
+    Files on the same host share a pool of at most `max_workers` logged-in
+    connections, and all remote sizes of a host are fetched up front over one
+    connection. Each file resumes and verifies as in `download_ftp_file`.
 
-    # Get remote file size
-    remote_file_size = ftp.size(file_path)
+    Parameters:
+    - ftp_urls (list): The FTP URLs of the files.
+    - save_dir (str): Directory to save the files in.
+    - max_workers (int): Number of parallel transfers (and connections per host).
+    - retries (int): Number of attempts per file.
+    - backoff (float): Base seconds of the exponential backoff between attempts.
+    - checksum (bool): Whether to record the sha256 in the manifests.
 
-    # Check if the file already exists at the specified path and has the same size as the remote file
-    if path and os.path.exists(path) and os.path.getsize(path) == remote_file_size:
-        return path
+    Returns:
+    - list: Paths to the downloaded files in the order of ftp_urls, None for missing ones.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    jobs = [
+        (ftp_url, os.path.join(save_dir, _split_ftp_url(ftp_url)[2]))
+        for ftp_url in ftp_urls
+    ]
+    return _download_ftp_jobs(
+        jobs,
+        max_workers=max_workers,
+        retries=retries,
+        backoff=backoff,
+        checksum=checksum,
+    )
 
-    # Download the file
-    for _ in range(retries):
-        with open(path, "wb") as local_file:
-            ftp.retrbinary(f"RETR {file_path}", local_file.write)
 
-        # Verify the downloaded file size
-        if os.path.getsize(path) == remote_file_size:
-            return path
+def _range_total(response):
+    """The full size in the Content-Range header (`bytes */N`), None if absent."""
+    total = response.headers.get("Content-Range", "").split("/")[-1]
+    return int(total) if total.isdigit() else None
+
+
+def _remote_size(url, headers=None):
+    """The Content-Length of a HEAD request, None if absent."""
+    head = requests.head(url, headers=headers, allow_redirects=True, timeout=60)
+    length = head.headers.get("Content-Length")
+    return int(length) if length is not None else None
+
+
+def download_resumable(
+    url,
+    file_name,
+    headers=None,
+    retries=5,
+    backoff=1,
+    checksum=False,
+    chunk_size=65536,
+):
+    """
+    Downloads a file over HTTP(S), resuming interrupted transfers.
+
+    Data are written to `<file_name>.part` and continued with an HTTP Range request
+    after a failure; retries wait `backoff * 2**attempt` seconds. A
+    `<file_name>.manifest` is written once the size matches the server.
+
+    Parameters:
+    - url (str): The URL of the file.
+    - file_name (str): The path to save the file.
+    - headers (dict, optional): Request headers.
+    - retries (int): Number of attempts.
+    - backoff (float): Base seconds of the exponential backoff between attempts.
+    - checksum (bool): Whether to record the sha256 in the manifest.
+    - chunk_size (int): Bytes per write.
+
+    Returns:
+    - str: The path to the downloaded file.
+    """
+    if verify_file(file_name):
+        return file_name
+    if headers is None:
+        headers = {}
+
+    # A file downloaded before manifests existed is kept if its size matches
+    if os.path.exists(file_name):
+        head = requests.head(url, headers=headers, allow_redirects=True, timeout=60)
+        length = head.headers.get("Content-Length")
+        if length is not None and os.path.getsize(file_name) == int(length):
+            _write_manifest(file_name, int(length), checksum)
+            return file_name
+
+    part_path = f"{file_name}.part"
+    total = None
+    for attempt in range(retries):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request_headers = dict(headers)
+        if offset > 0:
+            request_headers["Range"] = f"bytes={offset}-"
+        try:
+            with requests.get(
+                url, headers=request_headers, stream=True, timeout=60
+            ) as response:
+                if response.status_code == 416:
+                    # The part file may hold the whole content, check the real size
+                    total = _range_total(response) or _remote_size(url, headers)
+                    if total != offset:
+                        print(
+                            f"Part file of {offset} bytes does not match the "
+                            f"remote size {total}, restarting"
+                        )
+                        os.remove(part_path)
+                        total = None
+                        continue
+                elif response.status_code == 404:
+                    raise ValueError(f"{url} 404 not found.")
+                else:
+                    response.raise_for_status()
+                    if response.status_code == 206:
+                        total = int(response.headers["Content-Range"].split("/")[-1])
+                    else:
+                        # The server ignored the Range header, start from zero
+                        offset = 0
+                        length = response.headers.get("Content-Length")
+                        total = int(length) if length is not None else None
+
+                    bar = tqdm(
+                        total=total,
+                        initial=offset,
+                        unit="B",
+                        unit_scale=True,
+                        desc=f"下载文件 {file_name}",
+                    )
+                    with open(part_path, "ab" if offset > 0 else "wb") as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            bar.update(len(chunk))
+                    bar.close()
+        except requests.exceptions.RequestException as e:
+            print(f"Attempt {attempt + 1} failed: {e}")
+            time.sleep(backoff * 2**attempt)
+            continue
+
+        size = os.path.getsize(part_path)
+        if total is None or size == total:
+            os.replace(part_path, file_name)
+            _write_manifest(file_name, size, checksum)
+            return file_name
+        print(f"Attempt {attempt + 1} incomplete: {size}/{total} bytes")
+        time.sleep(backoff * 2**attempt)
 
     raise ValueError(
         "Failed to download the file after multiple attempts. The file might be corrupted or incomplete."
@@ -55,7 +508,10 @@ def download_ftp_file(ftp_url, path=None, retries=3):
 
 def wget_download(url, save_path=None):
     """
-    Downloads a file using wget.
+    Downloads a file, resuming interrupted transfers.
+
+    FTP URLs are fetched with `download_ftp_file`, HTTP(S) URLs with
+    `download_resumable`, anything else with wget.
 
     Parameters:
     - url (str): The URL of the file to be downloaded.
@@ -72,10 +528,14 @@ def wget_download(url, save_path=None):
         output_filename = os.path.basename(url)
 
     # Check if the file already exists
-    if os.path.exists(output_filename):
+    if verify_file(output_filename):
         print(f"File {output_filename} already exists. Skipping download.")
         return output_filename
 
+    if url.startswith("ftp://"):
+        return download_ftp_file(url, output_filename)
+    if url.startswith(("http://", "https://")):
+        return download_resumable(url, output_filename)
     return wget.download(url, out=output_filename)
 
 
@@ -124,7 +584,7 @@ def download_from_url(url, file_name):
 
 def download_by_stream(url, file_name):
     """
-    通过stream下载url链接文件
+    通过stream下载url链接文件，先写入.part文件，中断后以Range请求续传
 
     Args:
         url (str): url链接
@@ -137,28 +597,26 @@ def download_by_stream(url, file_name):
     }
 
     # 发起 head 请求，即只会获取响应头部信息
-    head = requests.head(url, headers=headers)
+    head = requests.head(url, headers=headers, allow_redirects=True)
 
     if head.status_code == 404:
         print("404 not found.")
     elif head.status_code == 200:
-        response = requests.get(url, headers=headers, stream=True)
-        with open(file_name, mode="wb") as f:
-            # 写入分块文件
-            for i, chunk in enumerate(response.iter_content(chunk_size=1024), start=1):
-                f.write(chunk)
-                print("\r", "已下载：%.2f MB" % (i / 1024), end="", flush=True)
-
-            print(f"{file_name}下载完成。")
+        download_resumable(url, file_name, headers)
+        print(f"{file_name}下载完成。")
 
 
-def download_sigletasking(url: str, file_name: str):
+def download_sigletasking(
+    url: str, file_name: str, segments=8, min_segment_size=4194304
+):
     """
-    单函数线程下载文件，显示进度条
+    单函数线程下载文件，显示进度条；服务器支持Range请求时分段并发下载大文件
 
     Args:
         url (str): 文件链接
         file_name (str): 文件名或文件路径
+        segments (int): 分段数，同时也是并发数
+        min_segment_size (int): 每段的最小字节数，文件小于两段时不分段
 
     """
     # 文件下载直链
@@ -168,19 +626,30 @@ def download_sigletasking(url: str, file_name: str):
     }
 
     # 发起 head 请求，即只会获取响应头部信息
-    head = requests.head(url, headers=headers)
+    head = requests.head(url, headers=headers, allow_redirects=True)
 
     if head.status_code == 404:
         print("404 not found.")
     elif head.status_code == 200:
         # 文件大小，以 B 为单位
         file_size = head.headers.get("Content-Length")
-        if file_size is not None:
-            download_single_task_with_chunks(file_size, url, headers, file_name)
+        accept_ranges = head.headers.get("Accept-Ranges", "none").lower()
+        if (
+            file_size is not None
+            and accept_ranges == "bytes"
+            and segments > 1
+            and int(file_size) >= 2 * min_segment_size
+        ):
+            download_by_ranges(
+                url,
+                file_name,
+                file_size,
+                headers,
+                segments=min(segments, int(file_size) // min_segment_size),
+            )
         else:
-            # 未获取到文件大小，采用stream方法下载
-            # download_from_url(url,file_name)
-            download_by_stream(url, file_name)
+            # 写入.part文件，中断后以Range请求续传
+            download_resumable(url, file_name, headers)
 
 
 def download_single_task_with_chunks(file_size, url, headers, file_name):
@@ -194,6 +663,341 @@ def download_single_task_with_chunks(file_size, url, headers, file_name):
         # 写入分块文件
         for chunk in response.iter_content(chunk_size=chunk_size):
             f.write(chunk)
-            bar.update(chunk_size)
+            bar.update(len(chunk))
     # 关闭进度条
     bar.close()
+
+
+def _split_ranges(file_size, segments):
+    """将[0, file_size)均分为segments段闭区间"""
+
+    step = -(-file_size // segments)
+    return [
+        (start, min(start + step, file_size) - 1) for start in range(0, file_size, step)
+    ]
+
+
+def _write_at(fd, data, offset, lock):
+    """在文件指定偏移处写入，不支持os.pwrite的平台加锁后seek写入"""
+
+    view = memoryview(data)
+    if hasattr(os, "pwrite"):
+        while len(view) > 0:
+            n = os.pwrite(fd, view, offset)
+            view = view[n:]
+            offset += n
+    else:
+        with lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            while len(view) > 0:
+                n = os.write(fd, view)
+                view = view[n:]
+
+
+def _merge_ranges(ranges):
+    """合并重叠或相邻的闭区间"""
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _missing_ranges(done, file_size, step):
+    """[0, file_size)中未完成的部分，按不超过step字节切分为闭区间"""
+
+    missing, start = [], 0
+    for done_start, done_end in _merge_ranges(done) + [[file_size, file_size]]:
+        if done_start > start:
+            gap = done_start - start
+            missing += [
+                (start + s, start + e) for s, e in _split_ranges(gap, -(-gap // step))
+            ]
+        start = max(start, done_end + 1)
+    return missing
+
+
+def _finished_ranges(part_path, file_size):
+    """读取.part文件的manifest中已完成的字节范围，.part与文件大小不符时返回None"""
+
+    manifest_file = f"{part_path}.manifest"
+    if not os.path.exists(part_path) or not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except ValueError:
+        return None
+    if manifest.get("size") != file_size or os.path.getsize(part_path) != file_size:
+        return None
+    return manifest.get("ranges", [])
+
+
+def download_by_ranges(
+    url,
+    file_name,
+    file_size,
+    headers=None,
+    segments=8,
+    chunk_size=1048576,
+    retries=5,
+    backoff=1,
+):
+    """
+    按字节范围分段并发下载单个大文件，各段写入预分配的.part文件的对应位置，全部完成后再重命名
+
+    已完成的字节范围记录在.part文件的manifest中；某段失败时从断开处重试，等待backoff * 2**attempt秒，
+    重试仍失败时保留.part文件，再次调用只下载未完成的部分
+
+    Args:
+        url (str): 文件链接，服务器需支持Range请求
+        file_name (str): 文件的本地存储地址
+        file_size (int): 文件大小，以 B 为单位
+        headers (dict): 请求头
+        segments (int): 分段数，同时也是并发数
+        chunk_size (int): 每次写入的字节数
+        retries (int): 每段的尝试次数
+        backoff (float): 重试间隔的基数（秒），按指数增长
+
+    Returns:
+        file_name (str): 文件的本地存储地址
+    """
+
+    file_size = int(file_size)
+    if verify_file(file_name, size=file_size):
+        return file_name
+    if headers is None:
+        headers = {}
+
+    # 续传上次未完成的.part文件，否则预分配文件
+    part_path = f"{file_name}.part"
+    done = _finished_ranges(part_path, file_size)
+    if done is None:
+        done = []
+        with open(part_path, mode="wb") as f:
+            f.truncate(file_size)
+        _write_manifest(part_path, file_size, ranges=done)
+    jobs = _missing_ranges(done, file_size, -(-file_size // segments))
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=segments, pool_maxsize=segments
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    lock = threading.Lock()
+    bar = tqdm(
+        total=file_size,
+        initial=sum(end - start + 1 for start, end in _merge_ranges(done)),
+        unit="B",
+        unit_scale=True,
+        desc=f"下载文件 {file_name}",
+    )
+
+    def record(start, end):
+        # 记录已写入的字节范围，中断后不再重复下载
+        if end < start:
+            return
+        with lock:
+            done[:] = _merge_ranges(done + [[start, end]])
+            _write_manifest(part_path, file_size, ranges=done)
+
+    def fetch(start, end):
+        offset = start
+        for attempt in range(retries):
+            try:
+                with session.get(
+                    url,
+                    headers={**headers, "Range": f"bytes={offset}-{end}"},
+                    stream=True,
+                    timeout=60,
+                ) as response:
+                    if response.status_code != 206:
+                        raise ValueError(
+                            f"服务器未按Range返回数据，状态码{response.status_code}"
+                        )
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        _write_at(fd, chunk, offset, lock)
+                        offset += len(chunk)
+                        with lock:
+                            bar.update(len(chunk))
+            except requests.exceptions.RequestException as e:
+                print(f"字节{offset}-{end}第{attempt + 1}次下载失败：{e}")
+            finally:
+                record(start, offset - 1)
+            if offset == end + 1:
+                return
+            time.sleep(backoff * 2**attempt)
+        raise Exception(f"字节{start}-{end}下载不完整，仅获得{offset - start}字节")
+
+    fd = os.open(part_path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+    try:
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            futures = [executor.submit(fetch, start, end) for start, end in jobs]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+        bar.close()
+        session.close()
+
+    # 校验文件大小
+    if os.path.getsize(part_path) != file_size:
+        os.remove(part_path)
+        os.remove(f"{part_path}.manifest")
+        raise Exception(f"{file_name}大小与服务器不一致")
+
+    os.replace(part_path, file_name)
+    os.remove(f"{part_path}.manifest")
+    _write_manifest(file_name, file_size)
+    return file_name
+
+
+class DownloadManager:
+    """
+    多文件并发下载，共用连接池，并限制同一主机的并发数
+
+    Attributes:
+        session (Session): 下载所用的session
+
+    Method:
+        download(jobs, cover): 并发下载(url, file_name)列表中的文件，显示总进度条
+    """
+
+    def __init__(self, max_workers=8, per_host=4, headers=None, chunk_size=1048576):
+        """
+        Args:
+            max_workers (int): 总并发数
+            per_host (int): 同一主机的最大并发数
+            headers (dict): 请求头
+            chunk_size (int): 每次写入的字节数
+        """
+
+        if headers is None:
+            headers = {
+                "User-Agent": "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/63.0.3239.132 Safari/537.36 QIHU 360SE"
+            }
+
+        self._max_workers = max_workers
+        self._per_host = per_host
+        self._headers = headers
+        self._chunk_size = chunk_size
+
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        return self._session
+
+    def _host_limit(self, url):
+        host = requests.utils.urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.Semaphore(self._per_host)
+            return self._hosts[host]
+
+    def _download(self, url, file_name, bar):
+        with self._host_limit(url):
+            response = self._session.get(url, headers=self._headers, stream=True)
+            if response.status_code == 404:
+                print(f"{url} 404 not found.")
+                return None
+            response.raise_for_status()
+
+            file_size = response.headers.get("Content-Length")
+            if file_size is not None:
+                with self._lock:
+                    bar.total += int(file_size)
+                    bar.refresh()
+
+            # 先写入.part文件，完整下载后才替换为目标文件
+            part_path = f"{file_name}.part"
+            size = 0
+            try:
+                with open(part_path, mode="wb") as f:
+                    for chunk in response.iter_content(chunk_size=self._chunk_size):
+                        f.write(chunk)
+                        size += len(chunk)
+                        with self._lock:
+                            bar.update(len(chunk))
+                if file_size is not None and size != int(file_size):
+                    raise Exception(f"下载不完整，仅获得{size}/{file_size}字节")
+            except Exception:
+                os.remove(part_path)
+                raise
+        os.replace(part_path, file_name)
+        _write_manifest(file_name, size)
+        return file_name
+
+    def download(self, jobs, cover=False):
+        """
+        并发下载文件
+
+        Args:
+            jobs (list): (url, file_name)列表
+            cover (bool): 若文件已完整下载，是否覆盖
+
+        Returns:
+            file_names (list): 与jobs顺序一致的本地文件路径，下载失败的为None
+        """
+
+        results = [None] * len(jobs)
+        todo = []
+        for i, (url, file_name) in enumerate(jobs):
+            # 只有与manifest一致的文件才视为已下载，中断留下的文件重新下载
+            if not cover and verify_file(file_name):
+                results[i] = file_name
+                continue
+
+            if os.path.dirname(file_name) and not os.path.exists(
+                os.path.dirname(file_name)
+            ):
+                os.makedirs(os.path.dirname(file_name), exist_ok=True)
+            todo.append(i)
+
+        bar = tqdm(
+            total=0, unit="B", unit_scale=True, desc=f"下载{len(todo)}个文件"
+        )
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = {
+                i: executor.submit(self._download, jobs[i][0], jobs[i][1], bar)
+                for i in todo
+            }
+            for i, future in futures.items():
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    print(f"{jobs[i][0]}下载失败：{e}")
+        bar.close()
+
+        return results
+
+
+def download_multitasking(jobs, max_workers=8, per_host=4, cover=False):
+    """
+    多线程并发下载多个文件，显示总进度条
+
+    Args:
+        jobs (list): (url, file_name)列表
+        max_workers (int): 总并发数
+        per_host (int): 同一主机的最大并发数
+        cover (bool): 若文件已存在，是否覆盖
+
+    Returns:
+        file_names (list): 与jobs顺序一致的本地文件路径，下载失败的为None
+    """
+
+    manager = DownloadManager(max_workers=max_workers, per_host=per_host)
+    return manager.download(jobs, cover=cover)
@@ -7,32 +7,39 @@ Description: Reading streamflow/water level data from hydrostation data source
 FilePath: \hydro_opendata\hydro_opendata\downloader\hydrostation.py
 Copyright (c) 2023-2024 Wenyu Ouyang. All rights reserved.
 """
+import io
 from datetime import datetime
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
+import time
 import warnings
-import pytz
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 from dataretrieval import nwis
 from pygeohydro import NWIS
 from hydro_opendata.downloader.downloader import (
     download_ftp_file,
+    download_ftp_files,
     unzip_file,
     wget_download,
 )
 
 
-def catalogue_grdc(save_dir):
-    # URL for the GRDC catalogue
-    file_url = "ftp://ftp.bafg.de/pub/REFERATE/GRDC/catalogue/grdc_stations.zip"
+# in-process memo of cleaned catalogues: station file -> (fingerprint, catalogue, index)
+_grdc_catalogues = {}
 
-    # Download the zip file using FTP
-    save_path = wget_download(file_url, save_dir)
-    # Extract the Excel file from the zip
-    unzip_folder = unzip_file(save_path)
-    # Read the Excel file
-    station_file = os.path.join(unzip_folder, "GRDC_Stations.xlsx")
+
+def _file_fingerprint(file_path):
+    """A cheap fingerprint of a source file: its size and modification time."""
+    stat = os.stat(file_path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def _read_grdc_catalogue_excel(station_file):
+    """Parse and clean GRDC_Stations.xlsx."""
     grdc_catalogue = pd.read_excel(station_file, sheet_name="station_catalogue")
 
     # Cleanup the data
@@ -70,7 +77,131 @@ def catalogue_grdc(save_dir):
     return grdc_catalogue
 
 
-def download_grdc_month_data(id, save_dir):
+def _load_grdc_catalogue(save_dir):
+    """Return the memo entry of the catalogue, refreshing it if the source file changed."""
+    # URL for the GRDC catalogue
+    file_url = "ftp://ftp.bafg.de/pub/REFERATE/GRDC/catalogue/grdc_stations.zip"
+
+    # Download the zip file using FTP
+    save_path = wget_download(file_url, save_dir)
+    # Extract the Excel file from the zip
+    unzip_folder = unzip_file(save_path)
+    station_file = os.path.join(unzip_folder, "GRDC_Stations.xlsx")
+    fingerprint = _file_fingerprint(station_file)
+
+    memo = _grdc_catalogues.get(station_file)
+    if memo is not None and memo[0] == fingerprint:
+        return memo
+
+    # The cleaned catalogue is cached as parquet next to the Excel file,
+    # tagged with the fingerprint of the Excel file it was made from
+    cache_file = os.path.join(unzip_folder, "GRDC_Stations.parquet")
+    grdc_catalogue = None
+    if os.path.exists(cache_file):
+        metadata = pq.read_schema(cache_file).metadata or {}
+        if metadata.get(b"grdc_fingerprint", b"").decode() == fingerprint:
+            grdc_catalogue = pd.read_parquet(cache_file)
+    if grdc_catalogue is None:
+        # Read the Excel file
+        grdc_catalogue = _read_grdc_catalogue_excel(station_file)
+        table = pa.Table.from_pandas(grdc_catalogue, preserve_index=False)
+        table = table.replace_schema_metadata(
+            {**table.schema.metadata, b"grdc_fingerprint": fingerprint.encode()}
+        )
+        pq.write_table(table, cache_file)
+
+    grdc_index = grdc_catalogue.set_index("grdc_no", drop=False).sort_index()
+    memo = (fingerprint, grdc_catalogue, grdc_index)
+    _grdc_catalogues[station_file] = memo
+    return memo
+
+
+def catalogue_grdc(save_dir):
+    """
+    Read the GRDC station catalogue.
+
+    The cleaned catalogue is cached as GRDC_Stations.parquet and memoized in the
+    process; both are rebuilt when GRDC_Stations.xlsx changes.
+
+    Parameters
+    -----------
+    save_dir (str)
+        Directory to save the catalogue in.
+
+    Returns
+    -------
+    pd.DataFrame
+        The station catalogue, one row per station.
+    """
+    return _load_grdc_catalogue(save_dir)[1].copy()
+
+
+def grdc_station_index(save_dir):
+    """
+    Read the GRDC station catalogue indexed by station number.
+
+    Use it for fast lookups, e.g. ``index.loc[6335020, ["lat", "long", "area", "wmo_reg"]]``
+    or ``index.loc[station_ids]`` for many stations at once.
+
+    Parameters
+    -----------
+    save_dir (str)
+        Directory to save the catalogue in.
+
+    Returns
+    -------
+    pd.DataFrame
+        The station catalogue with a sorted "grdc_no" index.
+    """
+    return _load_grdc_catalogue(save_dir)[2].copy()
+
+
+def _grdc_archives():
+    """Read the WMO region -> FTP archive table shipped with the package."""
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    grdc_ltmmd_file = os.path.join(this_dir, "grdcLTMMD.csv")
+    return pd.read_csv(grdc_ltmmd_file)
+
+
+def download_grdc_archives(save_dir, wmo_regions=None, max_workers=4, unzip=True):
+    """
+    Download the long-term monthly archives of several WMO regions in parallel.
+
+    All archives live on the same FTP host, so they share one pool of logged-in
+    connections and their sizes are fetched in a single batch.
+
+    Parameters
+    -----------
+    save_dir (str)
+        Directory to save the archives in.
+    wmo_regions (list, optional)
+        WMO region numbers (1-6). Defaults to all regions.
+    max_workers (int)
+        Number of parallel FTP connections.
+    unzip (bool)
+        Whether to extract the archives.
+
+    Returns
+    -------
+    dict
+        A dictionary mapping each WMO region to its archive (or extracted folder) path.
+    """
+    grdc_ltmmd = _grdc_archives()
+    if wmo_regions is not None:
+        grdc_ltmmd = grdc_ltmmd[grdc_ltmmd["WMO_Region"].isin(wmo_regions)]
+
+    file_paths = download_ftp_files(
+        grdc_ltmmd["Archive"].tolist(), save_dir, max_workers=max_workers
+    )
+    archives = {}
+    for wmo_region, file_path in zip(grdc_ltmmd["WMO_Region"], file_paths):
+        if file_path is not None and unzip:
+            file_path = unzip_file(file_path)
+        archives[wmo_region] = file_path
+    return archives
+
+
+def download_grdc_month_data(id, save_dir, catalogue=None):
     """
     Interface with the Global Runoff Data Centre database of Monthly Time Series.
 
@@ -82,6 +213,9 @@ def download_grdc_month_data(id, save_dir):
     id (str)
         Identifier for a station. It's called "grdc no" in the catalogue.
                 it will be transformed to int type.
+    catalogue (pd.DataFrame, optional)
+        The result of `catalogue_grdc`; pass it when querying many stations to
+        avoid reading the catalogue again for each one.
 
     Returns
     -------
@@ -89,19 +223,15 @@ def download_grdc_month_data(id, save_dir):
         A dictionary containing tables file path.
     """
 
-    # catalogue_grdc to get the catalogue.
-    catalogue = catalogue_grdc(save_dir)
-
-    # Filter the catalogue based on the provided id
-    catalogue_filtered = catalogue[catalogue["grdc_no"] == int(id)]
-
-    # Retrieve the WMO region from the filtered catalogue
-    wmo_region = catalogue_filtered["wmo_reg"].iloc[0]
+    # Retrieve the WMO region from the catalogue
+    if catalogue is None:
+        wmo_region = grdc_station_index(save_dir).loc[int(id), "wmo_reg"]
+    else:
+        catalogue_filtered = catalogue[catalogue["grdc_no"] == int(id)]
+        wmo_region = catalogue_filtered["wmo_reg"].iloc[0]
 
     # Load the grdcLTMMD.csv file
-    this_dir = os.path.dirname(os.path.abspath(__file__))
-    grdc_ltmmd_file = os.path.join(this_dir, "grdcLTMMD.csv")
-    grdc_ltmmd = pd.read_csv(grdc_ltmmd_file)
+    grdc_ltmmd = _grdc_archives()
     # Retrieve ftp server location based on the WMO region
     zip_file_url = grdc_ltmmd.loc[
         grdc_ltmmd["WMO_Region"] == wmo_region, "Archive"
@@ -144,11 +274,161 @@ def download_grdc_daily_data(station_id, data_dir):
     return file_path
 
 
+def _with_retry(func, *args, retries=3, backoff=1, **kwargs):
+    """Call func, retrying with exponential backoff when it raises."""
+    for attempt in range(retries):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries - 1:
+                raise
+            print(f"Attempt {attempt + 1} failed: {e}")
+            time.sleep(backoff * 2**attempt)
+
+
+def get_nwis_iv_batch(
+    sites,
+    start=None,
+    end=None,
+    param_code="All",
+    group_size=100,
+    max_workers=4,
+    retries=3,
+    backoff=1,
+):
+    """
+    分组并发获取多个站点的nwis即时数据（iv）
+
+    nwis的iv服务一次请求最多支持100个站点，因此按group_size分组，各组并发请求，失败后指数退避重试。
+
+    Args:
+        sites (list): 站点id
+        start (str): 起始时间，如"2016-01-01"
+        end (str): 结束时间
+        param_code (str): 参数代码，00060代表流量，00065代表水位；"All"为全部
+        group_size (int): 每个请求包含的站点数，不超过100
+        max_workers (int): 并发请求数
+        retries (int): 每组的最大尝试次数
+        backoff (float): 重试的基础等待秒数
+
+    Returns:
+        df (DataFrame): site_no、datetime为列的长表；部分组失败时跳过这些组，
+            失败的站点记录在df.attrs["failed_sites"]中；全部失败时抛出异常
+    """
+
+    if isinstance(sites, str):
+        sites = [sites]
+    groups = [sites[i : i + group_size] for i in range(0, len(sites), group_size)]
+    kwargs = {} if param_code == "All" else {"parameterCd": param_code}
+
+    def fetch(group):
+        df, _ = _with_retry(
+            nwis.get_iv,
+            sites=group,
+            start=start,
+            end=end,
+            retries=retries,
+            backoff=backoff,
+            **kwargs,
+        )
+        df = df.reset_index()
+        if "site_no" not in df.columns:
+            df.insert(0, "site_no", group[0])
+        return df
+
+    dfs = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch, group): group for group in groups}
+        for future in as_completed(futures):
+            try:
+                dfs.append(future.result())
+            except Exception as e:
+                print(f"{futures[future][0]}等{len(futures[future])}个站点获取失败：{e}")
+                failed += futures[future]
+
+    if len(groups) > 0 and len(failed) == len(sites):
+        raise Exception(f"全部{len(sites)}个站点获取失败")
+    if len(dfs) == 0:
+        df = pd.DataFrame(columns=["site_no", "datetime"])
+    else:
+        df = (
+            pd.concat(dfs, ignore_index=True)
+            .sort_values(["site_no", "datetime"])
+            .reset_index(drop=True)
+        )
+    df.attrs["failed_sites"] = [site for site in sites if site in set(failed)]
+    return df
+
+
+def download_nwis_batch(
+    sites,
+    start=None,
+    end=None,
+    param_code="00065",
+    save_file="nwis_iv.parquet",
+    station_store=None,
+    **kwargs,
+):
+    """
+    分组并发获取多个站点的nwis即时数据，一次性写入parquet文件
+
+    Args:
+        sites (list): 站点id
+        start (str): 起始时间
+        end (str): 结束时间
+        param_code (str): 参数代码
+        save_file (str): parquet文件路径
+        station_store (StationStore): 同时写入该站点数据库，来源为"nwis_iv"
+        **kwargs: get_nwis_iv_batch的其余参数
+
+    Returns:
+        df (DataFrame): 获取的数据，失败的站点记录在df.attrs["failed_sites"]中
+    """
+
+    df = get_nwis_iv_batch(sites, start=start, end=end, param_code=param_code, **kwargs)
+    if len(df) == 0:
+        raise Exception(f"没有获取到数据，不写入{save_file}")
+    if os.path.dirname(save_file):
+        os.makedirs(os.path.dirname(save_file), exist_ok=True)
+    df.to_parquet(save_file, index=False)
+    if station_store is not None:
+        _write_nwis_station_store(df, station_store)
+    return df
+
+
+def _write_nwis_station_store(df, station_store, source="nwis_iv"):
+    """将nwis即时数据的各参数列转为长表写入站点数据库，"_cd"结尾的质量标识列不写入"""
+    value_columns = [
+        c
+        for c in df.columns
+        if c not in ("site_no", "datetime") and not c.endswith("_cd")
+    ]
+    if len(df) == 0 or len(value_columns) == 0:
+        return
+    long_df = df.melt(
+        id_vars=["site_no", "datetime"],
+        value_vars=value_columns,
+        var_name="variable",
+        value_name="value",
+    ).rename(columns={"site_no": "station", "datetime": "time"})
+    station_store.write(source, long_df.dropna(subset=["value"]))
+
+
+def _write_nwis_txt(df, file_name, header):
+    """将nwis数据写为空格分隔、去掉双引号的文本，只写一次文件"""
+    content = df.to_csv(sep=" ", header=header, na_rep="", float_format="%6.2f")
+    with open(file_name, "w", encoding="utf-8") as file:
+        file.write(content.replace('"', ""))
+
+
 def download_nwis(
     gage_id_file="path_to_gauge_information.txt",
     start_date="2016-01-01",
     end_date="2023-06-30",
     param_code="00065",
+    max_workers=4,
+    station_store=None,
 ):
     # TODO: merge this func with get_nwis_stream_data
     with open(gage_id_file, "r", encoding="utf-8") as file:
@@ -157,30 +437,25 @@ def download_nwis(
     gage_ids = [line.split("\t")[1].strip() for line in content[1:] if line.strip()]
     # sites = gage_ids
 
-    for gage_id in gage_ids:
-        # get instantaneous values (iv)
-        df, md = nwis.get_iv(
-            sites=gage_id, start=start_date, end=end_date, parameterCd=param_code
-        )
+    # get instantaneous values (iv)
+    df = get_nwis_iv_batch(
+        gage_ids,
+        start=start_date,
+        end=end_date,
+        param_code=param_code,
+        max_workers=max_workers,
+    )
 
-        df.to_csv(
+    # 与单站点get_iv的结果一致：datetime为索引，保留site_no列
+    columns = ["site_no"] + [c for c in df.columns if c not in ("site_no", "datetime")]
+    for gage_id, df_site in df.groupby("site_no", sort=False):
+        _write_nwis_txt(
+            df_site.set_index("datetime")[columns],
             f"{str(gage_id)}.txt",
-            sep=" ",
             header=False,
-            na_rep="",
-            float_format="%6.2f",
         )
-
-        # 打开原文件，并读取所有内容
-        with open(f"{str(gage_id)}.txt", "r", encoding="utf-8") as file:
-            content = file.read()
-
-        # 使用replace方法去除所有的双引号
-        content_no_quotes = content.replace('"', "")
-
-        # 写入新的文件
-        with open(f"{str(gage_id)}.txt", "w", encoding="utf-8") as file:
-            file.write(content_no_quotes)
+    if station_store is not None:
+        _write_nwis_station_store(df, station_store)
 
 
 def get_nwis_stream_data(
@@ -192,12 +467,13 @@ def get_nwis_stream_data(
     ssl_check=True,
     param_code="All",
     standardlize=True,
+    station_store=None,
 ):
     """
     用来获取usgs相关流域的数据
 
     Args:
-        sites:站点id
+        sites:站点id，可以是多个站点的列表，此时分组并发获取，每个站点一个txt
         start:起始时间
         end:结束时间
         multi_index:多索引
@@ -207,6 +483,7 @@ def get_nwis_stream_data(
             00065代表水位
             出现其余数据类型，请参考USGS官网或nwis github
         standardlize:用于规范化存储txt
+        station_store:StationStore，同时写入该站点数据库，来源为"nwis_iv"
 
     Return:
         (type:DataFrame)
@@ -218,22 +495,39 @@ def get_nwis_stream_data(
         00065_cd: 同上
     """
 
-    df, md = nwis.get_iv(sites=sites, start=start, end=end, parameterCd=param_code)
-    df.to_csv(
-        save_dir + sites + ".txt", sep=" ", header=True, na_rep="", float_format="%6.2f"
-    )
+    if not isinstance(sites, str):
+        df = get_nwis_iv_batch(sites, start=start, end=end, param_code=param_code)
+        for site, df_site in df.groupby("site_no", sort=False):
+            df_site = df_site.set_index(["site_no", "datetime"])
+            if standardlize == True:
+                _write_nwis_txt(df_site, save_dir + site + ".txt", header=True)
+            else:
+                df_site.to_csv(
+                    save_dir + site + ".txt",
+                    sep=" ",
+                    header=True,
+                    na_rep="",
+                    float_format="%6.2f",
+                )
+        if station_store is not None:
+            _write_nwis_station_store(df, station_store)
+        return [df, None]
 
+    df, md = nwis.get_iv(sites=sites, start=start, end=end, parameterCd=param_code)
     if standardlize == True:
-        # 打开原文件，并读取所有内容
-        with open(save_dir + sites + ".txt", "r", encoding="utf-8") as file:
-            content = file.read()
-
-        # 使用replace方法去除所有的双引号
-        content_no_quotes = content.replace('"', "")
-
-        # 写入新的文件
-        with open(save_dir + sites + ".txt", "w", encoding="utf-8") as file:
-            file.write(content_no_quotes)
+        # 在内存中去除所有的双引号后一次写入
+        _write_nwis_txt(df, save_dir + sites + ".txt", header=True)
+    else:
+        df.to_csv(
+            save_dir + sites + ".txt",
+            sep=" ",
+            header=True,
+            na_rep="",
+            float_format="%6.2f",
+        )
+    if station_store is not None:
+        # 单站点时datetime为索引
+        _write_nwis_station_store(df.reset_index(), station_store)
     return [df, md]
 
 
@@ -281,12 +575,102 @@ def get_nwis_full_data(
     pass
 
 
+def _write_camels_format(
+    qobs: pd.DataFrame,
+    usgs_site_ids: list,
+    huc_of: dict,
+    save_dir: str,
+    unit: str = "cfs",
+    max_workers: int = 8,
+    consolidated: bool = False,
+) -> list:
+    """
+    Write streamflow into CAMELS-format files, one per site under its HUC02 folder.
+
+    Parameters
+    ----------
+    qobs
+        streamflow data -- index is date; columns are "USGS-" + gage id
+    usgs_site_ids
+        ids of USGS sites; sites missing in qobs are written as NaN
+    huc_of
+        a dict mapping gage id to its HUC02 id
+    save_dir
+        where we save streamflow data in files like CAMELS
+    unit
+        unit of streamflow, cms or cfs
+    max_workers
+        number of files written in parallel
+    consolidated
+        if True, also write all sites into one file save_dir/streamflow_qc.txt
+
+    Returns
+    -------
+    list
+        paths of the written site files, in the order of usgs_site_ids
+    """
+    camels_format_index = ["GAGE_ID", "Year", "Mnth", "Day", f"streamflow({unit})"]
+    dates = pd.DatetimeIndex(qobs.index)
+    n_dates = len(dates)
+    year, month, day = dates.year.values, dates.month.values, dates.day.values
+
+    # all sites in one 2-d array, missing sites stay NaN
+    flows = np.full((n_dates, len(usgs_site_ids)), np.nan)
+    columns = {col: i for i, col in enumerate(qobs.columns.values)}
+    for j, site_id in enumerate(usgs_site_ids):
+        i = columns.get("USGS-" + site_id)
+        if i is not None:
+            flows[:, j] = qobs.iloc[:, i].values
+
+    def write(j):
+        site_id = usgs_site_ids[j]
+        output_huc_dir = os.path.join(save_dir, huc_of[site_id])
+        os.makedirs(output_huc_dir, exist_ok=True)
+        output_file = os.path.join(output_huc_dir, site_id + "_streamflow_qc.txt")
+        pd.DataFrame(
+            {
+                camels_format_index[0]: np.full(n_dates, site_id),
+                camels_format_index[1]: year,
+                camels_format_index[2]: month,
+                camels_format_index[3]: day,
+                camels_format_index[4]: flows[:, j],
+            }
+        ).to_csv(output_file, header=True, index=False, sep=",", float_format="%.2f")
+        return output_file
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        output_files = list(executor.map(write, range(len(usgs_site_ids))))
+
+    if consolidated:
+        n_sites = len(usgs_site_ids)
+        pd.DataFrame(
+            {
+                camels_format_index[0]: np.repeat(np.asarray(usgs_site_ids), n_dates),
+                camels_format_index[1]: np.tile(year, n_sites),
+                camels_format_index[2]: np.tile(month, n_sites),
+                camels_format_index[3]: np.tile(day, n_sites),
+                camels_format_index[4]: flows.T.ravel(),
+            }
+        ).to_csv(
+            os.path.join(save_dir, "streamflow_qc.txt"),
+            header=True,
+            index=False,
+            sep=",",
+            float_format="%.2f",
+        )
+
+    return output_files
+
+
 def download_nwis_daily_flow(
     usgs_site_ids: list,
     date_tuple: tuple,
     gage_dict: dict,
     save_dir: str,
     unit: str = "cfs",
+    max_workers: int = 8,
+    consolidated: bool = False,
+    station_store=None,
 ) -> pd.DataFrame:
     """
     Download USGS flow data by HyRivers' pygeohydro tool.
@@ -304,6 +688,13 @@ def download_nwis_daily_flow(
         where we save streamflow data in files like CAMELS
     unit
         unit of streamflow, cms or cfs
+    max_workers
+        number of files written in parallel
+    consolidated
+        if True, also write all sites into one file save_dir/streamflow_qc.txt
+    station_store
+        a StationStore; if given, streamflow is also written to it under
+        source "nwis_dv", with station locations from gage_dict when it has them
 
     Returns
     -------
@@ -317,11 +708,6 @@ def download_nwis_daily_flow(
     # use round(2) because in both CAMELS and GAGES-II, data with cfs only have two float digits
     if unit == "cfs":
         qobs = (qobs * 35.314666212661).round(2)
-    dates = qobs.index
-    camels_format_index = ["GAGE_ID", "Year", "Mnth", "Day", f"streamflow({unit})"]
-    year_month_day = pd.DataFrame(
-        [[dt.year, dt.month, dt.day] for dt in dates], columns=camels_format_index[1:4]
-    )
     if "STAID" in gage_dict:
         gage_id_key = "STAID"
     elif "gauge_id" in gage_dict:
@@ -336,34 +722,44 @@ def download_nwis_daily_flow(
         huc02_key = "huc_02"
     else:
         raise NotImplementedError("No such huc02 id")
-    read_sites = [col[5:] for col in qobs.columns.values]
-    for site_id in usgs_site_ids:
-        if site_id not in read_sites:
-            df_flow = pd.DataFrame(
-                np.full(qobs.shape[0], np.nan), columns=camels_format_index[4:5]
-            )
-        else:
-            qobs_i = qobs["USGS-" + site_id]
-            df_flow = pd.DataFrame(qobs_i.values, columns=camels_format_index[4:5])
-        df_id = pd.DataFrame(
-            np.full(qobs.shape[0], site_id), columns=camels_format_index[:1]
-        )
-        new_data_df = pd.concat([df_id, year_month_day, df_flow], axis=1)
-        # output the result
-        i_basin = gage_dict[gage_id_key].values.tolist().index(site_id)
-        huc_id = gage_dict[huc02_key][i_basin]
-        output_huc_dir = os.path.join(save_dir, huc_id)
-        if not os.path.isdir(output_huc_dir):
-            os.makedirs(output_huc_dir)
-        output_file = os.path.join(output_huc_dir, site_id + "_streamflow_qc.txt")
-        if os.path.isfile(output_file):
-            os.remove(output_file)
-        new_data_df.to_csv(
-            output_file, header=True, index=False, sep=",", float_format="%.2f"
+    huc_of = dict(zip(list(gage_dict[gage_id_key]), list(gage_dict[huc02_key])))
+    _write_camels_format(
+        qobs,
+        usgs_site_ids,
+        huc_of,
+        save_dir,
+        unit=unit,
+        max_workers=max_workers,
+        consolidated=consolidated,
+    )
+    if station_store is not None:
+        _write_daily_flow_station_store(
+            qobs, gage_dict, gage_id_key, unit, station_store
         )
     return qobs
 
 
+def _write_daily_flow_station_store(qobs, gage_dict, gage_id_key, unit, station_store):
+    """Write pygeohydro daily flow (columns "USGS-" + gage id) to a StationStore"""
+    df = qobs.rename_axis("time").reset_index()
+    df = df.melt(id_vars="time", var_name="station", value_name="value")
+    df["station"] = df["station"].str.replace("USGS-", "", regex=False)
+    df["variable"] = f"streamflow_{unit}"
+    # GAGES-II and CAMELS name the location columns differently
+    lat_key = next((k for k in ["LAT_GAGE", "gauge_lat"] if k in gage_dict), None)
+    lon_key = next((k for k in ["LNG_GAGE", "gauge_lon"] if k in gage_dict), None)
+    locations = None
+    if lat_key is not None and lon_key is not None:
+        locations = pd.DataFrame(
+            {
+                "station": list(gage_dict[gage_id_key]),
+                "lat": list(gage_dict[lat_key]),
+                "lon": list(gage_dict[lon_key]),
+            }
+        )
+    station_store.write("nwis_dv", df.dropna(subset=["value"]), locations=locations)
+
+
 def _usgsflow_df_label(usgs_text: str) -> str:
     usgs_text = usgs_text.replace(",", "")
     if usgs_text == "Discharge":
@@ -374,54 +770,81 @@ def _usgsflow_df_label(usgs_text: str) -> str:
         return usgs_text
 
 
-def _process_usgs_response_text(file_name: str):
-    extractive_params = {}
-    with open(file_name, "r") as f:
-        lines = f.readlines()
-        i = 0
-        params = False
-        while "#" in lines[i]:
-            # TODO figure out getting height and discharge code efficently
-            the_split_line = lines[i].split()[1:]
-            if params:
-                print(the_split_line)
-                if len(the_split_line) < 2:
-                    params = False
-                else:
-                    extractive_params[
-                        the_split_line[0] + "_" + the_split_line[1]
-                    ] = _usgsflow_df_label(the_split_line[2])
-            if len(the_split_line) > 2 and the_split_line[0] == "TS":
-                params = True
-            i += 1
-        with open(file_name.split(".")[0] + "data.tsv", "w") as t:
-            t.write("".join(lines[i:]))
-        return file_name.split(".")[0] + "data.tsv", extractive_params
-
-
-def _create_csv_for_usgsflow(file_path: str, params_names: dict, site_number: str):
+def parse_usgs_rdb(lines, params_only=False):
     """
-    Function that creates the final version of the CSV files
+    Parse a USGS RDB (tab-delimited) response in memory.
 
     Parameters
     ----------
-    file_path : str
-        [description]
-    params_names : dict
-        [description]
-    site_number : str
-        [description]
+    lines : str or iterable of str
+        the whole response text, or its lines, e.g. ``response.iter_lines(decode_unicode=True)``
+    params_only : bool
+        if True, stop after the header and return only the parameter map
+
+    Returns
+    -------
+    tuple
+        (DataFrame, dict): data columns typed by the RDB format row ("n" columns
+        are float, others str), with a label column ("cfs", "height", ...) added
+        for every time series; and the map from "TSID_parameter" to its label
     """
-    df = pd.read_csv(file_path, sep="\t")
-    for key, value in params_names.items():
-        df[value] = df[key]
-    df.to_csv(f"{site_number}_flow_data.csv")
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    lines = iter(lines)
+
+    extractive_params = {}
+    params = False
+    columns = None
+    for line in lines:
+        if not line.startswith("#"):
+            columns = line.rstrip("\r\n").split("\t")
+            break
+        # the parameter table follows the "TS parameter Description" line in the header
+        the_split_line = line.split()[1:]
+        if params:
+            if len(the_split_line) < 2:
+                params = False
+            else:
+                extractive_params[
+                    the_split_line[0] + "_" + the_split_line[1]
+                ] = _usgsflow_df_label(the_split_line[2])
+        if len(the_split_line) > 2 and the_split_line[0] == "TS":
+            params = True
+    if params_only:
+        return None, extractive_params
+    if columns is None:
+        return pd.DataFrame(), extractive_params
+
+    # the row after the column names gives widths and types, e.g. 5s 15s 20d 14n
+    formats = next(lines, "").rstrip("\r\n").split("\t")
+    df = pd.read_csv(
+        io.StringIO("\n".join(lines)),
+        sep="\t",
+        header=None,
+        names=columns,
+        dtype=str,
+        keep_default_na=False,
+    )
+    for column, fmt in zip(columns, formats):
+        if fmt.endswith("n"):
+            df[column] = pd.to_numeric(df[column], errors="coerce")
+    for key, value in extractive_params.items():
+        if key in df.columns:
+            df[value] = df[key]
+    return df, extractive_params
 
 
 def download_usgs_data(
-    start_date: datetime, end_date: datetime, site_number: str
+    start_date: datetime,
+    end_date: datetime,
+    site_number: str,
+    session=None,
+    station_store=None,
 ) -> pd.DataFrame:
-    """This method could also be used to download usgs streamflow data"""
+    """
+    This method could also be used to download usgs streamflow data; with a
+    station_store, the data are also written to it under the source "usgs_iv"
+    """
     # TODO: to be merged with get_nwis_stream_data; may be useful when handling with hourly data
     base_url = (
         "https://nwis.waterdata.usgs.gov/usa/nwis/uv/?cb_00060=on&cb_00065&format=rdb&"
@@ -437,42 +860,141 @@ def download_usgs_data(
     )
     print("Getting request from USGS")
     print(full_url)
-    r = requests.get(full_url)
-    with open(f"{site_number}.txt", "w") as f:
-        f.write(r.text)
+    if session is None:
+        session = requests
+    with session.get(full_url, stream=True) as r:
+        r.raise_for_status()
+        df, params = parse_usgs_rdb(r.iter_lines(decode_unicode=True))
     print("Request finished")
-    response_data = _process_usgs_response_text(f"{site_number}.txt")
-    _create_csv_for_usgsflow(response_data[0], response_data[1], site_number)
-    return pd.read_csv(f"{site_number}_flow_data.csv")
+    if station_store is not None:
+        _write_usgs_station_store(df, params, station_store)
+    return df
+
+
+def _write_usgs_station_store(df, params, station_store):
+    """Write the labelled RDB columns ("cfs", "height", ...) to the store, in UTC"""
+    value_columns = sorted({v for v in params.values() if v in df.columns})
+    if len(df) == 0 or len(value_columns) == 0:
+        return
+    df = df.assign(datetime=usgs_datetime_to_utc(df["datetime"], df["tz_cd"]))
+    long_df = df.melt(
+        id_vars=["site_no", "datetime"],
+        value_vars=value_columns,
+        var_name="variable",
+        value_name="value",
+    ).rename(columns={"site_no": "station", "datetime": "time"})
+    station_store.write("usgs_iv", long_df.dropna(subset=["value"]))
+
+
+def download_usgs_data_batch(
+    start_date: datetime,
+    end_date: datetime,
+    site_numbers: list,
+    max_workers=4,
+    station_store=None,
+) -> dict:
+    """
+    Download usgs instantaneous data of many sites concurrently, parsing each response in memory.
 
+    Parameters
+    ----------
+    start_date : datetime
+        start date
+    end_date : datetime
+        end date
+    site_numbers : list
+        ids of USGS sites
+    max_workers : int
+        number of concurrent requests
+    station_store : StationStore, optional
+        also write the data to this store, under the source "usgs_iv"
 
-def _get_usgsflow_timezone_map():
+    Returns
+    -------
+    dict
+        site number -> DataFrame; failed sites are left out
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max_workers, pool_maxsize=max_workers
+    )
+    session.mount("https://", adapter)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                download_usgs_data,
+                start_date,
+                end_date,
+                site_number,
+                session,
+                station_store,
+            ): site_number
+            for site_number in site_numbers
+        }
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                print(f"{futures[future]} failed: {e}")
+    session.close()
+    return {site: results[site] for site in site_numbers if site in results}
+
+
+def _get_usgsflow_utc_offsets():
+    """UTC offsets in hours of the tz_cd codes used by USGS"""
     return {
-        "EST": "America/New_York",
-        "EDT": "America/New_York",
-        "CST": "America/Chicago",
-        "CDT": "America/Chicago",
-        "MDT": "America/Denver",
-        "MST": "America/Denver",
-        "PST": "America/Los_Angeles",
-        "PDT": "America/Los_Angeles",
+        "UTC": 0,
+        "EST": -5,
+        "EDT": -4,
+        "CST": -6,
+        "CDT": -5,
+        "MST": -7,
+        "MDT": -6,
+        "PST": -8,
+        "PDT": -7,
+        "AKST": -9,
+        "AKDT": -8,
+        "HST": -10,
     }
 
 
+def usgs_datetime_to_utc(datetimes: pd.Series, tz_cds: pd.Series) -> pd.Series:
+    """
+    Convert USGS local timestamps to UTC using the tz_cd of every row.
+
+    Each tz_cd is a fixed offset (EDT is UTC-4, EST is UTC-5, ...), so rows around
+    daylight-saving changes, where the same local hour occurs twice, are converted
+    unambiguously.
+
+    Parameters
+    ----------
+    datetimes : pd.Series
+        local timestamps formatted as "%Y-%m-%d %H:%M"
+    tz_cds : pd.Series
+        the tz_cd column, e.g. "EST" or "EDT"
+
+    Returns
+    -------
+    pd.Series
+        timestamps in UTC
+    """
+    offsets = tz_cds.map(_get_usgsflow_utc_offsets())
+    if offsets.isna().any():
+        raise ValueError(f"Unknown tz_cd: {set(tz_cds[offsets.isna()])}")
+    local = pd.to_datetime(datetimes, format="%Y-%m-%d %H:%M")
+    return (local - pd.to_timedelta(offsets.values, unit="h")).dt.tz_localize("UTC")
+
+
 def process_intermediate_csv(df: pd.DataFrame):
-    # Remove garbage first row
-    # TODO: check if more rows are garbage
-    df = df.iloc[1:]
-    time_zone = df["tz_cd"].iloc[0]
-    time_zone = _get_usgsflow_timezone_map()[time_zone]
-    old_timezone = pytz.timezone(time_zone)
-    new_timezone = pytz.timezone("UTC")
-    # This assumes timezones are consistent throughout the USGS stream (this should be true)
-    df["datetime"] = df["datetime"].map(
-        lambda x: old_timezone.localize(
-            datetime.strptime(x, "%Y-%m-%d %H:%M")
-        ).astimezone(new_timezone)
-    )
+    # Remove the RDB format row (e.g. "5s") if the data were read from a raw csv;
+    # a site without data in the period gives an empty frame
+    if len(df) > 0 and df["agency_cd"].astype(str).str.fullmatch(r"\d+s").iloc[0]:
+        df = df.iloc[1:]
+    df = df.copy()
+    # tz_cd may change within the series (EST/EDT), so convert row by row offsets
+    df["datetime"] = usgs_datetime_to_utc(df["datetime"], df["tz_cd"])
     df["cfs"] = pd.to_numeric(df["cfs"], errors="coerce")
     max_flow = df["cfs"].max()
     min_flow = df["cfs"].min()
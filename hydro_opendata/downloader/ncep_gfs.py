@@ -5,14 +5,22 @@
 
 数据说明: [https://www.ncei.noaa.gov/products/weather-climate-models/global-forecast](https://www.ncei.noaa.gov/products/weather-climate-models/global-forecast)
 
-- `search` - 返回符合搜索条件的dem数据下载地址列表
-- `download` - 将列表中的数据下载到本地
+- `get_gfs_from_ncep` - 从ncep官网下载一个预测时效的数据
+- `get_gfs_list_from_ncep` - 从ncep官网并发下载多个预测时效的数据
+- `get_gfs_from_aws` - 从aws下载数据
+- `get_gfs_subset` - 根据.idx索引按字节范围并发下载多个起报时次、预测时效中指定变量的GRIB2报文
 """
 
 
-from .downloader import download_sigletasking
+from .downloader import download_sigletasking, download_multitasking
 import os
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from tqdm import tqdm
 
 
 def get_gfs_from_ncep(
@@ -40,6 +48,20 @@ def get_gfs_from_ncep(
 
     """
 
+    url, file_name = _ncep_url(date, creation_time, forecast_time, bbox)
+
+    file_path = os.path.join(save_dir, file_name)
+    if os.path.exists(file_path) and not cover:
+        print(f"{file_name}已存在.")
+        return
+
+    if not os.path.exists(os.path.dirname(file_path)):
+        os.makedirs(os.path.dirname(file_path))
+
+    download_sigletasking(url, os.path.join(save_dir, file_name))
+
+
+def _ncep_url(date, creation_time, forecast_time, bbox):
     file_name_ = "gfsYYYYMMDD.tCCz.pgrb2.0p25.fFFF"
 
     url_ = f"https://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_0p25.pl?file=gfs.tCCz.pgrb2.0p25.fFFF&lev_10_m_above_ground=on&lev_2_m_above_ground=on&lev_entire_atmosphere=on&lev_entire_atmosphere_%5C%28considered_as_a_single_layer%5C%29=on&lev_surface=on&var_APCP=on&var_DSWRF=on&var_PWAT=on&var_RH=on&var_SPFH=on&var_TCDC=on&var_TMP=on&var_UGRD=on&var_VGRD=on&subregion=&leftlon={str(bbox[0])}&rightlon={str(bbox[2])}&toplat={str(bbox[3])}&bottomlat={str(bbox[1])}&dir=%2Fgfs.YYYYMMDD%2FCC%2Fatmos"
@@ -54,15 +76,44 @@ def get_gfs_from_ncep(
         .replace("FFF", str(forecast_time).zfill(3))
     )
 
-    file_path = os.path.join(save_dir, file_name)
-    if os.path.exists(file_path) and not cover:
-        print(f"{file_name}已存在.")
-        return
+    return url, file_name
 
-    if not os.path.exists(os.path.dirname(file_path)):
-        os.makedirs(os.path.dirname(file_path))
 
-    download_sigletasking(url, os.path.join(save_dir, file_name))
+def get_gfs_list_from_ncep(
+    date: str,
+    creation_time: str,
+    forecast_times=range(1, 121),
+    bbox=[115, 38, 136, 54],
+    save_dir=".",
+    cover=False,
+    max_workers=4,
+):
+    """
+    从ncep官网并发下载一个起报时次的多个预测时效的gfs数据
+
+    nomads对同一ip的访问频率有限制，max_workers不宜过大。
+
+    Args:
+        date (str): 下载日期，格式为：YYYYMMDD
+        creation_time (str): 数据创建时间，可以是00、06、12、18中的一个
+        forecast_times (list): 预测序列，范围1-384
+        bbox (list): 下载数据的矩形范围
+        save_dir (str): 存储文件夹
+        cover (bool): 若文件已存在，是否覆盖
+        max_workers (int): 并发下载数
+
+    Returns:
+        file_paths (list): 本地文件路径，下载失败的为None
+    """
+
+    jobs = []
+    for forecast_time in forecast_times:
+        url, file_name = _ncep_url(date, creation_time, forecast_time, bbox)
+        jobs.append((url, os.path.join(save_dir, file_name)))
+
+    return download_multitasking(
+        jobs, max_workers=max_workers, per_host=max_workers, cover=cover
+    )
 
 
 def get_gfs_from_aws(
@@ -116,6 +167,193 @@ def get_gfs_from_aws(
     subprocess.call(["aws", "s3", "cp", url, file_path])
 
 
+GFS_SUBSET_VARIABLES = [
+    "APCP:surface",
+    "DSWRF:surface",
+    "PWAT:entire atmosphere (considered as a single layer)",
+    "RH:2 m above ground",
+    "SPFH:2 m above ground",
+    "TCDC:entire atmosphere",
+    "TMP:2 m above ground",
+    "UGRD:10 m above ground",
+    "VGRD:10 m above ground",
+]
+
+
+def _parse_idx(text):
+    """
+    解析GRIB2的.idx索引文件
+
+    Args:
+        text (str): .idx文件内容，每行形如`1:0:d=2023010100:PRMSL:mean sea level:anl:`
+
+    Returns:
+        messages (list): (变量, 层次, 起始字节, 结束字节)列表，最后一条报文的结束字节为None
+    """
+
+    rows = [line.split(":") for line in text.splitlines() if line.strip()]
+    messages = []
+    for i, row in enumerate(rows):
+        start = int(row[1])
+        end = int(rows[i + 1][1]) - 1 if i + 1 < len(rows) else None
+        messages.append((row[3], row[4], start, end))
+    return messages
+
+
+def _select_ranges(messages, variables):
+    """
+    选出指定变量的报文，并合并相邻的字节范围
+
+    Args:
+        messages (list): `_parse_idx`的结果
+        variables (list): "变量:层次"列表，省略层次时选取该变量的全部层次
+
+    Returns:
+        ranges (list): (起始字节, 结束字节)列表
+    """
+
+    wanted = [v.split(":", 1) for v in variables]
+    ranges = []
+    for var, level, start, end in messages:
+        if not any(
+            var == w[0] and (len(w) == 1 or level == w[1]) for w in wanted
+        ):
+            continue
+        if len(ranges) > 0 and ranges[-1][1] is not None and ranges[-1][1] + 1 == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def _gfs_key(date, creation_time, forecast_time):
+    """返回gfs文件在存储桶中的相对路径"""
+
+    cc = creation_time.zfill(2)
+    fff = str(forecast_time).zfill(3)
+    if (date + cc) < "2021032212":
+        return f"gfs.{date}/{cc}/gfs.t{cc}z.pgrb2.0p25.f{fff}"
+    return f"gfs.{date}/{cc}/atmos/gfs.t{cc}z.pgrb2.0p25.f{fff}"
+
+
+def _fetch_gfs_subset(session, url, variables, file_path, bar, lock):
+    """按.idx索引下载一个GRIB2文件中指定变量的报文，返回写入的字节数"""
+
+    response = session.get(f"{url}.idx", timeout=60)
+    if response.status_code == 404:
+        print(f"{url}.idx 404 not found.")
+        return None
+    response.raise_for_status()
+
+    ranges = _select_ranges(_parse_idx(response.text), variables)
+    if len(ranges) == 0:
+        print(f"{url}中没有所需变量.")
+        return None
+
+    size = 0
+    with open(f"{file_path}.part", "wb") as f:
+        for start, end in ranges:
+            byte_range = f"bytes={start}-" if end is None else f"bytes={start}-{end}"
+            response = session.get(url, headers={"Range": byte_range}, timeout=60)
+            if response.status_code != 206:
+                raise Exception(f"服务器未按Range返回数据，状态码{response.status_code}")
+            f.write(response.content)
+            size += len(response.content)
+            with lock:
+                bar.update(len(response.content))
+    os.replace(f"{file_path}.part", file_path)
+
+    return size
+
+
+def get_gfs_subset(
+    start_date: str,
+    end_date: str,
+    creation_times=("00", "06", "12", "18"),
+    forecast_times=range(1, 121),
+    variables=None,
+    save_dir=".",
+    base_url="https://noaa-gfs-bdp-pds.s3.amazonaws.com",
+    cover=False,
+    max_workers=8,
+):
+    """
+    根据.idx索引，按字节范围并发下载多个起报时次、预测时效中指定变量的GRIB2报文
+
+    文件存储为save_dir/YYYYMMDD/CC/gfs.tCCz.pgrb2.0p25.fFFF，只包含所选报文，仍是合法的GRIB2文件。
+
+    aws链接: [https://registry.opendata.aws/noaa-gfs-bdp-pds/](https://registry.opendata.aws/noaa-gfs-bdp-pds/)
+
+    Args:
+        start_date (str): 起始日期，格式为：YYYYMMDD
+        end_date (str): 终止日期，格式为：YYYYMMDD
+        creation_times (list|tuple): 数据创建时间，00、06、12、18的子集
+        forecast_times (list): 预测序列，范围1-384
+        variables (list): "变量:层次"列表，如["TMP:2 m above ground", "APCP"]；默认为GFS_SUBSET_VARIABLES
+        save_dir (str): 存储文件夹
+        base_url (str): 数据源地址，需支持Range请求，目录结构与aws一致
+        cover (bool): 若文件已存在，是否覆盖
+        max_workers (int): 并发下载的文件数
+
+    Returns:
+        file_paths (list): 与(日期, 创建时间, 预测序列)顺序一致的本地文件路径，下载失败的为None
+    """
+
+    if end_date < start_date:
+        raise Exception("结束时间不能早于开始时间")
+
+    if variables is None:
+        variables = GFS_SUBSET_VARIABLES
+
+    jobs = []
+    for date in pd.date_range(start_date, end_date, freq="D").strftime("%Y%m%d"):
+        for creation_time in creation_times:
+            cc = creation_time.zfill(2)
+            cycle_dir = os.path.join(save_dir, date, cc)
+            os.makedirs(cycle_dir, exist_ok=True)
+            for forecast_time in forecast_times:
+                key = _gfs_key(date, cc, forecast_time)
+                jobs.append(
+                    (
+                        f"{base_url.rstrip('/')}/{key}",
+                        os.path.join(cycle_dir, os.path.basename(key)),
+                    )
+                )
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max_workers, pool_maxsize=max_workers
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    results = [None] * len(jobs)
+    lock = threading.Lock()
+    bar = tqdm(total=None, unit="B", unit_scale=True, desc=f"下载{len(jobs)}个gfs文件")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for i, (url, file_path) in enumerate(jobs):
+            if os.path.exists(file_path) and not cover:
+                results[i] = file_path
+                continue
+            futures[
+                executor.submit(
+                    _fetch_gfs_subset, session, url, variables, file_path, bar, lock
+                )
+            ] = i
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                if future.result() is not None:
+                    results[i] = jobs[i][1]
+            except Exception as e:
+                print(f"{jobs[i][0]}下载失败：{e}")
+    bar.close()
+    session.close()
+
+    return results
+
+
 def get_gfs_from_gee(
     date: str,
     creation_time: str,
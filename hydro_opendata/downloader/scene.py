@@ -0,0 +1,239 @@
+"""
+该模块用于下载Landsat、Sentinel等STAC搜索结果中的影像波段
+
+- `select_assets`按波段和云量筛选搜索结果中的数据文件
+- `download_scenes`并发下载或按aoi范围读取所选波段，每个波段完成后写入检查点，重复运行时跳过已完成的波段
+
+"""
+
+import os
+import json
+import hashlib
+import requests
+import rasterio
+import shapely
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .downloader import download_resumable
+from .dem import REMOTE_COG_OPTIONS, read_dem
+from ..utils import aoi_geometry
+
+CHECKPOINT = "_checkpoint.json"
+COG_MEDIA_TYPE = "image/tiff; application=geotiff; profile=cloud-optimized"
+
+
+def _asset_bands(key, asset):
+    """资产的键名及其eo:bands中的波段名、通用名，均转为小写"""
+
+    names = {key.lower()}
+    for band in asset.get("eo:bands", []):
+        for k in ["name", "common_name"]:
+            if k in band:
+                names.add(band[k].lower())
+    return names
+
+
+def select_assets(features, bands=None, max_cloud_cover=None, roles=("data",)):
+    """
+    按波段和云量筛选搜索结果中的数据文件
+
+    Args:
+        features (list): LandsatCatalog、SentinelCatalog等的搜索结果
+        bands (list): 波段，可为资产的键名或eo:bands中的name、common_name，如["red", "nir08"]；默认全部
+        max_cloud_cover (float): 最大云量（%），eo:cloud_cover超过该值的影像被排除；默认不筛选
+        roles (tuple): 资产的角色，默认只选择数据文件
+
+    Returns:
+        scenes (list): 每景影像为一个dict，包含id、datetime、cloud_cover、assets（波段 -> 链接）
+            及media_types（波段 -> 资产的type）；缺少任一所需波段的影像被排除
+    """
+
+    scenes = []
+    for feature in features:
+        properties = feature.get("properties", {})
+        cloud_cover = properties.get("eo:cloud_cover")
+        if (
+            max_cloud_cover is not None
+            and cloud_cover is not None
+            and cloud_cover > max_cloud_cover
+        ):
+            continue
+
+        assets, media_types = {}, {}
+        for key, asset in feature["assets"].items():
+            if roles is not None and not set(roles) & set(asset.get("roles", [])):
+                continue
+            if bands is None:
+                assets[key] = asset["href"]
+                media_types[key] = asset.get("type")
+                continue
+            names = _asset_bands(key, asset)
+            for band in bands:
+                if band.lower() in names and band not in assets:
+                    assets[band] = asset["href"]
+                    media_types[band] = asset.get("type")
+        if bands is not None and len(assets) < len(bands):
+            continue
+
+        scenes.append(
+            {
+                "id": feature["id"],
+                "datetime": properties.get("datetime"),
+                "cloud_cover": cloud_cover,
+                "assets": assets,
+                "media_types": media_types,
+            }
+        )
+
+    return scenes
+
+
+def _aoi_key(aoi):
+    """检查点中记录的aoi：EPSG:4326下的外包矩形及几何的sha256，不裁剪时为None"""
+
+    if aoi is None:
+        return None
+    geometry = aoi_geometry(aoi, "EPSG:4326")
+    return {
+        "bounds": [round(b, 9) for b in geometry.bounds],
+        "sha256": hashlib.sha256(shapely.to_wkb(geometry)).hexdigest(),
+    }
+
+
+def _read_checkpoint(scene_dir):
+    checkpoint = os.path.join(scene_dir, CHECKPOINT)
+    if not os.path.exists(checkpoint):
+        return None
+    with open(checkpoint, "r") as f:
+        return json.load(f)
+
+
+def _write_checkpoint(scene_dir, aoi_key, band_files):
+    """记录已完成的波段及其文件路径，以及下载时的aoi"""
+
+    checkpoint = _read_checkpoint(scene_dir) or {"aoi": aoi_key, "bands": {}}
+    checkpoint["bands"].update(band_files)
+    tmp_file = os.path.join(scene_dir, f"{CHECKPOINT}.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_file, os.path.join(scene_dir, CHECKPOINT))
+
+
+def _remove_band_file(file_name):
+    """删除波段文件及下载时的manifest、.part等附属文件"""
+
+    for path in [file_name, f"{file_name}.manifest", f"{file_name}.part"]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _is_cog(media_type):
+    """资产的type是否为Cloud-Optimized GeoTIFF，忽略大小写和空格"""
+
+    if media_type is None:
+        return False
+    return media_type.replace(" ", "").lower() == COG_MEDIA_TYPE.replace(" ", "")
+
+
+def _band_file(scene_dir, band, href, aoi):
+    if aoi is not None:
+        return os.path.join(scene_dir, f"{band}.tif")
+    name = requests.utils.urlparse(href).path.split("/")[-1]
+    return os.path.join(scene_dir, name)
+
+
+def _fetch_band(href, file_name, aoi, headers):
+    """下载一个波段；指定aoi时只读取COG中与aoi相交的块并裁剪"""
+
+    if aoi is None:
+        return download_resumable(href, file_name, headers=headers)
+
+    options = dict(REMOTE_COG_OPTIONS)
+    if headers:
+        options["GDAL_HTTP_HEADERS"] = "\r\n".join(
+            f"{k}: {v}" for k, v in headers.items()
+        )
+    with rasterio.Env(**options):
+        return read_dem([href], aoi, save_file=file_name)
+
+
+def download_scenes(
+    scenes, save_dir=".", aoi=None, max_workers=4, headers=None, cover=False
+):
+    """
+    并发下载select_assets选出的影像波段，每景影像保存在save_dir下以id命名的目录中
+
+    指定aoi时，type为COG的波段只通过range请求读取与aoi相交的块，裁剪后写为COG；
+    其它波段（如Sentinel-2的JP2）及未指定aoi时下载整个文件。
+    每个波段完成后写入所在影像的检查点，并记录aoi；重复运行时跳过已完成的波段，aoi不同时重新下载。
+
+    Args:
+        scenes (list): select_assets的结果
+        save_dir (str): 本地保存目录
+        aoi (GeoDataFrame|Geometry|list): 裁剪范围，可为矢量、shapely几何或[minx, miny, maxx, maxy]；默认不裁剪
+        max_workers (int): 并发下载的波段数
+        headers (dict): 请求头，如认证信息{"Authorization": "Bearer ..."}
+        cover (bool): 是否删除已下载的文件并重新下载
+
+    Returns:
+        files (dict): 影像id -> {波段: 本地文件路径}，有波段失败的影像为None
+    """
+
+    aoi_key = _aoi_key(aoi)
+    files = {}
+    jobs = []
+    for scene in scenes:
+        scene_dir = os.path.join(save_dir, scene["id"])
+        checkpoint = _read_checkpoint(scene_dir)
+        if checkpoint is not None and (cover or checkpoint.get("aoi") != aoi_key):
+            # 重新下载或aoi不同时，之前的结果作废
+            for file_name in checkpoint.get("bands", {}).values():
+                _remove_band_file(file_name)
+            os.remove(os.path.join(scene_dir, CHECKPOINT))
+            checkpoint = None
+        done = {} if checkpoint is None else checkpoint["bands"]
+
+        # 检查点中已有的波段不再下载
+        files[scene["id"]] = {
+            band: f for band, f in done.items() if band in scene["assets"]
+        }
+        for band, href in scene["assets"].items():
+            if band not in done:
+                # 非COG的波段无法按块读取，下载整个文件
+                band_aoi = aoi
+                if aoi is not None and not _is_cog(
+                    scene.get("media_types", {}).get(band)
+                ):
+                    band_aoi = None
+                file_name = _band_file(scene_dir, band, href, band_aoi)
+                if cover:
+                    _remove_band_file(file_name)
+                jobs.append((scene, band, href, file_name, band_aoi))
+    for scene, _, _, _, _ in jobs:
+        os.makedirs(os.path.join(save_dir, scene["id"]), exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_fetch_band, href, file_name, band_aoi, headers): (
+                scene,
+                band,
+                file_name,
+            )
+            for scene, band, href, file_name, band_aoi in jobs
+        }
+        for future in as_completed(futures):
+            scene, band, file_name = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"{scene['id']}的{band}波段下载失败：{e}")
+                files[scene["id"]] = None
+                continue
+            # 每个波段完成后即记录，影像未全部完成时重复运行也不再下载该波段
+            _write_checkpoint(
+                os.path.join(save_dir, scene["id"]), aoi_key, {band: file_name}
+            )
+            if files[scene["id"]] is not None:
+                files[scene["id"]][band] = file_name
+
+    return files
@@ -1,5 +1,9 @@
 import ujson
-from ..common import fs, ro
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import xarray as xr
+from ..common import fs, ro, minio_paras
 import kerchunk.hdf
 from kerchunk.combine import MultiZarrToZarr
 import kerchunk.netCDF3
@@ -112,6 +116,301 @@ class NC3Processor:
             f.write(ujson.dumps(d).encode())
 
 
+# GFSReader中的变量缩写 -> (eccodes shortName对应的层次类型, 变量全名)
+GFS_GRIB_VARIABLES = {
+    "dswrf": ("surface", "downward_shortwave_radiation_flux"),
+    "pwat": ("atmosphereSingleLayer", "precipitable_water_entire_atmosphere"),
+    "2r": ("heightAboveGround", "relative_humidity_2m_above_ground"),
+    "2sh": ("heightAboveGround", "specific_humidity_2m_above_ground"),
+    "2t": ("heightAboveGround", "temperature_2m_above_ground"),
+    "tcc": ("atmosphere", "total_cloud_cover_entire_atmosphere"),
+    "tp": ("surface", "total_precipitation_surface"),
+    "10u": ("heightAboveGround", "u_component_of_wind_10m_above_ground"),
+    "10v": ("heightAboveGround", "v_component_of_wind_10m_above_ground"),
+}
+
+
+def _message_variable(refs):
+    """返回单条GRIB报文引用中的数据变量名及其属性"""
+    for key, value in refs.items():
+        if key.endswith("/.zattrs"):
+            attrs = ujson.loads(value)
+            if "GRIB_shortName" in attrs:
+                return key[: -len("/.zattrs")], attrs
+    return None, None
+
+
+def _group_messages(messages, short_names):
+    """
+    将一个文件中各报文的引用按变量缩写分组
+
+    同一变量在一个文件中有多条报文时（如tp的时段累积与起报累积），只保留第一条，即GFS中的时段累积。
+
+    Args:
+        messages (list): scan_grib的结果，每条报文一个引用
+        short_names (list): 变量缩写
+
+    Returns:
+        groups (dict): 变量缩写 -> 报文引用
+    """
+
+    groups = {}
+    for message in messages:
+        refs = message["refs"]
+        name, attrs = _message_variable(refs)
+        if name is None:
+            continue
+        short_name = attrs["GRIB_shortName"]
+        if short_name not in short_names or short_name in groups:
+            continue
+        if attrs.get("GRIB_typeOfLevel") != GFS_GRIB_VARIABLES[short_name][0]:
+            continue
+
+        # 预见期由valid_time与time计算，去掉各报文不同的step坐标
+        refs = {k: v for k, v in refs.items() if not k.startswith("step/")}
+        coordinates = attrs.get("coordinates", "").split()
+        attrs["coordinates"] = " ".join(c for c in coordinates if c != "step")
+        refs[f"{name}/.zattrs"] = ujson.dumps(attrs)
+        groups[short_name] = {**message, "refs": refs}
+    return groups
+
+
+def _rename_variable(refs, name, new_name):
+    """将引用中的变量name重命名为new_name"""
+    renamed = {}
+    for key, value in refs.items():
+        if key.startswith(f"{name}/"):
+            key = f"{new_name}/{key[len(name) + 1:]}"
+        renamed[key] = value
+    return renamed
+
+
+def _update_gfs_paras(paras, short_name, creation_date, bbox):
+    """
+    将新处理的起报日期合并进gfs.json中该变量的最后一段
+
+    Args:
+        paras (dict): gfs.json内容，变量缩写 -> [{"start", "end", "bbox"}, ...]
+        short_name (str): 变量缩写
+        creation_date (datetime64): 起报日期
+        bbox (list): 数据的四至范围
+
+    Returns:
+        paras (dict): 更新后的内容
+    """
+
+    date = str(np.datetime64(creation_date, "D"))
+    segments = paras.setdefault(short_name, [])
+    if len(segments) == 0:
+        segments.append({"start": date, "end": date, "bbox": bbox})
+        return paras
+
+    last = segments[-1]
+    if date > last["end"]:
+        last["end"] = date
+    if date < last["start"] and (len(segments) == 1 or date > segments[-2]["end"]):
+        last["start"] = date
+    return paras
+
+
+class GribProcessor:
+    """
+    适用于gfs等GRIB2格式数据。
+
+    将minio中按get_gfs_subset目录结构（YYYYMMDD/CC/gfs.tCCz.pgrb2.0p25.fFFF）存储的GRIB2文件生成kerchunk索引，
+    按起报时次、变量合并为GFSReader读取的{dataset}/gfs/{short_name}/Y/M/D/gfsYMD.tCCz.0p25.json，
+    并增量更新gfs.json中的时间范围。
+
+    Attributes:
+
+    Method:
+        scan(grib_paths): 并发扫描多个GRIB2文件，返回每个文件各报文的引用
+        cycle_to_zarr(grib_paths, creation_date, creation_time): 合并一个起报时次的多个预测时效
+        multi_cycles_to_zarr(grib_dir): 处理目录下的全部起报时次并更新gfs.json
+    """
+
+    def __init__(self, dataset="wis", short_names=None, max_workers=8):
+        """
+        Args:
+            dataset (str): wis或camels
+            short_names (list): 需处理的变量缩写，默认为全部
+            max_workers (int): 并发扫描的文件数
+        """
+
+        if dataset != "wis" and dataset != "camels":
+            raise Exception("dataset参数错误")
+
+        self._prefix = os.path.join(
+            minio_paras["bucket_name"],
+            "geodata" if dataset == "wis" else "camdata",
+            "gfs",
+        )
+        if short_names is None:
+            short_names = list(GFS_GRIB_VARIABLES.keys())
+        self._short_names = short_names
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+
+    def _scan_file(self, grib_path):
+        from kerchunk.grib2 import scan_grib
+
+        try:
+            return scan_grib(
+                f"s3://{grib_path}",
+                storage_options=ro,
+                filter={"shortName": set(self._short_names)},
+            )
+        except Exception:
+            print(grib_path, "未生成！")
+            return []
+
+    def scan(self, grib_paths):
+        """
+        并发扫描多个GRIB2文件，每个文件只读取一次
+
+        Args:
+            grib_paths (list): minio中的GRIB2文件路径
+
+        Returns:
+            messages (list): 与grib_paths顺序一致，每个文件各报文的引用
+        """
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            return list(executor.map(self._scan_file, grib_paths))
+
+    def _bbox(self, refs):
+        ds = xr.open_dataset(
+            "reference://",
+            engine="zarr",
+            backend_kwargs={
+                "consolidated": False,
+                "storage_options": {
+                    "fo": refs,
+                    "remote_protocol": "s3",
+                    "remote_options": ro,
+                },
+            },
+        )
+        return [
+            float(ds["longitude"].min()),
+            float(ds["latitude"].min()),
+            float(ds["longitude"].max()),
+            float(ds["latitude"].max()),
+        ]
+
+    def cycle_to_zarr(self, grib_paths, creation_date, creation_time, messages=None):
+        """
+        将一个起报时次的多个预测时效按变量合并，写入GFSReader读取的索引文件
+
+        Args:
+            grib_paths (list): 该起报时次各预测时效的GRIB2文件路径
+            creation_date (datetime64): 起报日期
+            creation_time (str): 起报时间，00、06、12、18之一
+            messages (list): scan的结果，为None时重新扫描
+
+        Returns:
+            bboxes (dict): 变量缩写 -> 四至范围，只包含成功写入的变量
+        """
+
+        if messages is None:
+            messages = self.scan(grib_paths)
+
+        groups = {short_name: [] for short_name in self._short_names}
+        for file_messages in messages:
+            for short_name, message in _group_messages(
+                file_messages, self._short_names
+            ).items():
+                groups[short_name].append(message)
+
+        date = np.datetime64(creation_date, "D").astype("object")
+        year, month, day = (
+            str(date.year),
+            str(date.month).zfill(2),
+            str(date.day).zfill(2),
+        )
+
+        bboxes = {}
+        for short_name, group in groups.items():
+            if len(group) == 0:
+                continue
+
+            name, _ = _message_variable(group[0]["refs"])
+            level = GFS_GRIB_VARIABLES[short_name][0]
+            mzz = MultiZarrToZarr(
+                group,
+                remote_protocol="s3",
+                remote_options=ro,
+                concat_dims=["valid_time"],
+                identical_dims=["latitude", "longitude", "time", level],
+            )
+            d = mzz.translate()
+            d["refs"] = _rename_variable(
+                d["refs"], name, GFS_GRIB_VARIABLES[short_name][1]
+            )
+
+            json_path = os.path.join(
+                self._prefix,
+                short_name,
+                year,
+                month,
+                day,
+                f"gfs{year}{month}{day}.t{creation_time}z.0p25.json",
+            )
+            with fs.open(json_path, "wb") as f:
+                f.write(ujson.dumps(d).encode())
+            bboxes[short_name] = self._bbox(d)
+
+        return bboxes
+
+    def multi_cycles_to_zarr(self, grib_dir):
+        """
+        处理目录下按YYYYMMDD/CC/存放的全部起报时次，并增量更新gfs.json
+
+        所有文件先一起并发扫描，再逐个起报时次合并，gfs.json只读写一次。
+
+        Args:
+            grib_dir (str): minio中的GRIB2根目录
+
+        Returns:
+            cycles (list): 已处理的(起报日期, 起报时间)
+        """
+
+        grib_paths = sorted(fs.glob(f"{grib_dir}/*/*/gfs.t*z.pgrb2.0p25.f*"))
+        grib_paths = [p for p in grib_paths if not p.endswith(".idx")]
+
+        cycles = {}
+        for grib_path in grib_paths:
+            date, creation_time = grib_path.split("/")[-3:-1]
+            cycles.setdefault((date, creation_time), []).append(grib_path)
+
+        messages = dict(zip(grib_paths, self.scan(grib_paths)))
+
+        updates = []
+        for (date, creation_time), paths in cycles.items():
+            creation_date = np.datetime64(f"{date[:4]}-{date[4:6]}-{date[6:]}")
+            bboxes = self.cycle_to_zarr(
+                paths,
+                creation_date,
+                creation_time,
+                messages=[messages[p] for p in paths],
+            )
+            updates.append((creation_date, bboxes))
+
+        with self._lock:
+            paras_path = os.path.join(self._prefix, "gfs.json")
+            paras = {}
+            if fs.exists(paras_path):
+                with fs.open(paras_path) as f:
+                    paras = ujson.load(f)
+            for creation_date, bboxes in updates:
+                for short_name, bbox in bboxes.items():
+                    _update_gfs_paras(paras, short_name, creation_date, bbox)
+            with fs.open(paras_path, "wb") as f:
+                f.write(ujson.dumps(paras).encode())
+
+        return list(cycles.keys())
+
+
 def geojson_to_shp(input_geojson, output_folder=None, keep_folder=True):
     """Trans geojson to shp and zip it, return the path of zip file"""
     gdf = gpd.read_file(input_geojson)
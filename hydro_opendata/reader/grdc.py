@@ -9,15 +9,23 @@ Copyright (c) 2023-2024 Wenyu Ouyang. All rights reserved.
 """
 # Global Runoff Data Centre module from ewatercycle: https://github.com/eWaterCycle/ewatercycle/blob/main/src/ewatercycle/observation/grdc.py
 import datetime
+import io
 import logging
 import os
+import threading
+import weakref
 from pathlib import Path
 from typing import Dict, Optional, Tuple, Union
 from dateutil.parser import parse
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import xarray as xr
 
-from hydro_opendata.downloader.hydrostation import catalogue_grdc
+from concurrent.futures import ProcessPoolExecutor
+
+from hydro_opendata.downloader.hydrostation import grdc_station_index
 
 logger = logging.getLogger(__name__)
 
@@ -179,42 +187,42 @@ def read_grdc_daily_data(
 
 
 def _grdc_read(grdc_station_path, start, end, column):
-    with grdc_station_path.open("r", encoding="cp1252", errors="ignore") as file:
+    with grdc_station_path.open("rb") as file:
         data = file.read()
 
-    metadata = _grdc_metadata_reader(grdc_station_path, data)
+    # Split the bytes once: metadata lines up to "# DATA", then the data table
+    data_line = data.find(b"\n# DATA")
+    if data_line == -1:
+        header, body = b"", data
+    else:
+        header = data[: data_line + 1]
+        body = data[data.find(b"\n", data_line + 1) + 1 :]
 
-    all_lines = data.split("\n")
-    header = next(
-        (i + 1 for i, line in enumerate(all_lines) if line.startswith("# DATA")),
-        0,
+    metadata = _grdc_metadata_reader(
+        grdc_station_path, header.decode("cp1252", errors="ignore")
     )
-    # Import GRDC data into dataframe and modify dataframe format
-    grdc_data = pd.read_csv(
-        grdc_station_path,
-        encoding="cp1252",
-        skiprows=header,
-        delimiter=";",
-        parse_dates=["YYYY-MM-DD"],
-        na_values="-999",
+
+    # Parse the data straight from the buffer, only the date and value columns
+    grdc_data = pa_csv.read_csv(
+        io.BytesIO(body),
+        parse_options=pa_csv.ParseOptions(delimiter=";"),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=["YYYY-MM-DD", " Value"],
+            column_types={"YYYY-MM-DD": pa.date32(), " Value": pa.float64()},
+        ),
     )
+    values = grdc_data.column(" Value").to_numpy()
     grdc_station_df = pd.DataFrame(
-        {column: grdc_data[" Value"].array},
-        index=grdc_data["YYYY-MM-DD"].array,
-    )
-    grdc_station_df.index.rename("time", inplace=True)
-
-    # Create a continuous date range based on the given start and end dates
-    full_date_range = pd.date_range(start=start, end=end)
-    full_df = pd.DataFrame(index=full_date_range)
-    full_df.index.rename("time", inplace=True)
-
-    # Merge the two dataframes, so the dates without data will have NaN values
-    merged_df = full_df.merge(
-        grdc_station_df, left_index=True, right_index=True, how="left"
+        {column: np.where(values == -999, np.nan, values)},
+        index=pd.DatetimeIndex(
+            grdc_data.column("YYYY-MM-DD").to_numpy().astype("datetime64[ns]")
+        ),
     )
+    grdc_station_df = grdc_station_df[~grdc_station_df.index.duplicated()]
 
-    return metadata, merged_df
+    # Reindex to a continuous date range, so the dates without data will have NaN values
+    full_date_range = pd.date_range(start=start, end=end, name="time")
+    return metadata, grdc_station_df.reindex(full_date_range)
 
 
 def _grdc_metadata_reader(grdc_station_path, all_lines):
@@ -358,23 +366,74 @@ def _log_metadata(metadata):
     logger.info("%s", message)
 
 
-def dailygrdc2netcdf(start_date, end_date, data_dir=None, station_ids=None):
+def _read_station_values(args):
+    """Read one station over a date range for the process pool; NaN if it fails."""
+    station_path, start, end = args
+    try:
+        _, df = _grdc_read(Path(station_path), start, end, "streamflow")
+        return df["streamflow"].to_numpy()
+    except Exception as e:
+        print(f"Error reading data for station {station_path}: {e}")
+        return None
+
+
+def _open_grdc_store(store_file):
+    """Open an existing netcdf or zarr store of dailygrdc2netcdf, None if absent."""
+    if not os.path.exists(store_file):
+        return None
+    if store_file.endswith(".zarr"):
+        return xr.open_zarr(store_file)
+    return xr.open_dataset(store_file)
+
+
+def dailygrdc2netcdf(
+    start_date,
+    end_date,
+    data_dir=None,
+    station_ids=None,
+    max_workers=None,
+    incremental=True,
+    store_format="netcdf",
+    station_store=None,
+):
     """
+    Convert GRDC daily files into one (time, station) dataset.
+
+    Stations are read in a process pool and written in place into a preallocated
+    array. In incremental mode an existing store is extended: only stations it
+    lacks are read in full, and existing stations are read only for the dates
+    outside its time range.
+
     Parameters
     ----------
-    start_date : _type_
+    start_date : str
         a startDate provided in YYYY-MM-DD
-    end_date : _type_
+    end_date : str
         a endDate provided in YYYY-MM-DD
+    data_dir : str
+        directory of the *_Q_Day.Cmd.txt files, the store is written here too
+    station_ids : list, optional
+        stations to convert, by default all files in data_dir
+    max_workers : int, optional
+        number of processes, by default the number of CPUs
+    incremental : bool
+        if True, extend an existing store instead of rebuilding it
+    store_format : str
+        "netcdf" (grdc_daily_data.nc) or "zarr" (grdc_daily_data.zarr)
+    station_store : StationStore, optional
+        also write the converted stations to this store under source "grdc"
+
+    Returns
+    -------
+    str
+        path of the store
     """
-    nc_file = os.path.join(data_dir, "grdc_daily_data.nc")
-    if os.path.exists(nc_file):
-        return
-
-    catalogue = catalogue_grdc(data_dir)
-    # Create empty lists to store data and metadata
-    data_list = []
-    meta_list = []
+    if store_format == "zarr":
+        store_file = os.path.join(data_dir, "grdc_daily_data.zarr")
+    elif store_format == "netcdf":
+        store_file = os.path.join(data_dir, "grdc_daily_data.nc")
+    else:
+        raise ValueError("store_format should be netcdf or zarr")
 
     if station_ids is None:
         # Filter the catalogue based on the provided station IDs
@@ -385,80 +444,234 @@ def dailygrdc2netcdf(start_date, end_date, data_dir=None, station_ids=None):
             for fname in filenames
             if fname.endswith("_Q_Day.Cmd.txt")
         ]
-    catalogue = catalogue[catalogue["grdc_no"].isin(station_ids)]
-
-    # Loop over each station in the catalogue
-    for station_id in catalogue["grdc_no"]:
-        try:
-            st = datetime.datetime.strptime(start_date, "%Y-%m-%d").strftime(
-                "%Y-%m-%dT%H:%M:%SZ"
-            )
-            et = datetime.datetime.strptime(end_date, "%Y-%m-%d").strftime(
-                "%Y-%m-%dT%H:%M:%SZ"
-            )
-            df, meta = read_grdc_daily_data(str(station_id), st, et, data_dir)
-        except Exception as e:
-            print(f"Error reading data for station {station_id}: {e}")
-            # Create an empty DataFrame with the same structure
-            df = pd.DataFrame(
-                columns=["streamflow"],
-                index=pd.date_range(start=start_date, end=end_date),
-            )
-            df["streamflow"] = float("nan")
-            meta = {
-                "grdc_file_name": "",
-                "id_from_grdc": station_id,
-                "river_name": "",
-                "station_name": "",
-                "country_code": "",
-                "grdc_latitude_in_arc_degree": float("nan"),
-                "grdc_longitude_in_arc_degree": float("nan"),
-                "grdc_catchment_area_in_km2": float("nan"),
-                "altitude_masl": float("nan"),
-                "dataSetContent": "",
-                "units": "m³/s",
-                "time_series": "",
-                "no_of_years": 0,
-                "last_update": "",
-                "nrMeasurements": "NA",
-                "UserStartTime": start_date,
-                "UserEndTime": end_date,
-                "nrMissingData": 0,
-            }
-
-        # Convert the DataFrame to an xarray DataArray and append to the list
-        # da = xr.DataArray(
-        #     df["streamflow"].values,
-        #     coords=[df.index, [station_id]],
-        #     dims=["time", "station"],
-        # )
-        coords_dict = {"time": df.index, "station": [station_id]}
-        da = xr.DataArray(
-            data=df["streamflow"].values.reshape(-1, 1),
-            coords=coords_dict,
-            dims=["time", "station"],
-            name="streamflow",
-            attrs={"units": meta.get("units", "unknown")},
-        )
-        data_list.append(da)
+    catalogue = grdc_station_index(data_dir)
+    station_ids = sorted(
+        set(int(i) for i in station_ids).intersection(catalogue.index)
+    )
 
-        # Append metadata
-        meta_list.append(meta)
+    requested_time = pd.date_range(start=start_date, end=end_date, name="time")
+    existing = _open_grdc_store(store_file) if incremental else None
+    if existing is None:
+        old_stations, old_time = [], requested_time[:0]
+    else:
+        old_stations = existing["station"].values.tolist()
+        old_time = pd.DatetimeIndex(existing["time"].values)
+
+    new_stations = [i for i in station_ids if i not in set(old_stations)]
+    time = requested_time.union(old_time)
+    time = pd.date_range(start=time[0], end=time[-1], name="time")
+    if len(new_stations) == 0 and len(time) == len(old_time):
+        print("All stations and dates are already in the store.")
+        return store_file
+    stations = old_stations + new_stations
+
+    # Preallocate the whole (time, station) array and copy in the existing block
+    data = np.full((len(time), len(stations)), np.nan)
+    old_rows = time.get_indexer(old_time)
+    if existing is not None:
+        data[old_rows, : len(old_stations)] = existing["streamflow"].values
+        existing.close()
+
+    # New stations are read over the whole time axis, existing ones only when it grew
+    jobs = [(j, time[0], time[-1]) for j in range(len(old_stations), len(stations))]
+    missing_rows = np.setdiff1d(np.arange(len(time)), old_rows)
+    if len(old_time) > 0 and len(missing_rows) > 0:
+        jobs += [
+            (j, time[missing_rows[0]], time[missing_rows[-1]])
+            for j in range(len(old_stations))
+        ]
 
-    # Concatenate all DataArrays along the 'station' dimension
-    ds = xr.concat(data_list, dim="station")
+    args = [
+        (
+            os.path.join(data_dir, f"{stations[j]}_Q_Day.Cmd.txt"),
+            start.date(),
+            end.date(),
+        )
+        for j, start, end in jobs
+    ]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            _read_station_values, args, chunksize=max(1, len(args) // 64)
+        )
+        for (j, start, end), values in zip(jobs, results):
+            if values is None:
+                continue
+            rows = slice(time.get_loc(start), time.get_loc(end) + 1)
+            if j < len(old_stations):
+                # keep the values already in the store
+                column = data[rows, j]
+                fill = np.isin(np.arange(rows.start, rows.stop), missing_rows)
+                column[fill] = values[fill]
+            else:
+                data[rows, j] = values
+
+    ds = xr.Dataset(
+        {
+            "streamflow": xr.DataArray(
+                data,
+                coords={"time": time, "station": stations},
+                dims=["time", "station"],
+                attrs={"units": "m³/s"},
+            )
+        }
+    )
 
     # Assign attributes
     ds.attrs["description"] = "Daily river discharge"
     ds.station.attrs["description"] = "GRDC station number"
 
-    # Write the xarray Dataset to a NetCDF file
-    ds.to_netcdf(nc_file)
+    # Handles kept open by GRDCDataHandler would block replacing the store on Windows
+    _release_store(store_file)
+
+    # One chunk per station, so reading a station touches a single chunk
+    if store_format == "zarr":
+        ds = ds.chunk({"time": -1, "station": 1})
+        ds["streamflow"].encoding["chunks"] = (len(time), 1)
+        if len(old_stations) > 0 and len(time) == len(old_time):
+            # only new stations, append them to the store
+            ds.isel(station=slice(len(old_stations), None)).to_zarr(
+                store_file, append_dim="station"
+            )
+        else:
+            ds.to_zarr(store_file, mode="w")
+    else:
+        # Write the xarray Dataset to a NetCDF file, replacing the old one at the end
+        ds.to_netcdf(
+            f"{store_file}.tmp",
+            encoding={"streamflow": {"chunksizes": (len(time), 1)}},
+        )
+        os.replace(f"{store_file}.tmp", store_file)
+
+    if station_store is not None:
+        # only the stations read in this run, the others are already in the store
+        columns = sorted({j for j, _, _ in jobs})
+        _write_station_store(station_store, data, time, stations, columns, catalogue)
+
+    print(f"{store_file} created successfully!")
+    return store_file
+
+
+def _write_station_store(station_store, data, time, stations, columns, catalogue):
+    """Write the given station columns of the converted array to a StationStore."""
+    values = data[:, columns]
+    rows, cols = np.nonzero(~np.isnan(values))
+    ids = np.asarray(stations)[columns]
+    df = pd.DataFrame(
+        {
+            "station": ids[cols],
+            "time": time.values[rows],
+            "variable": "streamflow",
+            "value": values[rows, cols],
+        }
+    )
+    locations = pd.DataFrame(
+        {
+            "station": ids,
+            "lat": catalogue["lat"].reindex(ids).to_numpy(),
+            "lon": catalogue["long"].reindex(ids).to_numpy(),
+        }
+    )
+    station_store.write("grdc", df, locations=locations)
+
+
+# live GRDCDataHandler instances, so a store can be released before it is rewritten
+_handlers = weakref.WeakSet()
+_handlers_lock = threading.Lock()
+
 
-    print("NetCDF file created successfully!")
+def _release_store(store_file):
+    """Close the handles of a store cached by any GRDCDataHandler of this process."""
+    with _handlers_lock:
+        handlers = list(_handlers)
+    for handler in handlers:
+        handler.release(store_file)
 
 
 class GRDCDataHandler:
+    """
+    Serve station/time queries from the store of dailygrdc2netcdf.
+
+    The store is opened once and kept open across calls together with an index of
+    its stations; it is reopened only when the file changes. A list of station ids
+    is served with one read. dailygrdc2netcdf releases the cached handle before it
+    rewrites the store.
+    """
+
+    def __init__(self):
+        # absolute store path -> (modification time, open dataset, station index)
+        self._stores = {}
+        self._lock = threading.Lock()
+        with _handlers_lock:
+            _handlers.add(self)
+
+    def _open(self, nc_file):
+        mtime = os.stat(nc_file).st_mtime_ns
+        nc_file = os.path.abspath(nc_file)
+        with self._lock:
+            cached = self._stores.get(nc_file)
+            if cached is not None and cached[0] == mtime:
+                return cached[1], cached[2]
+            if cached is not None:
+                cached[1].close()
+
+            if nc_file.endswith(".zarr"):
+                ds = xr.open_zarr(nc_file)
+            else:
+                ds = xr.open_dataset(nc_file, chunks={})
+            stations = pd.Index(ds["station"].values)
+            self._stores[nc_file] = (mtime, ds, stations)
+            return ds, stations
+
+    def release(self, nc_file):
+        """Close the cached handle of one store, it is reopened on the next read."""
+        with self._lock:
+            cached = self._stores.pop(os.path.abspath(nc_file), None)
+        if cached is not None:
+            cached[1].close()
+
+    def close(self):
+        with self._lock:
+            for _, ds, _ in self._stores.values():
+                ds.close()
+            self._stores.clear()
+
+    def read(self, nc_file, station_ids, start_time, end_time):
+        """
+        Read one or many stations over a time range.
+
+        Parameters
+        ----------
+        nc_file : str
+            path of the netcdf or zarr store
+        station_ids : str, int or list
+            one station id, or a list of them for a batched read
+        start_time : str
+            start date, e.g. "1980-01-01"
+        end_time : str
+            end date
+
+        Returns
+        -------
+        xr.Dataset
+            the selected data; the station dimension is dropped for a single id
+        """
+        ds, stations = self._open(nc_file)
+        single = isinstance(station_ids, (str, int, np.integer))
+        ids = [int(station_ids)] if single else [int(i) for i in station_ids]
+        positions = stations.get_indexer(ids)
+        if (positions < 0).any():
+            raise KeyError(f"Stations not in {nc_file}: {np.array(ids)[positions < 0]}")
+
+        # read the stations in store order, then restore the requested order
+        order = np.argsort(positions)
+        data = (
+            ds.isel(station=positions[order])
+            .sel(time=slice(start_time, end_time))
+            .load()
+        )
+        data = data.isel(station=np.argsort(order))
+        return data.isel(station=0) if single else data
+
     def handle(self, configuration):
         aoi_param = configuration["aoi"].aoi_param
         start_time = aoi_param["start_time"]
@@ -466,8 +679,7 @@ class GRDCDataHandler:
         station_id = aoi_param["station_id"]
         # Based on configuration, read and handle GRDC data specifically
         nc_file = configuration["path"]
-        if not os.path.isfile(nc_file):
+        if not os.path.exists(nc_file):
             dailygrdc2netcdf(start_time, end_time, data_dir=os.path.dirname(nc_file))
-        ds = xr.open_dataset(nc_file)
-        # choose data for given basin
-        return ds.sel(station=int(station_id)).sel(time=slice(start_time, end_time))
+        # choose data for given basin(s)
+        return self.read(nc_file, station_id, start_time, end_time)
@@ -6,6 +6,7 @@ import calendar
 import dask
 import json
 import geopandas as gpd
+from concurrent.futures import ThreadPoolExecutor
 
 from ..common import minio_paras, fs, ro
 from ..utils import regen_box, creatspinc
@@ -821,15 +822,17 @@ class GPMReader:
 
 class GFSReader:
     """
-    用于从minio中读取gpm数据
+    用于从minio中读取gfs数据
 
     Attributes:
         variables (dict): 变量名称及缩写
 
     Methods:
-        open_dataset(data_variables, creation_date, creation_time, bbox): 从minio中读取gfs数据
-        from_shp(data_variables, creation_date, creation_time, shp): 通过已有的矢量数据范围从minio服务器读取gfs数据
-        from_aoi(data_variables, creation_date, creation_time, aoi): 用过已有的GeoPandas.GeoDataFrame对象从minio服务器读取gfs数据
+        open_dataset(creation_date, creation_time, dataset, bbox): 从minio中读取gfs数据
+        open_cycles(start_date, end_date, creation_times, dataset, bbox): 并发读取多个起报时次的gfs数据
+        deaccumulate(ds, bucket_hours): 将分段累积的变量转换为逐时段增量
+        from_shp(creation_date, creation_time, dataset, shp): 通过已有的矢量数据范围从minio服务器读取gfs数据
+        from_aoi(creation_date, creation_time, dataset, aoi): 用过已有的GeoPandas.GeoDataFrame对象从minio服务器读取gfs数据
     """
 
     def __init__(self):
@@ -845,7 +848,11 @@ class GFSReader:
             "10v": "v_component_of_wind_10m_above_ground",
         }
 
+        self._accumulated = ["tp"]
+
         self._default = "tp"
+        self._change = np.datetime64("2022-09-01")
+        self._paras_cache = {}
 
     @property
     def variables(self):
@@ -861,31 +868,7 @@ class GFSReader:
         else:
             raise Exception("变量设置错误")
 
-    def open_dataset(
-        self,
-        creation_date=np.datetime64("2022-09-01"),
-        creation_time="00",
-        dataset="wis",
-        bbox=(115, 38, 136, 54),
-        time_chunks=24,
-    ):
-        """
-        从minio服务器读取gfs数据
-
-        Args:
-            creation_date (datetime64): 创建日期
-            creation_time (datetime64): 创建时间，即00\06\12\18之一
-            dataset (str): wis或camels
-            bbox (list|tuple): 四至范围
-            time_chunks (int): 分块数量
-
-        Returns:
-            dataset (Dataset): 读取结果
-        """
-
-        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
-            raise Exception("四至范围格式错误")
-
+    def _set_dataset(self, dataset):
         if dataset != "wis" and dataset != "camels":
             raise Exception("dataset参数错误")
 
@@ -894,34 +877,29 @@ class GFSReader:
         elif dataset == "camels":
             self._dataset = "camdata"
 
-        with fs.open(os.path.join(bucket_name, f"{self._dataset}/gfs/gfs.json")) as f:
-            cont = json.load(f)
-            self._paras = cont
-
-        short_name = self._default
-        full_name = self._variables[short_name]
+        # gfs.json只在第一次使用时读取，之后从缓存中获取
+        if self._dataset not in self._paras_cache:
+            with fs.open(
+                os.path.join(bucket_name, f"{self._dataset}/gfs/gfs.json")
+            ) as f:
+                self._paras_cache[self._dataset] = json.load(f)
+        self._paras = self._paras_cache[self._dataset]
 
+    def _check_cycle(self, short_name, creation_date, creation_time):
         start = np.datetime64(self._paras[short_name][0]["start"])
         end = np.datetime64(self._paras[short_name][-1]["end"])
 
         if creation_date < start or creation_date > end:
             print("超出时间范围！")
-            return
+            return False
 
         if creation_time not in ["00", "06", "12", "18"]:
             print("creation_time必须是00、06、12、18之一！")
-            return
+            return False
 
-        year = str(creation_date.astype("object").year)
-        month = str(creation_date.astype("object").month).zfill(2)
-        day = str(creation_date.astype("object").day).zfill(2)
-
-        change = np.datetime64("2022-09-01")
-        if creation_date < change:
-            json_url = f"s3://{bucket_name}/{self._dataset}/gfs/gfs_history/{year}/{month}/{day}/gfs{year}{month}{day}.t{creation_time}z.0p25.json"
-        else:
-            json_url = f"s3://{bucket_name}/{self._dataset}/gfs/{short_name}/{year}/{month}/{day}/gfs{year}{month}{day}.t{creation_time}z.0p25.json"
+        return True
 
+    def _open_reference(self, json_url, time_chunks):
         chunks = {"valid_time": time_chunks}
         ds = xr.open_dataset(
             "reference://",
@@ -938,17 +916,87 @@ class GFSReader:
                 },
             },
         )
+        return ds
 
-        if creation_date < change:
-            ds = ds[full_name]
-            box = self._paras[short_name][0]["bbox"]
+    def _open_cycle(
+        self,
+        short_names,
+        creation_date,
+        creation_time,
+        bbox,
+        time_chunks,
+        max_workers=1,
+    ):
+        single = isinstance(short_names, str)
+        if single:
+            short_names = [short_names]
+        full_names = [self._variables[short_name] for short_name in short_names]
+
+        year = str(creation_date.astype("object").year)
+        month = str(creation_date.astype("object").month).zfill(2)
+        day = str(creation_date.astype("object").day).zfill(2)
+
+        if creation_date < self._change:
+            # 2022-09-01之前所有变量位于同一个索引文件中，只需打开一次
+            json_url = f"s3://{bucket_name}/{self._dataset}/gfs/gfs_history/{year}/{month}/{day}/gfs{year}{month}{day}.t{creation_time}z.0p25.json"
+            ds = self._open_reference(json_url, time_chunks)
+            ds = ds[full_names[0]] if single else ds[full_names]
+            boxes = [self._paras[short_name][0]["bbox"] for short_name in short_names]
         else:
-            box = self.paras[short_name][-1]["bbox"]
+            # 2022-09-01之后每个变量对应单独的索引文件，并发打开后按坐标对齐合并
+            json_urls = [
+                f"s3://{bucket_name}/{self._dataset}/gfs/{short_name}/{year}/{month}/{day}/gfs{year}{month}{day}.t{creation_time}z.0p25.json"
+                for short_name in short_names
+            ]
+            if max_workers > 1 and len(json_urls) > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    dss = list(
+                        executor.map(
+                            lambda json_url: self._open_reference(
+                                json_url, time_chunks
+                            ),
+                            json_urls,
+                        )
+                    )
+            else:
+                dss = [
+                    self._open_reference(json_url, time_chunks)
+                    for json_url in json_urls
+                ]
+
+            if single:
+                ds = dss[0]
+            else:
+                # 不同变量的高度层等标量坐标互相冲突，合并前去掉
+                dss = [
+                    ds.drop_vars(
+                        [c for c in ds.coords if ds[c].ndim == 0 and c != "time"]
+                    )
+                    for ds in dss
+                ]
+                ds = xr.merge(
+                    dss, join="inner", compat="override", combine_attrs="drop_conflicts"
+                )
+            boxes = [self._paras[short_name][-1]["bbox"] for short_name in short_names]
+
+        box = [
+            max(b[0] for b in boxes),
+            max(b[1] for b in boxes),
+            min(b[2] for b in boxes),
+            min(b[3] for b in boxes),
+        ]
 
         # ds = ds.filter_by_attrs(long_name=lambda v: v in data_variables)
         ds = ds.rename({"longitude": "lon", "latitude": "lat"})
         # ds = ds.transpose('time','valid_time','lon','lat')
 
+        # 记录起报时间及预见期，便于多个起报时次的数据对齐
+        init_time = np.datetime64(creation_date, "h") + np.timedelta64(
+            int(creation_time), "h"
+        )
+        ds = ds.assign_coords(init_time=init_time)
+        ds = ds.assign_coords(lead_time=ds["valid_time"] - ds["init_time"])
+
         bbox = regen_box(bbox, 0.25, 0)
 
         if bbox[0] < box[0]:
@@ -979,6 +1027,198 @@ class GFSReader:
 
         return ds
 
+    def open_dataset(
+        self,
+        creation_date=np.datetime64("2022-09-01"),
+        creation_time="00",
+        dataset="wis",
+        bbox=(115, 38, 136, 54),
+        time_chunks=24,
+        data_variables=None,
+        max_workers=4,
+    ):
+        """
+        从minio服务器读取gfs数据
+
+        Args:
+            creation_date (datetime64): 创建日期
+            creation_time (datetime64): 创建时间，即00\06\12\18之一
+            dataset (str): wis或camels
+            bbox (list|tuple): 四至范围
+            time_chunks (int): 分块数量
+            data_variables (list): 变量缩写列表，如["tp", "2t"]；默认为default_variable
+            max_workers (int): 并发读取多个变量的线程数
+
+        Returns:
+            dataset (Dataset): 读取结果
+        """
+
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise Exception("四至范围格式错误")
+
+        short_names = self._get_short_names(data_variables)
+
+        self._set_dataset(dataset)
+
+        for short_name in self._as_list(short_names):
+            if not self._check_cycle(short_name, creation_date, creation_time):
+                return
+
+        return self._open_cycle(
+            short_names, creation_date, creation_time, bbox, time_chunks, max_workers
+        )
+
+    def _get_short_names(self, data_variables):
+        if data_variables is None:
+            return self._default
+
+        short_names = self._as_list(data_variables)
+        for short_name in short_names:
+            if short_name not in self._variables.keys():
+                raise Exception("变量设置错误")
+
+        return short_names
+
+    def _as_list(self, short_names):
+        if isinstance(short_names, str):
+            return [short_names]
+        return list(short_names)
+
+    def open_cycles(
+        self,
+        start_date=np.datetime64("2022-09-01"),
+        end_date=np.datetime64("2022-09-01"),
+        creation_times=("00", "06", "12", "18"),
+        dataset="wis",
+        bbox=(115, 38, 136, 54),
+        time_chunks=24,
+        max_workers=8,
+        data_variables=None,
+        variable_workers=4,
+    ):
+        """
+        并发读取一段日期内多个起报时次的gfs数据，并合并为一个惰性数据集
+
+        返回结果以init_time（起报时间）和lead_time（预见期）为维度，valid_time为二维坐标。
+
+        Args:
+            start_date (datetime64): 起始创建日期
+            end_date (datetime64): 终止创建日期
+            creation_times (list|tuple): 创建时间，00、06、12、18的子集
+            dataset (str): wis或camels
+            bbox (list|tuple): 四至范围
+            time_chunks (int): 分块数量
+            max_workers (int): 并发读取多个起报时次的线程数
+            data_variables (list): 变量缩写列表，如["tp", "2t"]；默认为default_variable
+            variable_workers (int): 每个起报时次内并发读取多个变量的线程数
+
+        Returns:
+            dataset (Dataset): 读取结果
+        """
+
+        if end_date < start_date:
+            raise Exception("结束时间不能早于开始时间")
+
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise Exception("四至范围格式错误")
+
+        short_names = self._get_short_names(data_variables)
+
+        self._set_dataset(dataset)
+
+        dates = np.arange(
+            np.datetime64(start_date, "D"),
+            np.datetime64(end_date, "D") + np.timedelta64(1, "D"),
+            np.timedelta64(1, "D"),
+        )
+        cycles = [
+            (date, creation_time)
+            for date in dates
+            for creation_time in creation_times
+            if all(
+                self._check_cycle(short_name, date, creation_time)
+                for short_name in self._as_list(short_names)
+            )
+        ]
+
+        if len(cycles) == 0:
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            dss = list(
+                executor.map(
+                    lambda cycle: self._open_cycle(
+                        short_names,
+                        cycle[0],
+                        cycle[1],
+                        bbox,
+                        time_chunks,
+                        variable_workers,
+                    ),
+                    cycles,
+                )
+            )
+
+        return xr.concat(
+            [self._stack_cycle(ds) for ds in dss],
+            dim="init_time",
+            coords="different",
+            compat="equals",
+            join="outer",
+        )
+
+    def _stack_cycle(self, ds):
+        if isinstance(ds, xr.DataArray):
+            ds = ds.to_dataset()
+
+        if "valid_time" in ds.dims:
+            ds = ds.swap_dims({"valid_time": "lead_time"})
+
+        return ds.expand_dims("init_time")
+
+    def deaccumulate(self, ds, bucket_hours=6):
+        """
+        将分段累积的变量（如total_precipitation_surface）转换为逐时段增量
+
+        gfs降水自每个累积时段起点（预见期为bucket_hours的整数倍）开始累积，
+        时段内各时刻减去前一时刻的累积值即为增量，时段内的第一个时刻保持原值。
+        计算基于lead_time坐标按维度整体进行，不会触发数据加载，可直接用于open_cycles的结果。
+
+        Args:
+            ds (Dataset|DataArray): open_dataset或open_cycles的读取结果，需包含lead_time坐标
+            bucket_hours (int): 累积时段长度，单位为小时
+
+        Returns:
+            dataset (Dataset|DataArray): 转换结果，Dataset中只转换累积变量
+        """
+
+        if "lead_time" not in ds.coords or ds["lead_time"].ndim != 1:
+            raise Exception("数据中缺少一维的lead_time坐标")
+
+        dim = ds["lead_time"].dims[0]
+        hours = ds["lead_time"].values / np.timedelta64(1, "h")
+
+        # 前一时刻晚于当前时刻所在累积时段的起点时，两者属于同一时段，需要做差
+        bucket_start = np.ceil(hours / bucket_hours) * bucket_hours - bucket_hours
+        previous = np.concatenate([[-np.inf], hours[:-1]])
+        continued = xr.DataArray(previous > bucket_start, dims=[dim])
+
+        def _deaccumulate(da):
+            increment = da - da.shift({dim: 1}).where(continued, 0)
+            increment.attrs = da.attrs
+            return increment
+
+        if isinstance(ds, xr.DataArray):
+            return _deaccumulate(ds)
+
+        ds = ds.copy()
+        for short_name in self._accumulated:
+            full_name = self._variables[short_name]
+            if full_name in ds.data_vars:
+                ds[full_name] = _deaccumulate(ds[full_name])
+
+        return ds
+
     def from_shp(
         self,
         creation_date=np.datetime64("2022-09-01"),
@@ -986,6 +1226,7 @@ class GFSReader:
         dataset="wis",
         shp=None,
         time_chunks=24,
+        data_variables=None,
     ):
         """
         通过已有的矢量数据范围从minio服务器读取gfs数据
@@ -996,6 +1237,7 @@ class GFSReader:
             dataset (str): wis或camels
             shp (str): 矢量数据路径
             time_chunks (int): 分块数量
+            data_variables (list): 变量缩写列表，如["tp", "2t"]；默认为default_variable
 
         Returns:
             dataset (Dataset): 读取结果
@@ -1009,7 +1251,14 @@ class GFSReader:
             0,
         )
 
-        ds = self.open_dataset(creation_date, creation_time, dataset, bbox, time_chunks)
+        ds = self.open_dataset(
+            creation_date,
+            creation_time,
+            dataset,
+            bbox,
+            time_chunks,
+            data_variables=data_variables,
+        )
 
         return ds
 
@@ -1020,6 +1269,7 @@ class GFSReader:
         dataset="wis",
         aoi: gpd.GeoDataFrame = None,
         time_chunks=24,
+        data_variables=None,
     ):
         """
         通过已有的GeoPandas.GeoDataFrame对象从minio服务器读取gfs数据
@@ -1030,6 +1280,7 @@ class GFSReader:
             dataset (str): wis或camels
             aoi (GeoDataFrame): 已有的GeoPandas.GeoDataFrame对象
             time_chunks (int): 分块数量
+            data_variables (list): 变量缩写列表，如["tp", "2t"]；默认为default_variable
 
         Returns:
             dataset (Dataset): 读取结果
@@ -1041,6 +1292,13 @@ class GFSReader:
             0,
         )
 
-        ds = self.open_dataset(creation_date, creation_time, dataset, bbox, time_chunks)
+        ds = self.open_dataset(
+            creation_date,
+            creation_time,
+            dataset,
+            bbox,
+            time_chunks,
+            data_variables=data_variables,
+        )
 
         return ds
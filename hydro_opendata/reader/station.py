@@ -0,0 +1,308 @@
+"""
+Description: a columnar store of station observations shared by GRDC, NWIS and USGS data
+FilePath: \hydro_opendata\hydro_opendata\reader\station.py
+"""
+# Layout of a store under root:
+#   data/source=<source>/station=<station>/part-0.parquet  time, variable, value
+#   stations.parquet  statistics of every source, station and variable
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import shapely
+from shapely.strtree import STRtree
+
+DATA_SCHEMA = pa.schema(
+    [
+        ("time", pa.timestamp("ns")),
+        ("variable", pa.string()),
+        ("value", pa.float64()),
+    ]
+)
+PARTITIONING = ds.partitioning(
+    pa.schema([("source", pa.string()), ("station", pa.string())]), flavor="hive"
+)
+STATS_COLUMNS = [
+    "source",
+    "station",
+    "variable",
+    "lat",
+    "lon",
+    "count",
+    "start",
+    "end",
+    "mean",
+    "min",
+    "max",
+]
+
+
+class StationStore:
+    """
+    Station time series partitioned by source and station, with per-station
+    statistics and a spatial index on station locations.
+
+    Writers pass long tables (station, time, variable, value); a station's new
+    rows are merged into its partition, replacing rows with the same time and
+    variable. Times are naive UTC.
+    """
+
+    def __init__(self, root, max_workers=8):
+        """
+        Parameters
+        ----------
+        root : str
+            directory of the store, created if missing
+        max_workers : int
+            number of station partitions written in parallel
+        """
+        self._root = root
+        self._data_dir = os.path.join(root, "data")
+        self._stats_file = os.path.join(root, "stations.parquet")
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._stats = None
+        self._tree = None
+        os.makedirs(self._data_dir, exist_ok=True)
+
+    @property
+    def root(self):
+        return self._root
+
+    def _partition(self, source, station):
+        return os.path.join(self._data_dir, f"source={source}", f"station={station}")
+
+    def _write_station(self, source, station, df):
+        """Merge rows of one station into its partition, return its statistics"""
+        partition = self._partition(source, station)
+        file_path = os.path.join(partition, "part-0.parquet")
+        df = df[["time", "variable", "value"]]
+        if os.path.exists(file_path):
+            df = pd.concat([pd.read_parquet(file_path), df], ignore_index=True)
+        df = (
+            df.drop_duplicates(["variable", "time"], keep="last")
+            .sort_values(["variable", "time"])
+            .reset_index(drop=True)
+        )
+        os.makedirs(partition, exist_ok=True)
+        df.to_parquet(f"{file_path}.tmp", index=False, schema=DATA_SCHEMA)
+        os.replace(f"{file_path}.tmp", file_path)
+
+        valid = df.dropna(subset=["value"])
+        stats = valid.groupby("variable")["value"].agg(["count", "mean", "min", "max"])
+        times = valid.groupby("variable")["time"].agg(["min", "max"])
+        stats["start"], stats["end"] = times["min"], times["max"]
+        stats = stats.reset_index()
+        stats["source"], stats["station"] = source, station
+        return stats
+
+    def write(self, source, df, locations=None):
+        """
+        Write observations of one source.
+
+        Parameters
+        ----------
+        source : str
+            e.g. "grdc", "nwis_iv", "nwis_dv"
+        df : pd.DataFrame
+            long table with columns station, time, variable, value
+        locations : pd.DataFrame, optional
+            station locations with columns station, lat, lon
+
+        Returns
+        -------
+        pd.DataFrame
+            the updated statistics of the written stations
+        """
+        df = df.assign(
+            station=df["station"].astype(str),
+            time=_to_naive_utc(df["time"]),
+            value=pd.to_numeric(df["value"], errors="coerce").astype(float),
+        )
+        groups = list(df.groupby("station", sort=False))
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            stats = list(
+                executor.map(
+                    lambda group: self._write_station(source, group[0], group[1]),
+                    groups,
+                )
+            )
+        stats = pd.concat(stats, ignore_index=True) if stats else pd.DataFrame()
+        if len(stats) == 0:
+            return stats
+
+        if locations is not None:
+            locations = locations.assign(station=locations["station"].astype(str))
+            stats = stats.merge(
+                locations[["station", "lat", "lon"]].drop_duplicates("station"),
+                on="station",
+                how="left",
+            )
+        return self._update_stats(stats)
+
+    def _update_stats(self, stats):
+        with self._lock:
+            old = self.stations()
+            if "lat" not in stats:
+                stats["lat"], stats["lon"] = np.nan, np.nan
+            # keep known locations when a writer does not provide them
+            known = old.drop_duplicates(["source", "station"]).set_index(
+                ["source", "station"]
+            )[["lat", "lon"]]
+            keys = pd.MultiIndex.from_frame(stats[["source", "station"]])
+            for col in ["lat", "lon"]:
+                stats[col] = stats[col].fillna(
+                    pd.Series(known[col].reindex(keys).to_numpy(), index=stats.index)
+                )
+            stats = stats[STATS_COLUMNS]
+
+            written = pd.MultiIndex.from_frame(stats[["source", "station"]])
+            old_keys = pd.MultiIndex.from_frame(old[["source", "station"]])
+            old = old[~old_keys.isin(written)]
+            merged = (
+                pd.concat([old, stats], ignore_index=True) if len(old) > 0 else stats
+            )
+            merged.to_parquet(f"{self._stats_file}.tmp", index=False)
+            os.replace(f"{self._stats_file}.tmp", self._stats_file)
+            self._stats, self._tree = merged, None
+            return stats
+
+    def stations(self, source=None):
+        """
+        Statistics per station and variable: lat, lon, count, start, end, mean,
+        min and max.
+
+        Parameters
+        ----------
+        source : str, optional
+            only the stations of this source
+
+        Returns
+        -------
+        pd.DataFrame
+            one row per source, station and variable
+        """
+        if self._stats is None:
+            if os.path.exists(self._stats_file):
+                self._stats = pd.read_parquet(self._stats_file)
+            else:
+                self._stats = pd.DataFrame(columns=STATS_COLUMNS)
+        stats = self._stats
+        if source is not None:
+            stats = stats[stats["source"] == source]
+        return stats.reset_index(drop=True)
+
+    def query(self, bbox, source=None):
+        """
+        Find stations located in a bounding box with the spatial index.
+
+        Parameters
+        ----------
+        bbox : list
+            [minx, miny, maxx, maxy] in degrees
+        source : str, optional
+            only the stations of this source
+
+        Returns
+        -------
+        pd.DataFrame
+            the source and station of the matched stations
+        """
+        with self._lock:
+            if self._tree is None:
+                located = (
+                    self.stations()
+                    .drop_duplicates(["source", "station"])
+                    .dropna(subset=["lat", "lon"])
+                    .reset_index(drop=True)
+                )
+                points = shapely.points(
+                    located["lon"].to_numpy(float), located["lat"].to_numpy(float)
+                )
+                self._tree = (STRtree(points), located[["source", "station"]])
+            tree, located = self._tree
+        hits = located.iloc[np.sort(tree.query(shapely.box(*bbox)))]
+        if source is not None:
+            hits = hits[hits["source"] == source]
+        return hits.reset_index(drop=True)
+
+    def read(
+        self,
+        source=None,
+        stations=None,
+        start_time=None,
+        end_time=None,
+        variables=None,
+        bbox=None,
+    ):
+        """
+        Read observations, pruning partitions by source and station.
+
+        Parameters
+        ----------
+        source : str, optional
+            e.g. "grdc"
+        stations : list, optional
+            station ids
+        start_time : str, optional
+            first time to read, in UTC
+        end_time : str, optional
+            last time to read, in UTC
+        variables : list, optional
+            variables to read
+        bbox : list, optional
+            [minx, miny, maxx, maxy], only stations located inside
+
+        Returns
+        -------
+        pd.DataFrame
+            long table with columns source, station, time, variable, value
+        """
+        if bbox is not None:
+            hits = self.query(bbox, source=source)
+            if stations is not None:
+                hits = hits[hits["station"].isin([str(s) for s in stations])]
+            stations = hits["station"].tolist()
+
+        columns = ["source", "station", "time", "variable", "value"]
+        if not os.path.exists(self._data_dir) or not os.listdir(self._data_dir):
+            return pd.DataFrame(columns=columns)
+
+        dataset = ds.dataset(
+            self._data_dir,
+            format="parquet",
+            schema=DATA_SCHEMA.append(pa.field("source", pa.string())).append(
+                pa.field("station", pa.string())
+            ),
+            partitioning=PARTITIONING,
+        )
+        conditions = []
+        if source is not None:
+            conditions.append(ds.field("source") == source)
+        if stations is not None:
+            conditions.append(ds.field("station").isin([str(s) for s in stations]))
+        if variables is not None:
+            conditions.append(ds.field("variable").isin(list(variables)))
+        if start_time is not None:
+            start_time = pd.Timestamp(start_time).to_datetime64()
+            conditions.append(ds.field("time") >= start_time)
+        if end_time is not None:
+            end_time = pd.Timestamp(end_time).to_datetime64()
+            conditions.append(ds.field("time") <= end_time)
+        condition = None
+        for c in conditions:
+            condition = c if condition is None else condition & c
+
+        return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+def _to_naive_utc(times):
+    """Convert times to naive UTC, tz-aware ones are converted first."""
+    times = pd.to_datetime(times)
+    if getattr(times.dt, "tz", None) is not None:
+        times = times.dt.tz_convert("UTC").dt.tz_localize(None)
+    return times.astype("datetime64[ns]")
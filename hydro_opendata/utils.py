@@ -1,4 +1,6 @@
 import numpy as np
+import geopandas as gpd
+import shapely
 from netCDF4 import Dataset, date2num, num2date
 import time
 from datetime import datetime, timedelta
@@ -143,3 +145,17 @@ def cf2datetime(ds):
     ds.coords["time"].attrs = attrs
 
     return ds
+
+
+def aoi_geometry(aoi, crs):
+    """将aoi统一为crs坐标系下的shapely几何，未指定坐标系的aoi视为EPSG:4326"""
+
+    if isinstance(aoi, (gpd.GeoDataFrame, gpd.GeoSeries)):
+        if aoi.crs is None:
+            aoi = aoi.set_crs("EPSG:4326")
+        return shapely.union_all(aoi.to_crs(crs).geometry.values)
+    if isinstance(aoi, (list, tuple)):
+        aoi = shapely.box(*aoi)
+    elif isinstance(aoi, dict):
+        aoi = shapely.geometry.shape(aoi)
+    return gpd.GeoSeries([aoi], crs="EPSG:4326").to_crs(crs).iloc[0]
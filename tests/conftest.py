@@ -9,6 +9,11 @@ Description: conf for pytest
 FilePath: \hydro_opendata\tests\conftest.py
 Copyright (c) 2023-2024 Wenyu Ouyang. All rights reserved.
 """
+import os
+import threading
+from http.server import ThreadingHTTPServer
+import numpy as np
+import pandas as pd
 import pytest
 
 from hydro_opendata.common import minio_cfg
@@ -17,3 +22,93 @@ from hydro_opendata.common import minio_cfg
 @pytest.fixture()
 def minio_paras():
     return minio_cfg(bucket_name="test-private-data")
+
+
+@pytest.fixture()
+def http_server():
+    """start local http servers with the given handler class, return the base url"""
+    servers = []
+
+    def _serve(handler):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield _serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture()
+def fake_grdc_catalogue():
+    """write a GRDC_Stations.xlsx of stations 6335000, 6335001, ... for catalogue_grdc"""
+
+    def _write(save_dir, n_stations):
+        zip_file = os.path.join(save_dir, "grdc_stations.zip")
+        with open(zip_file, "wb") as f:
+            f.write(b"zip")
+        with open(f"{zip_file}.manifest", "w") as f:
+            f.write('{"size": 3}')
+        os.makedirs(os.path.join(save_dir, "grdc_stations"), exist_ok=True)
+        int_cols = ["wmo_reg", "sub_reg", "d_start", "d_end", "d_yrs", "m_start"]
+        int_cols += ["m_end", "m_yrs", "t_start", "t_end", "t_yrs"]
+        float_cols = ["lat", "long", "area", "altitude", "d_miss", "m_miss"]
+        float_cols += ["lta_discharge", "r_volume_yr", "r_height_yr"]
+        df = pd.DataFrame({"grdc_no": 6335000 + np.arange(n_stations)})
+        df["station"] = "REES"
+        for col in int_cols:
+            df[col] = np.arange(n_stations) % 6 + 1
+        for col in float_cols:
+            df[col] = np.arange(n_stations) / 10
+        df["area"] = df["area"].astype(object)
+        df.loc[0, "area"] = "n.a."
+        df.to_excel(
+            os.path.join(save_dir, "grdc_stations", "GRDC_Stations.xlsx"),
+            sheet_name="station_catalogue",
+            index=False,
+        )
+
+    return _write
+
+
+@pytest.fixture()
+def fake_dem_tiles():
+    """write 1°x1° cloud-optimized dem tiles; a pixel's value is row * 1000 + col,
+    counted from the north-west corner (west, north) of all tiles"""
+    import rasterio
+    import rasterio.shutil
+    from rasterio.transform import from_origin
+
+    def _write(save_dir, west=110, north=32, n_lon=2, n_lat=2, size=200):
+        res = 1 / size
+        rows, cols = np.mgrid[0 : n_lat * size, 0 : n_lon * size]
+        values = (rows * 1000 + cols).astype("float32")
+        files = []
+        for i in range(n_lat):
+            for j in range(n_lon):
+                lat, lon = north - i - 1, west + j
+                name = f"ALPSMLC30_N{lat:03d}E{lon:03d}_DSM.tif"
+                file_name = os.path.join(save_dir, name)
+                tmp_file = f"{file_name}.tmp.tif"
+                with rasterio.open(
+                    tmp_file,
+                    "w",
+                    driver="GTiff",
+                    width=size,
+                    height=size,
+                    count=1,
+                    dtype="float32",
+                    crs="EPSG:4326",
+                    transform=from_origin(lon, lat + 1, res, res),
+                    nodata=-9999,
+                ) as dst:
+                    block = values[i * size : (i + 1) * size, j * size : (j + 1) * size]
+                    dst.write(block, 1)
+                rasterio.shutil.copy(tmp_file, file_name, driver="COG", BLOCKSIZE=64)
+                os.remove(tmp_file)
+                files.append(file_name)
+        return files
+
+    return _write
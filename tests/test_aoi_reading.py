@@ -10,6 +10,7 @@ Copyright (c) 2023-2024 Wenyu Ouyang. All rights reserved.
 import os
 import pytest
 import geopandas as gpd
+import xarray as xr
 
 from hydro_opendata.reader.minio import ERA5LReader, GPMReader, GFSReader
 import numpy as np
@@ -62,3 +63,61 @@ def test_read_gfs(aoi_shp, creation_date):
     gfs = GFSReader()
     ds3 = gfs.from_aoi(creation_date=creation_date, creation_time="00", aoi=aoi_shp)
     print(ds3)
+
+
+def test_read_gfs_cycles(aoi_shp, creation_date):
+    gfs = GFSReader()
+    b = aoi_shp.bounds
+    bbox = (b.loc[0]["minx"], b.loc[0]["miny"], b.loc[0]["maxx"], b.loc[0]["maxy"])
+    ds4 = gfs.open_cycles(
+        start_date=creation_date,
+        end_date=creation_date + np.timedelta64(1, "D"),
+        creation_times=["00", "12"],
+        bbox=bbox,
+    )
+    assert ds4.sizes["init_time"] == 4
+    assert "lead_time" in ds4.dims
+    print(ds4)
+
+
+def test_read_gfs_multi_variables(aoi_shp):
+    gfs = GFSReader()
+    ds5 = gfs.from_aoi(
+        creation_date=np.datetime64("2022-09-01"),
+        creation_time="00",
+        aoi=aoi_shp,
+        data_variables=["tp", "2t", "10u", "10v"],
+    )
+    assert len(ds5.data_vars) == 4
+    print(ds5)
+
+
+def test_gfs_deaccumulate():
+    gfs = GFSReader()
+    lead_time = np.arange(1, 121).astype("timedelta64[h]")
+    # 6小时分段累积，每小时降水1mm
+    accumulated = ((np.arange(1, 121) - 1) % 6 + 1).astype(float)
+    ds = xr.Dataset(
+        {
+            "total_precipitation_surface": (
+                ("init_time", "lead_time"),
+                np.tile(accumulated, (2, 1)),
+            ),
+            "temperature_2m_above_ground": (
+                ("init_time", "lead_time"),
+                np.tile(accumulated, (2, 1)),
+            ),
+        },
+        coords={
+            "init_time": np.array(
+                ["2022-09-01T00", "2022-09-01T06"], dtype="datetime64[ns]"
+            ),
+            "lead_time": lead_time,
+        },
+    ).chunk({"lead_time": 24})
+    ds6 = gfs.deaccumulate(ds)
+    np.testing.assert_array_equal(ds6["total_precipitation_surface"].values, 1.0)
+    np.testing.assert_array_equal(
+        ds6["temperature_2m_above_ground"].values,
+        ds["temperature_2m_above_ground"].values,
+    )
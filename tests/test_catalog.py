@@ -0,0 +1,285 @@
+"""
+Description: Test funcs for catalog
+FilePath: \hydro_opendata\tests\test_catalog.py
+"""
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler
+import pytest
+import numpy as np
+import geopandas as gpd
+import shapely
+
+from hydro_opendata.catalog.minio import CatalogIndex, registry
+from hydro_opendata.data.minio import GFS
+from hydro_opendata.catalog.s3 import LandsatCatalog
+from hydro_opendata.catalog.stac import StacClient
+
+
+@pytest.fixture()
+def geo_file():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_dir, "test.geojson")
+
+
+def test_catalog_index_bulk_search():
+    records = [
+        {
+            "id": "gfs_atmos.tp",
+            "dataset": "wis",
+            "start_time": "2016-07-10",
+            "end_time": "2022-08-31",
+            "bbox": [115, 38, 136, 54],
+        },
+        {
+            "id": "gfs_atmos.tp",
+            "dataset": "wis",
+            "start_time": "2022-09-01",
+            "end_time": "2023-08-17",
+            "bbox": [120, 40, 136, 54],
+        },
+    ]
+    index = CatalogIndex(records)
+    aois = gpd.GeoSeries(
+        [
+            shapely.box(118, 39, 119, 40),
+            shapely.box(121, 41, 122, 42),
+            shapely.box(0, 0, 1, 1),
+        ],
+        crs="EPSG:4326",
+    )
+    datalist = index.bulk_search(
+        aois,
+        start_times=np.datetime64("2022-01-01"),
+        end_times=[
+            np.datetime64("2022-12-31"),
+            np.datetime64("2022-12-31"),
+            np.datetime64("2022-12-31"),
+        ],
+    )
+    assert sorted(datalist["aoi"].tolist()) == [0, 1, 1]
+    second = datalist[datalist["aoi"] == 1].sort_values("start_time")
+    assert second["start_time"].tolist() == ["2022-01-01T00:00:00", "2022-09-01T00:00:00"]
+    assert second["end_time"].tolist() == ["2022-08-31T00:00:00", "2022-12-31T00:00:00"]
+    assert second.geometry.iloc[0].equals(shapely.box(121, 41, 122, 42))
+
+
+def test_catalog_index_search(geo_file):
+    aoi = gpd.read_file(geo_file)
+    index = CatalogIndex(
+        [
+            {
+                "id": "era5-land",
+                "dataset": "wis",
+                "start_time": "2015-01-01T00:00:00",
+                "end_time": "2021-12-31T23:00:00",
+                "bbox": [115, 38, 136, 54],
+            }
+        ]
+    )
+    datalist = index.search(aoi)
+    assert list(datalist.columns) == [
+        "id",
+        "dataset",
+        "start_time",
+        "end_time",
+        "geometry",
+    ]
+    assert datalist.geometry.iloc[0].equals(aoi.geometry.iloc[0])
+    assert index.search(aoi, end_time=np.datetime64("2014-01-01")).empty
+
+
+def test_registry_search(geo_file):
+    gfs = GFS("tp")
+    aoi = gpd.read_file(geo_file)
+    datalist = registry.search(aoi)
+    assert "era5-land" in datalist["id"].tolist()
+    assert "gfs_atmos.tp" in datalist["id"].tolist()
+    assert "wis" in gfs.catalog.datasets
+
+
+class StubStacHandler(BaseHTTPRequestHandler):
+    """A minimal STAC API: one feature per page, two pages per year"""
+
+    requests = {"GET": 0, "POST": 0}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body):
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.requests["GET"] += 1
+        root = f"http://{self.headers['Host']}"
+        self._send({"links": [{"rel": "search", "href": f"{root}/search"}]})
+
+    def do_POST(self):
+        self.requests["POST"] += 1
+        root = f"http://{self.headers['Host']}"
+        params = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if "ids" in params:
+            features = [
+                {"id": i, "assets": {"B1": {"href": f"{i}.tif", "roles": ["data"]}}}
+                for i in params["ids"]
+            ]
+            self._send({"features": features, "links": []})
+            return
+        year = params["datetime"][:4]
+        page = params.get("page", 1)
+        links = []
+        if page == 1:
+            links.append(
+                {
+                    "rel": "next",
+                    "href": f"{root}/search",
+                    "method": "POST",
+                    "body": {"page": 2},
+                    "merge": True,
+                }
+            )
+        self._send(
+            {
+                "features": [
+                    {
+                        "id": f"LC_{year}_{page}",
+                        "assets": {
+                            "B1": {"href": f"LC_{year}_{page}.tif", "roles": ["data"]}
+                        },
+                    }
+                ],
+                "links": links,
+            }
+        )
+
+
+def test_landsat_search_stub(http_server):
+    url = http_server(StubStacHandler)
+    landsat = LandsatCatalog(root=url, max_workers=4)
+    features = landsat.search(
+        start_date="2015-06-01", end_date="2020-03-01", bbox=[121, 39, 122, 40]
+    )
+    ids = [f["id"] for f in features]
+    assert ids == [f"LC_{y}_{p}" for y in range(2020, 2014, -1) for p in (1, 2)]
+
+    streamed = landsat.iter_search(
+        start_date="2015-06-01", end_date="2020-03-01", bbox=[121, 39, 122, 40]
+    )
+    assert sorted(f["id"] for f in streamed) == sorted(ids)
+
+
+class StubSlowStacHandler(StubStacHandler):
+    """StubStacHandler answering slowly and recording the peak concurrency"""
+
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def do_POST(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        time.sleep(0.05)
+        try:
+            super().do_POST()
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+
+def test_landsat_search_windows_concurrent(http_server):
+    url = http_server(StubSlowStacHandler)
+    landsat = LandsatCatalog(root=url, max_workers=4)
+    # the pages of one window follow each other, finer windows run concurrently
+    features = landsat.search(
+        start_date="2020-03-01",
+        end_date="2020-03-08",
+        bbox=[121, 39, 122, 40],
+        interval="day",
+    )
+    assert len(features) == 16
+    assert StubSlowStacHandler.peak > 1
+
+
+def test_stac_client_cache(http_server):
+    StubStacHandler.requests = {"GET": 0, "POST": 0}
+    url = http_server(StubStacHandler)
+    stac_client = StacClient()
+    landsat = LandsatCatalog(root=url, stac_client=stac_client)
+    LandsatCatalog(root=url, stac_client=stac_client)
+    assert StubStacHandler.requests["GET"] == 1
+
+    features = landsat.search(
+        start_date="2020-01-01", end_date="2020-12-31", bbox=[121, 39, 122, 40]
+    )
+    posts = StubStacHandler.requests["POST"]
+    hrefs = landsat.get_hrefs([f["id"] for f in features])
+    assert hrefs == [["LC_2020_1.tif"], ["LC_2020_2.tif"]]
+    assert StubStacHandler.requests["POST"] == posts
+
+    assert landsat.get_hrefs(["LC_2021_1"]) == [["LC_2021_1.tif"]]
+    assert StubStacHandler.requests["POST"] == posts + 1
+
+
+def test_catalog_lazy_loading(monkeypatch):
+    from hydro_opendata.catalog import minio as catalog_minio
+
+    reads = []
+    descriptor = {"start": "2020-01-01", "end": "2020-12-31", "bbox": [73, 3, 136, 54]}
+
+    def read(path):
+        reads.append(path)
+        if path.endswith("gfs.json"):
+            return {"tp": [descriptor]}
+        return descriptor
+
+    lazy_registry = catalog_minio.CatalogRegistry(max_workers=2)
+    monkeypatch.setattr(lazy_registry, "_read", read)
+    monkeypatch.setattr(catalog_minio, "registry", lazy_registry)
+
+    era5 = catalog_minio.ERA5LCatalog()
+    gpm = catalog_minio.GPMCatalog()
+    gfs = catalog_minio.GFSCatalog("tp")
+    assert era5.collection_id == "era5-land" and gfs.variable == "tp"
+    assert reads == []
+
+    assert set(era5.datasets) == {"wis", "camels"}
+    assert len(reads) == 2
+    assert len(gpm.index) == 4
+    assert len(gfs.index) == 2
+    assert len(reads) == 8
+
+    lazy_registry.close()
+    assert lazy_registry._executor is None
+    # the cached descriptors are still served after close
+    assert len(catalog_minio.GPMCatalog().datasets["wis"]) == 2
+    assert len(reads) == 8
+
+
+def test_stac_client_feature_cache_bounds(http_server):
+    StubStacHandler.requests = {"GET": 0, "POST": 0}
+    url = http_server(StubStacHandler)
+    other_url = http_server(StubStacHandler)
+    stac_client = StacClient(max_features=2)
+
+    stac_client.get_features(f"{url}/search", ["a", "b"])
+    assert StubStacHandler.requests["POST"] == 1
+    # the same ids of another endpoint are not served from the cache
+    stac_client.get_features(f"{other_url}/search", ["a"])
+    assert StubStacHandler.requests["POST"] == 2
+    assert len(stac_client._features) == 2
+
+    # the least recently used "a" of the first endpoint was evicted
+    stac_client.get_features(f"{url}/search", ["b"])
+    stac_client.get_features(f"{other_url}/search", ["a"])
+    assert StubStacHandler.requests["POST"] == 2
+    stac_client.get_features(f"{url}/search", ["a"])
+    assert StubStacHandler.requests["POST"] == 3
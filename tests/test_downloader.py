@@ -7,16 +7,52 @@ Description: Test downloading function
 FilePath: \hydro_opendata\tests\test_downloader.py
 Copyright (c) 2023-2024 Wenyu Ouyang. All rights reserved.
 """
+import io
 import os
+import json
+import time
+import socket
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler
+import numpy as np
+import pytest
 import pandas as pd
+import requests
+import shapely
 
 import hydrodataset as hds
+from hydro_opendata.downloader.downloader import (
+    download_by_ranges,
+    download_by_stream,
+    download_ftp_files,
+    get_ftp_pool,
+    download_multitasking,
+    download_resumable,
+    download_sigletasking,
+    verify_file,
+)
+from hydro_opendata.downloader.ncep_gfs import get_gfs_subset
+from hydro_opendata.downloader import dem
+from hydro_opendata.downloader.dem import mosaic_dem, read_dem
+from hydro_opendata.downloader.scene import download_scenes, select_assets
+from hydro_opendata.downloader import hydrostation
 from hydro_opendata.downloader.hydrostation import (
+    _write_camels_format,
     catalogue_grdc,
+    download_grdc_archives,
     download_grdc_month_data,
     download_grdc_daily_data,
+    grdc_station_index,
+    download_nwis_batch,
     download_nwis_daily_flow,
+    download_usgs_data_batch,
+    get_nwis_stream_data,
+    parse_usgs_rdb,
+    process_intermediate_csv,
+    usgs_datetime_to_utc,
 )
+from hydro_opendata.reader.station import StationStore
 
 
 def test_catalogue_grdc():
@@ -47,6 +83,29 @@ def test_catalogue_grdc():
     assert "sub_reg" in grdc_catalogue.columns
 
 
+def test_catalogue_grdc_cache(tmp_path, fake_grdc_catalogue):
+    fake_grdc_catalogue(tmp_path, 50)
+    catalogue = catalogue_grdc(tmp_path)
+    assert catalogue.shape == (50, 22)
+    assert np.isnan(catalogue["area"].iloc[0])
+    cache_file = os.path.join(tmp_path, "grdc_stations", "GRDC_Stations.parquet")
+    assert os.path.exists(cache_file)
+
+    # a new process reads the parquet cache instead of the Excel file
+    hydrostation._grdc_catalogues.clear()
+    pd.testing.assert_frame_equal(catalogue_grdc(tmp_path), catalogue)
+    start = time.perf_counter()
+    index = grdc_station_index(tmp_path)
+    assert time.perf_counter() - start < 0.5
+    assert index.loc[6335007, "wmo_reg"] == 2
+    assert index.loc[[6335001, 6335003], "lat"].tolist() == [0.1, 0.3]
+
+    # a changed Excel file invalidates both caches
+    time.sleep(0.01)
+    fake_grdc_catalogue(tmp_path, 60)
+    assert catalogue_grdc(tmp_path).shape == (60, 22)
+
+
 def test_download_grdc_ts(id="2181200"):
     data = download_grdc_month_data(id, hds.CACHE_DIR)
 
@@ -57,6 +116,12 @@ def test_download_grdc_ts(id="2181200"):
     assert all(isinstance(table, str) for table in data.values())
 
 
+def test_download_grdc_archives():
+    archives = download_grdc_archives(hds.CACHE_DIR, wmo_regions=[5, 6])
+    assert list(archives.keys()) == [5, 6]
+    assert all(os.path.isdir(folder) for folder in archives.values())
+
+
 def test_download_grdc_daily_data(tmp_path):
     station_id = "12345"
     file_path = download_grdc_daily_data(tmp_path, station_id)
@@ -72,3 +137,793 @@ def test_download_usgs_streamflow():
     unit = "cfs"
     qobs = download_nwis_daily_flow(sites_id, date_range, gage_dict, save_dir, unit)
     print(qobs)
+
+
+USGS_RDB = """# ---------------------------------- WARNING ----------------------------------------
+# Some of the data that you have obtained from this U.S. Geological Survey database
+#
+# Data provided for site 01646500
+#            TS   parameter     Description
+#         69928       00060     Discharge, cubic feet per second
+#         69929       00065     Gage height, feet
+#
+# Data-value qualification codes included in this output:
+#     P  Provisional data subject to revision.
+#
+agency_cd\tsite_no\tdatetime\ttz_cd\t69928_00060\t69928_00060_cd\t69929_00065\t69929_00065_cd
+5s\t15s\t20d\t6s\t14n\t10s\t14n\t10s
+USGS\t01646500\t2021-11-07 00:45\tEDT\t1234\tP\t3.51\tP
+USGS\t01646500\t2021-11-07 01:00\tEDT\t1230\tP\t3.50\tP
+USGS\t01646500\t2021-11-07 01:00\tEST\t\tP\t3.49\tP
+USGS\t01646500\t2021-11-07 02:00\tEST\tIce\tP\t3.48\tP
+"""
+
+
+def test_parse_usgs_rdb():
+    df, params = parse_usgs_rdb(USGS_RDB)
+    assert params == {"69928_00060": "cfs", "69929_00065": "height"}
+    assert df.shape == (4, 10)
+    assert df["site_no"].iloc[0] == "01646500"
+    assert df["cfs"].dtype == float
+    assert df["cfs"].iloc[0] == 1234
+    assert df["cfs"].iloc[2:].isna().all()
+    assert df["height"].tolist() == [3.51, 3.50, 3.49, 3.48]
+
+    # lines from a streamed response give the same result
+    df_lines, _ = parse_usgs_rdb(iter(USGS_RDB.splitlines()))
+    pd.testing.assert_frame_equal(df, df_lines)
+
+    # the format row is only dropped from raw csv data
+    df_hourly, max_flow, min_flow = process_intermediate_csv(df)
+    assert max_flow == 1234
+    # 01:00 EDT and 01:00 EST are different instants
+    assert df_hourly["datetime"].tolist() == [
+        pd.Timestamp("2021-11-07 05:00", tz="UTC"),
+        pd.Timestamp("2021-11-07 06:00", tz="UTC"),
+        pd.Timestamp("2021-11-07 07:00", tz="UTC"),
+    ]
+
+    # a site without data in the period: header and format row only
+    header = USGS_RDB[: USGS_RDB.index("USGS\t")]
+    df_empty, _ = parse_usgs_rdb(header)
+    assert len(df_empty) == 0
+    df_hourly, _, _ = process_intermediate_csv(df_empty)
+    assert len(df_hourly) == 0
+
+
+def test_usgs_datetime_to_utc_benchmark():
+    # 30 years of 15-minute data with the tz_cd switching at every DST change
+    local = pd.date_range("1990-01-01", "2019-12-31 23:45", freq="15min")
+    aware = local.tz_localize("America/New_York", ambiguous=False, nonexistent="NaT")
+    keep = ~aware.isna()
+    local, aware = local[keep], aware[keep]
+    datetimes = pd.Series(local.strftime("%Y-%m-%d %H:%M"))
+    utc_expected = aware.tz_convert("UTC").tz_localize(None)
+    is_dst = local - utc_expected == pd.Timedelta("-4h")
+    tz_cds = pd.Series(np.where(is_dst, "EDT", "EST"))
+
+    start = time.perf_counter()
+    utc = usgs_datetime_to_utc(datetimes, tz_cds)
+    print(f"converted {len(utc)} timestamps in {time.perf_counter() - start:.2f}s")
+
+    assert (utc.dt.tz_localize(None).values == utc_expected.values).all()
+
+
+def test_write_camels_format_benchmark(tmp_path):
+    # 671 CAMELS basins, ten years of daily flow, three sites missing in the response
+    sites = [str(1013500 + i).zfill(8) for i in range(671)]
+    huc_of = {site: str(i % 18 + 1).zfill(2) for i, site in enumerate(sites)}
+    dates = pd.date_range("2010-01-01", "2019-12-31", freq="D")
+    qobs = pd.DataFrame(
+        np.random.rand(len(dates), 668).round(2) * 1000,
+        index=dates,
+        columns=["USGS-" + site for site in sites[:668]],
+    )
+    start = time.perf_counter()
+    output_files = _write_camels_format(
+        qobs, sites, huc_of, tmp_path, consolidated=True
+    )
+    print(f"wrote {len(sites)} basins in {time.perf_counter() - start:.2f}s")
+
+    assert len(output_files) == 671
+    df = pd.read_csv(output_files[0], dtype={"GAGE_ID": str})
+    assert list(df.columns) == ["GAGE_ID", "Year", "Mnth", "Day", "streamflow(cfs)"]
+    assert df["GAGE_ID"].iloc[0] == sites[0]
+    assert df["Year"].iloc[-1] == 2019
+    np.testing.assert_allclose(
+        df["streamflow(cfs)"].values, qobs["USGS-" + sites[0]].values
+    )
+    assert pd.read_csv(output_files[-1])["streamflow(cfs)"].isna().all()
+    assert output_files[1] == os.path.join(
+        tmp_path, "02", f"{sites[1]}_streamflow_qc.txt"
+    )
+    consolidated = pd.read_csv(os.path.join(tmp_path, "streamflow_qc.txt"))
+    assert consolidated.shape == (671 * len(dates), 5)
+
+
+def test_download_nwis_batch(tmp_path):
+    sites = ["01013500", "01022500", "01030500"]
+    save_file = os.path.join(tmp_path, "nwis_iv.parquet")
+    df = download_nwis_batch(
+        sites, "2021-10-01", "2021-10-02", "00060", save_file, group_size=2
+    )
+    assert set(df["site_no"]) == set(sites)
+    assert pd.read_parquet(save_file).shape == df.shape
+
+
+class StubFileHandler(BaseHTTPRequestHandler):
+    """Serve deterministic bytes for every path and record the peak concurrency"""
+
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        time.sleep(0.05)
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.end_headers()
+        else:
+            content = (self.path * 1000).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        with cls.lock:
+            cls.active -= 1
+
+
+def test_download_multitasking(tmp_path, http_server):
+    url = http_server(StubFileHandler)
+    jobs = [
+        (f"{url}/tile_{i}.tif", os.path.join(tmp_path, "dem", f"tile_{i}.tif"))
+        for i in range(20)
+    ]
+    jobs.append((f"{url}/missing.tif", os.path.join(tmp_path, "dem", "missing.tif")))
+    # a file left by an interrupted run is downloaded again
+    os.makedirs(os.path.join(tmp_path, "dem"))
+    with open(jobs[0][1], "wb") as f:
+        f.write(b"/tile")
+    file_paths = download_multitasking(jobs, max_workers=8, per_host=3)
+    assert file_paths[-1] is None
+    for (url_i, path), file_path in zip(jobs[:-1], file_paths[:-1]):
+        assert file_path == path
+        with open(path, "rb") as f:
+            assert f.read() == (url_i.replace(url, "") * 1000).encode()
+    assert StubFileHandler.peak <= 3
+    assert all(verify_file(path) for path in file_paths[:-1])
+
+
+def test_download_multitasking_incomplete(tmp_path, http_server):
+    url = http_server(StubFlakyHandler)
+    file_name = os.path.join(tmp_path, "archive.zip")
+    # the connection drops halfway, nothing is left at the destination
+    assert download_multitasking([(f"{url}/archive.zip", file_name)]) == [None]
+    assert not os.path.exists(file_name)
+    assert not os.path.exists(f"{file_name}.part")
+
+
+class StubRangeHandler(BaseHTTPRequestHandler):
+    """Serve a fixed payload with HTTP Range support and record the requested ranges"""
+
+    content = os.urandom(1000003)
+    ranges = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.content)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        start, end = self.headers["Range"].replace("bytes=", "").split("-")
+        start, end = int(start), int(end)
+        type(self).ranges.append((start, end))
+        self.send_response(206)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header(
+            "Content-Range", f"bytes {start}-{end}/{len(self.content)}"
+        )
+        self.end_headers()
+        self.wfile.write(self.content[start : end + 1])
+
+
+def test_download_by_ranges(tmp_path, http_server):
+    url = http_server(StubRangeHandler)
+    file_name = os.path.join(tmp_path, "large.tif")
+    download_sigletasking(f"{url}/large.tif", file_name, segments=4, min_segment_size=1000)
+    assert len(StubRangeHandler.ranges) == 4
+    with open(file_name, "rb") as f:
+        assert f.read() == StubRangeHandler.content
+    assert verify_file(file_name)
+    assert not os.path.exists(f"{file_name}.part")
+
+    # a server ignoring Range fails the download
+    url = http_server(StubFileHandler)
+    file_name = os.path.join(tmp_path, "other.tif")
+    with pytest.raises(Exception):
+        download_by_ranges(f"{url}/other.tif", file_name, 8000, segments=2)
+    assert not os.path.exists(file_name)
+
+
+class StubDroppingRangeHandler(StubRangeHandler):
+    """Send only half of every requested range while drop is set"""
+
+    drop = True
+
+    def do_GET(self):
+        if not self.drop:
+            return super().do_GET()
+        start, end = self.headers["Range"].replace("bytes=", "").split("-")
+        start, end = int(start), int(end)
+        type(self).ranges.append((start, end))
+        self.send_response(206)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header(
+            "Content-Range", f"bytes {start}-{end}/{len(self.content)}"
+        )
+        self.end_headers()
+        self.wfile.write(self.content[start : start + (end - start + 1) // 2])
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def test_download_by_ranges_resumes(tmp_path, http_server):
+    url = http_server(StubDroppingRangeHandler)
+    file_name = os.path.join(tmp_path, "large.tif")
+    size = len(StubDroppingRangeHandler.content)
+    with pytest.raises(Exception):
+        download_by_ranges(
+            f"{url}/large.tif",
+            file_name,
+            size,
+            segments=4,
+            chunk_size=16384,
+            retries=2,
+            backoff=0,
+        )
+    # the part file and its finished ranges are kept
+    assert not os.path.exists(file_name)
+    with open(f"{file_name}.part.manifest") as f:
+        finished = sum(end - start + 1 for start, end in json.load(f)["ranges"])
+    assert 0 < finished < size
+
+    # a second call fetches only the missing bytes
+    StubDroppingRangeHandler.drop = False
+    StubDroppingRangeHandler.ranges = []
+    download_by_ranges(f"{url}/large.tif", file_name, size, segments=4, backoff=0)
+    requested = sum(end - start + 1 for start, end in StubDroppingRangeHandler.ranges)
+    assert requested == size - finished
+    with open(file_name, "rb") as f:
+        assert f.read() == StubDroppingRangeHandler.content
+    assert verify_file(file_name)
+    assert not os.path.exists(f"{file_name}.part")
+    assert not os.path.exists(f"{file_name}.part.manifest")
+
+
+class StubFlakyHandler(BaseHTTPRequestHandler):
+    """Serve a fixed payload, dropping the connection halfway through the first GET"""
+
+    content = os.urandom(300000)
+    ranges = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.content)))
+        self.end_headers()
+
+    def do_GET(self):
+        size = len(self.content)
+        if "Range" in self.headers:
+            start = int(self.headers["Range"].replace("bytes=", "").split("-")[0])
+            type(self).ranges.append(start)
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Length", str(size - start))
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+            self.end_headers()
+            self.wfile.write(self.content[start:])
+        else:
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            self.wfile.write(self.content[: size // 2])
+            self.wfile.flush()
+            self.close_connection = True
+
+
+def test_download_resumable(tmp_path, http_server):
+    url = http_server(StubFlakyHandler)
+    file_name = os.path.join(tmp_path, "archive.zip")
+    download_resumable(f"{url}/archive.zip", file_name, backoff=0, checksum=True)
+    # resumed from what had been written before the connection dropped
+    assert len(StubFlakyHandler.ranges) == 1
+    assert 0 < StubFlakyHandler.ranges[0] <= len(StubFlakyHandler.content) // 2
+    assert not os.path.exists(f"{file_name}.part")
+    with open(file_name, "rb") as f:
+        assert f.read() == StubFlakyHandler.content
+    assert verify_file(file_name)
+    # a second call is served from the manifest
+    download_resumable(f"{url}/archive.zip", file_name)
+    assert len(StubFlakyHandler.ranges) == 1
+
+
+def test_download_resumable_oversized_part(tmp_path, http_server):
+    StubFlakyHandler.ranges = []
+    url = http_server(StubFlakyHandler)
+    file_name = os.path.join(tmp_path, "archive.zip")
+    # a part file longer than the remote file is not taken as complete
+    with open(f"{file_name}.part", "wb") as f:
+        f.write(StubFlakyHandler.content + b"garbage")
+    download_resumable(f"{url}/archive.zip", file_name, backoff=0)
+    assert StubFlakyHandler.ranges[0] == len(StubFlakyHandler.content) + 7
+    with open(file_name, "rb") as f:
+        assert f.read() == StubFlakyHandler.content
+    assert verify_file(file_name)
+
+
+def test_download_by_stream_resumes(tmp_path, http_server):
+    StubFlakyHandler.ranges = []
+    url = http_server(StubFlakyHandler)
+    file_name = os.path.join(tmp_path, "stream.zip")
+    download_by_stream(f"{url}/stream.zip", file_name)
+    assert len(StubFlakyHandler.ranges) == 1
+    with open(file_name, "rb") as f:
+        assert f.read() == StubFlakyHandler.content
+    assert verify_file(file_name)
+
+
+def _fake_grib(cycle):
+    """Build a fake GRIB2 file of five messages and its .idx sidecar"""
+    fields = [
+        ("PRMSL", "mean sea level"),
+        ("TMP", "2 m above ground"),
+        ("RH", "2 m above ground"),
+        ("UGRD", "10 m above ground"),
+        ("APCP", "surface"),
+    ]
+    messages, lines, offset = [], [], 0
+    for i, (var, level) in enumerate(fields, start=1):
+        message = b"GRIB" + f"{cycle}{var}".encode() * (i * 10) + b"7777"
+        lines.append(f"{i}:{offset}:d={cycle}:{var}:{level}:1 hour fcst:")
+        messages.append(message)
+        offset += len(message)
+    return messages, "\n".join(lines) + "\n"
+
+
+class StubGribHandler(BaseHTTPRequestHandler):
+    """Serve fake GFS files in the aws bucket layout, with Range support"""
+
+    files = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        content = self.files.get(self.path)
+        if content is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        if "Range" in self.headers:
+            start, end = self.headers["Range"].replace("bytes=", "").split("-")
+            end = int(end) if end else len(content) - 1
+            content = content[int(start) : end + 1]
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def test_get_gfs_subset(tmp_path, http_server):
+    expected = {}
+    for date in ["20230101", "20230102"]:
+        for cc in ["00", "12"]:
+            for fff in ["001", "002"]:
+                messages, idx = _fake_grib(f"{date}{cc}{fff}")
+                key = f"/gfs.{date}/{cc}/atmos/gfs.t{cc}z.pgrb2.0p25.f{fff}"
+                StubGribHandler.files[key] = b"".join(messages)
+                StubGribHandler.files[f"{key}.idx"] = idx.encode()
+                expected[(date, cc, fff)] = messages[1] + messages[2] + messages[4]
+    url = http_server(StubGribHandler)
+
+    file_paths = get_gfs_subset(
+        "20230101",
+        "20230102",
+        creation_times=["00", "12"],
+        forecast_times=[1, 2, 3],
+        variables=["TMP:2 m above ground", "RH", "APCP:surface"],
+        save_dir=tmp_path,
+        base_url=url,
+    )
+    assert len(file_paths) == 12
+    # forecast time 3 does not exist on the server
+    assert file_paths[2::3] == [None] * 4
+    for (date, cc, fff), content in expected.items():
+        file_path = os.path.join(tmp_path, date, cc, f"gfs.t{cc}z.pgrb2.0p25.f{fff}")
+        assert file_path in file_paths
+        with open(file_path, "rb") as f:
+            assert f.read() == content
+
+
+def test_mosaic_dem(tmp_path, fake_dem_tiles, monkeypatch):
+    import rasterio
+
+    files = fake_dem_tiles(str(tmp_path))
+    aoi = shapely.Polygon([(110.5, 30.5), (111.5, 30.5), (111.5, 31.5), (110.5, 31.5)])
+    save_file = mosaic_dem(files, str(tmp_path / "dem.tif"), aoi=aoi, block_size=64)
+    with rasterio.open(save_file) as src:
+        assert src.profile["tiled"] and src.profile["blockxsize"] == 64
+        assert src.compression.value == "DEFLATE"
+        assert len(src.overviews(1)) > 0
+        assert src.bounds == (110.5, 30.5, 111.5, 31.5)
+        data = src.read(1)
+    # the clipped window starts at row 100 and col 100 of the 2x2 tiles
+    assert data.shape == (200, 200)
+    assert data[0, 0] == 100 * 1000 + 100
+    assert data[-1, -1] == 299 * 1000 + 299
+
+    # a triangle aoi: pixels outside it are nodata
+    aoi = shapely.Polygon([(110.5, 30.5), (111.5, 30.5), (111.5, 31.5)])
+    save_file = mosaic_dem(files, str(tmp_path / "dem.tif"), aoi=aoi, block_size=64)
+    with rasterio.open(save_file) as src:
+        data = src.read(1)
+        assert data[0, 0] == src.nodata
+        assert data[-1, -1] == 299 * 1000 + 299
+
+    # a failed COG copy leaves no temporary file behind
+    def copy(*args, **kwargs):
+        raise rasterio.errors.RasterioIOError("disk full")
+
+    monkeypatch.setattr(dem.rasterio.shutil, "copy", copy)
+    with pytest.raises(rasterio.errors.RasterioIOError):
+        mosaic_dem(files, str(tmp_path / "failed.tif"), block_size=64)
+    assert not os.path.exists(tmp_path / "failed.tif.tmp.tif")
+
+
+def test_alos_dem_search_resets_hrefs(monkeypatch):
+    features = [{"id": "a", "assets": {"data": {"href": "https://x/a.tif"}}}]
+    monkeypatch.setattr(dem.client, "search_link", lambda root: "https://x/search")
+    monkeypatch.setattr(dem.client, "search", lambda url, params: features)
+    alos = dem.Alos_DEM()
+    alos.search(bbox=[110, 30, 112, 32])
+    assert alos.search(bbox=[110, 30, 112, 32]) == ["https://x/a.tif"]
+
+
+class StubCOGHandler(BaseHTTPRequestHandler):
+    """Serve files of a directory with HTTP Range support and count the bytes sent"""
+
+    root = "."
+    sent = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _file(self):
+        file_name = os.path.join(self.root, os.path.basename(self.path))
+        if not os.path.exists(file_name):
+            self.send_response(404)
+            self.end_headers()
+            return None
+        return file_name
+
+    def do_HEAD(self):
+        file_name = self._file()
+        if file_name is None:
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(os.path.getsize(file_name)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        file_name = self._file()
+        if file_name is None:
+            return
+        size = os.path.getsize(file_name)
+        start, end = 0, size - 1
+        if "Range" in self.headers:
+            start, end = self.headers["Range"].replace("bytes=", "").split("-")
+            start, end = int(start), min(int(end), size - 1)
+        with open(file_name, "rb") as f:
+            f.seek(start)
+            content = f.read(end - start + 1)
+        with type(self).lock:
+            type(self).sent += len(content)
+        self.send_response(206 if "Range" in self.headers else 200)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def test_read_dem_remote(tmp_path, http_server, fake_dem_tiles):
+    import rasterio
+
+    files = fake_dem_tiles(str(tmp_path), size=1000)
+    StubCOGHandler.root = str(tmp_path)
+    url = http_server(StubCOGHandler)
+    hrefs = [f"{url}/{os.path.basename(f)}" for f in files]
+
+    # a small aoi across the four tiles
+    aoi = [110.98, 30.98, 111.03, 31.02]
+    data, profile = read_dem(hrefs, aoi)
+    assert data.shape == (40, 50)
+    assert data[0, 0] == 980 * 1000 + 980
+    assert profile["transform"].c == 110.98
+    total = sum(os.path.getsize(f) for f in files)
+    assert StubCOGHandler.sent < total / 10
+
+    save_file = read_dem(hrefs, aoi, save_file=str(tmp_path / "dem.tif"))
+    with rasterio.open(save_file) as src:
+        assert (src.read(1) == data).all()
+
+
+def test_download_scenes(tmp_path, http_server, fake_dem_tiles):
+    import rasterio
+
+    tile_dir = tmp_path / "tiles"
+    os.makedirs(tile_dir)
+    files = [os.path.basename(f) for f in fake_dem_tiles(str(tile_dir), n_lat=1)]
+    StubCOGHandler.root = str(tile_dir)
+    StubCOGHandler.sent = 0
+    url = http_server(StubCOGHandler)
+
+    def feature(id, cloud_cover, red, nir):
+        def asset(href, name, common_name):
+            return {
+                "href": f"{url}/{href}",
+                "type": "image/tiff; application=geotiff; profile=cloud-optimized",
+                "roles": ["data"],
+                "eo:bands": [{"name": name, "common_name": common_name}],
+            }
+
+        return {
+            "id": id,
+            "properties": {"datetime": "2023-01-01", "eo:cloud_cover": cloud_cover},
+            "assets": {
+                "B4": asset(red, "B4", "red"),
+                "B5": asset(nir, "B5", "nir08"),
+                "thumbnail": {"href": f"{url}/thumb.jpg", "roles": ["thumbnail"]},
+            },
+        }
+
+    features = [
+        feature("scene_a", 10, files[0], files[1]),
+        feature("scene_b", 90, files[0], files[1]),
+        feature("scene_c", 20, files[0], "missing.tif"),
+    ]
+    scenes = select_assets(features, bands=["red", "nir08"], max_cloud_cover=50)
+    assert [s["id"] for s in scenes] == ["scene_a", "scene_c"]
+    assert scenes[0]["assets"] == {
+        "red": f"{url}/{files[0]}",
+        "nir08": f"{url}/{files[1]}",
+    }
+
+    aoi = [110.9, 31.5, 111.1, 31.6]
+    result = download_scenes(scenes, str(tmp_path / "scenes"), aoi=aoi, max_workers=4)
+    assert result["scene_c"] is None
+    with rasterio.open(result["scene_a"]["nir08"]) as src:
+        # the right half of the aoi lies in the second tile
+        assert src.read(1).shape == (20, 20)
+    with open(tmp_path / "scenes" / "scene_c" / "_checkpoint.json") as f:
+        # the band that succeeded in an incomplete scene is recorded
+        assert list(json.load(f)["bands"]) == ["red"]
+
+    # finished bands are skipped
+    sent = StubCOGHandler.sent
+    result_again = download_scenes(scenes, str(tmp_path / "scenes"), aoi=aoi)
+    assert result_again["scene_a"] == result["scene_a"]
+    assert result_again["scene_c"] is None
+    assert StubCOGHandler.sent == sent
+
+    # another aoi invalidates the checkpoint
+    aoi = [110.9, 31.5, 111.1, 31.55]
+    result = download_scenes(scenes[:1], str(tmp_path / "scenes"), aoi=aoi)
+    with rasterio.open(result["scene_a"]["nir08"]) as src:
+        assert src.read(1).shape == (10, 20)
+
+    # whole files without an aoi, downloaded again with cover
+    result = download_scenes(scenes[:1], str(tmp_path / "scenes"))
+    assert not os.path.exists(tmp_path / "scenes" / "scene_a" / "nir08.tif")
+    sent = StubCOGHandler.sent
+    download_scenes(scenes[:1], str(tmp_path / "scenes"))
+    assert StubCOGHandler.sent == sent
+    download_scenes(scenes[:1], str(tmp_path / "scenes"), cover=True)
+    total = sum(os.path.getsize(f) for f in result["scene_a"].values())
+    assert StubCOGHandler.sent == sent + total
+
+    # a band that is not a COG is downloaded whole even with an aoi
+    scene = dict(scenes[0], id="scene_jp2")
+    scene["media_types"] = dict(scene["media_types"], nir08="image/jp2")
+    result = download_scenes([scene], str(tmp_path / "scenes"), aoi=aoi)
+    with rasterio.open(result["scene_jp2"]["red"]) as src:
+        assert src.read(1).shape == (10, 20)
+    assert os.path.getsize(result["scene_jp2"]["nir08"]) == os.path.getsize(
+        tile_dir / files[1]
+    )
+
+
+class StubFTPHandler(socketserver.StreamRequestHandler):
+    """A minimal anonymous FTP server in passive mode, counting the logins"""
+
+    files = {f"data/file_{i}.zip": os.urandom(20000 + i) for i in range(6)}
+    logins = 0
+    lock = threading.Lock()
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 stub ftp")
+        data_server, rest = None, 0
+        for line in self.rfile:
+            command, _, arg = line.decode().strip().partition(" ")
+            command = command.upper()
+            if command == "USER":
+                self.reply("331 password please")
+            elif command == "PASS":
+                with type(self).lock:
+                    type(self).logins += 1
+                self.reply("230 logged in")
+            elif command in ("TYPE", "NOOP"):
+                self.reply("200 ok")
+            elif command == "SIZE":
+                if arg in self.files:
+                    self.reply(f"213 {len(self.files[arg])}")
+                else:
+                    self.reply("550 no such file")
+            elif command == "PASV":
+                data_server = socket.create_server(("127.0.0.1", 0))
+                port = data_server.getsockname()[1]
+                self.reply(f"227 passive (127,0,0,1,{port // 256},{port % 256})")
+            elif command == "REST":
+                rest = int(arg)
+                self.reply("350 restarting")
+            elif command == "RETR":
+                self.reply("150 sending")
+                conn, _ = data_server.accept()
+                conn.sendall(self.files[arg][rest:])
+                conn.close()
+                data_server.close()
+                rest = 0
+                self.reply("226 done")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+def test_download_ftp_files_pooled(tmp_path):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), StubFTPHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = f"127.0.0.1:{server.server_address[1]}"
+    try:
+        urls = [f"ftp://{host}/{name}" for name in StubFTPHandler.files]
+        paths = download_ftp_files(urls[:3], str(tmp_path), max_workers=2)
+        # six files over at most two logged-in connections
+        paths += download_ftp_files(urls[3:], str(tmp_path), max_workers=2)
+        assert 1 <= StubFTPHandler.logins <= 2
+        for path, content in zip(paths, StubFTPHandler.files.values()):
+            with open(path, "rb") as f:
+                assert f.read() == content
+            assert verify_file(path)
+
+        # a later call with more workers grows the shared pool
+        assert get_ftp_pool(host, size=2).size == 2
+        assert get_ftp_pool(host, size=5).size == 5
+    finally:
+        get_ftp_pool(host).close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_nwis_iv_batch_failures(tmp_path, monkeypatch):
+    def get_iv(sites, start=None, end=None, **kwargs):
+        if "bad" in sites:
+            raise ConnectionError("service unavailable")
+        index = pd.MultiIndex.from_product(
+            [sites, pd.date_range("2021-10-01", periods=2, freq="15min", tz="UTC")],
+            names=["site_no", "datetime"],
+        )
+        df = pd.DataFrame({"00065": 1.5, "00065_cd": "P"}, index=index)
+        return df, None
+
+    monkeypatch.setattr(hydrostation.nwis, "get_iv", get_iv)
+    save_file = os.path.join(tmp_path, "nwis_iv.parquet")
+    df = download_nwis_batch(
+        ["01013500", "bad", "01030500"], save_file=save_file, group_size=1, backoff=0
+    )
+    assert df.attrs["failed_sites"] == ["bad"]
+    assert set(df["site_no"]) == {"01013500", "01030500"}
+
+    # nothing is written when every group fails
+    with pytest.raises(Exception):
+        download_nwis_batch(["bad"], save_file=save_file + "2", backoff=0)
+    assert not os.path.exists(save_file + "2")
+
+    # the txt files keep the site_no column, as single-site get_iv returns it
+    gage_id_file = os.path.join(tmp_path, "gages.txt")
+    with open(gage_id_file, "w") as f:
+        f.write("agency\tsite_no\nUSGS\t01013500\n")
+    monkeypatch.chdir(tmp_path)
+    hydrostation.download_nwis(gage_id_file, "2021-10-01", "2021-10-02")
+    with open(os.path.join(tmp_path, "01013500.txt")) as f:
+        assert f.readline().split()[2:5] == ["01013500", "1.50", "P"]
+
+
+def test_nwis_stream_data_station_store(tmp_path, monkeypatch):
+    def get_iv(sites, start=None, end=None, **kwargs):
+        sites = [sites] if isinstance(sites, str) else sites
+        index = pd.MultiIndex.from_product(
+            [sites, pd.date_range("2021-10-01", periods=2, freq="15min", tz="UTC")],
+            names=["site_no", "datetime"],
+        )
+        df = pd.DataFrame({"00060": 10.0, "00060_cd": "P"}, index=index)
+        return df, None
+
+    monkeypatch.setattr(hydrostation.nwis, "get_iv", get_iv)
+    store = StationStore(str(tmp_path / "stations"))
+    save_dir = f"{tmp_path}{os.sep}"
+    get_nwis_stream_data(save_dir, ["01013500", "01030500"], station_store=store)
+    get_nwis_stream_data(save_dir, "01022500", station_store=store)
+    stats = store.stations(source="nwis_iv")
+    assert sorted(stats["station"]) == ["01013500", "01022500", "01030500"]
+    assert (stats["variable"] == "00060").all() and (stats["count"] == 2).all()
+
+
+class StubUsgsSession:
+    """Answer every request with USGS_RDB, like a requests.Session"""
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def close(self):
+        pass
+
+    def get(self, url, stream=False):
+        response = requests.models.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(USGS_RDB.encode())
+        response.encoding = "utf-8"
+        return response
+
+
+def test_usgs_data_batch_station_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(hydrostation.requests, "Session", StubUsgsSession)
+    store = StationStore(str(tmp_path / "stations"))
+    results = download_usgs_data_batch(
+        pd.Timestamp("2021-11-07"),
+        pd.Timestamp("2021-11-08"),
+        ["01646500"],
+        station_store=store,
+    )
+    assert len(results["01646500"]) == 4
+    stats = store.stations(source="usgs_iv").set_index("variable")
+    assert stats.loc["cfs", "count"] == 2
+    assert stats.loc["height", "count"] == 4
+    # 01:00 EST is stored as 06:00 UTC
+    df = store.read(source="usgs_iv", variables=["height"])
+    assert df["time"].max() == pd.Timestamp("2021-11-07 07:00")
@@ -8,8 +8,15 @@ FilePath: \hydro_opendata\tests\test_processor.py
 Copyright (c) 2023-2024 Wenyu Ouyang. All rights reserved.
 """
 import os
+import ujson
 import geopandas as gpd
-from hydro_opendata.processor.minio import GeoProcessor, geojson_to_shp
+from hydro_opendata.processor.minio import (
+    GeoProcessor,
+    geojson_to_shp,
+    _group_messages,
+    _rename_variable,
+    _update_gfs_paras,
+)
 
 
 def test_geojson_to_shp(tmp_path):
@@ -40,3 +47,62 @@ def test_upload_and_read_shp(tmp_path, minio_paras):
     geo_processor.upload_geojson(gj_local_path=input_geojson, gj_mo_name="test.geojson")
     gdf_rd = geo_processor.read_shp("test.zip")
     assert gdf_rd.equals(gdf)
+
+
+def _grib_message(var, short_name, level, step):
+    """a minimal scan_grib-like reference of one GRIB message"""
+    attrs = {
+        "GRIB_shortName": short_name,
+        "GRIB_typeOfLevel": level,
+        "coordinates": f"{level} latitude longitude step time valid_time",
+    }
+    return {
+        "version": 1,
+        "refs": {
+            f"{var}/.zattrs": ujson.dumps(attrs),
+            f"{var}/0.0": ["s3://test/gfs.f001", 0, 100],
+            "step/.zattrs": "{}",
+            "step/0": str(step),
+            "latitude/.zattrs": "{}",
+        },
+    }
+
+
+def test_group_gfs_messages():
+    messages = [
+        _grib_message("tp", "tp", "surface", 3),
+        # the second APCP message of a file accumulates from the cycle start
+        _grib_message("tp", "tp", "surface", 9),
+        _grib_message("tcc", "tcc", "boundaryLayerCloudLayer", 3),
+        _grib_message("tcc", "tcc", "atmosphere", 3),
+        _grib_message("t2m", "2t", "heightAboveGround", 3),
+        _grib_message("prmsl", "prmsl", "meanSea", 3),
+    ]
+    groups = _group_messages(messages, ["tp", "tcc", "2t"])
+    assert list(groups.keys()) == ["tp", "tcc", "2t"]
+    assert groups["tp"] is not messages[0]
+    assert "step/0" not in groups["tp"]["refs"]
+    attrs = ujson.loads(groups["tcc"]["refs"]["tcc/.zattrs"])
+    assert attrs["GRIB_typeOfLevel"] == "atmosphere"
+    assert "step" not in attrs["coordinates"].split()
+
+    refs = _rename_variable(groups["2t"]["refs"], "t2m", "temperature_2m_above_ground")
+    assert "temperature_2m_above_ground/0.0" in refs
+    assert "latitude/.zattrs" in refs
+    assert not any(key.startswith("t2m/") for key in refs)
+
+
+def test_update_gfs_paras():
+    bbox = [115, 38, 136, 54]
+    paras = {
+        "tp": [
+            {"start": "2016-01-01", "end": "2022-08-31", "bbox": bbox},
+            {"start": "2022-09-01", "end": "2023-10-01", "bbox": bbox},
+        ]
+    }
+    _update_gfs_paras(paras, "tp", "2023-10-03", bbox)
+    _update_gfs_paras(paras, "tp", "2023-09-15", bbox)
+    _update_gfs_paras(paras, "2t", "2023-10-03", bbox)
+    assert paras["tp"][0]["end"] == "2022-08-31"
+    assert paras["tp"][-1] == {"start": "2022-09-01", "end": "2023-10-03", "bbox": bbox}
+    assert paras["2t"] == [{"start": "2023-10-03", "end": "2023-10-03", "bbox": bbox}]
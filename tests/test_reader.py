@@ -8,9 +8,18 @@ FilePath: \hydro_opendata\tests\test_reader.py
 Copyright (c) 2023-2024 Wenyu Ouyang. All rights reserved.
 """
 import os
+import numpy as np
+import pandas as pd
 from minio import Minio
 import hydrodataset as hds
-from hydro_opendata.reader.grdc import GRDCDataHandler
+import xarray as xr
+from hydro_opendata.reader.grdc import (
+    GRDCDataHandler,
+    dailygrdc2netcdf,
+    read_grdc_daily_data,
+)
+from hydro_opendata.downloader.hydrostation import _write_nwis_station_store
+from hydro_opendata.reader.station import StationStore
 from hydro_opendata.reader.reader import (
     AOI,
     GPMDataHandler,
@@ -56,3 +65,180 @@ def test_reader_grdc():
         os.path.join(hds.CACHE_DIR.joinpath("grdc_daily_data"), "grdc_daily_data.nc"),
         aoi,
     )
+
+
+def write_grdc_daily_file(data_dir, station_id, dates, values):
+    """write a GRDC export format daily file with the header layout of the real ones"""
+    header = [""] * 35
+    header[0] = "# Title:                 GRDC STATION DATA FILE"
+    header[6] = "# file generation date:  2019-03-27"
+    header[8] = f"# GRDC-No.:              {station_id}"
+    header[9] = "# River:                 RHINE RIVER"
+    header[10] = "# Station:               REES"
+    header[11] = "# Country:               DE"
+    header[12] = "# Latitude (DD):       51.756918"
+    header[13] = "# Longitude (DD):      6.395395"
+    header[14] = "# Catchment area (km²):      159300.0"
+    header[15] = "# Altitude (m ASL):        8.0"
+    header[21] = "# Data Set Content:      MEAN DAILY DISCHARGE (Q)"
+    header[23] = "# Unit of measure:                  m³/s"
+    header[24] = "# Time series:           1814-11 - 2016-12"
+    header[25] = "# No. of years:          203"
+    header[26] = "# Last update:           2018-05-24"
+    header[34] = f"# Data lines: {len(dates)}"
+    lines = [line or "#" for line in header] + ["# DATA", "YYYY-MM-DD;hh:mm; Value"]
+    lines += [
+        f"{date:%Y-%m-%d};--:--;{value:11.3f}" for date, value in zip(dates, values)
+    ]
+    file_path = os.path.join(data_dir, f"{station_id}_Q_Day.Cmd.txt")
+    with open(file_path, "w", encoding="cp1252", newline="\r\n") as f:
+        f.write("\n".join(lines) + "\n")
+    return file_path
+
+
+def test_read_grdc_daily_data(tmp_path):
+    dates = pd.date_range("2000-01-01", "2000-12-31")
+    values = np.arange(len(dates), dtype=float)
+    values[3] = -999
+    # a gap in the record
+    keep = (dates < "2000-03-01") | (dates > "2000-03-10")
+    write_grdc_daily_file(tmp_path, 6335020, dates[keep], values[keep])
+
+    df, meta = read_grdc_daily_data(
+        "6335020", "1999-12-01T00:00Z", "2000-12-31T00:00Z", str(tmp_path)
+    )
+    assert meta["id_from_grdc"] == 6335020
+    assert meta["grdc_latitude_in_arc_degree"] == 51.756918
+    assert meta["units"] == "m³/s"
+    assert meta["nrMeasurements"] == keep.sum()
+    assert df.index.name == "time"
+    assert len(df) == 31 + 366
+    assert df["streamflow"].loc["1999-12"].isna().all()
+    assert np.isnan(df.loc["2000-01-04", "streamflow"])
+    assert df["streamflow"].loc["2000-03-01":"2000-03-10"].isna().all()
+    assert df.loc["2000-12-31", "streamflow"] == values[-1]
+    assert meta["nrMissingData"] == 31 + 1 + 10
+
+
+def test_dailygrdc2netcdf_incremental(tmp_path, fake_grdc_catalogue):
+    fake_grdc_catalogue(tmp_path, 10)
+    dates = pd.date_range("2000-01-01", "2001-12-31")
+    for i in range(3):
+        write_grdc_daily_file(tmp_path, 6335000 + i, dates, np.full(len(dates), i))
+    # not in the catalogue
+    write_grdc_daily_file(tmp_path, 1234567, dates, np.zeros(len(dates)))
+
+    nc_file = dailygrdc2netcdf("2000-01-01", "2000-06-30", str(tmp_path), max_workers=2)
+    with xr.open_dataset(nc_file) as ds:
+        assert ds["station"].values.tolist() == [6335000, 6335001, 6335002]
+        assert ds.sizes["time"] == 182
+        assert (ds["streamflow"].sel(station=6335002) == 2).all()
+
+    # a new station file and a longer period: only the missing parts are read
+    write_grdc_daily_file(tmp_path, 6335003, dates, np.full(len(dates), 3))
+    nc_file = dailygrdc2netcdf("2000-01-01", "2000-12-31", str(tmp_path), max_workers=2)
+    with xr.open_dataset(nc_file) as ds:
+        assert ds["station"].values.tolist() == [6335000, 6335001, 6335002, 6335003]
+        assert ds.sizes["time"] == 366
+        for i in range(4):
+            assert (ds["streamflow"].sel(station=6335000 + i) == i).all()
+
+    # new stations are appended to a zarr store
+    zarr_file = dailygrdc2netcdf(
+        "2000-01-01",
+        "2000-12-31",
+        str(tmp_path),
+        station_ids=[6335000, 6335001],
+        store_format="zarr",
+    )
+    dailygrdc2netcdf("2000-01-01", "2000-12-31", str(tmp_path), store_format="zarr")
+    with xr.open_zarr(zarr_file) as ds:
+        assert ds["station"].values.tolist() == [6335000, 6335001, 6335002, 6335003]
+        assert (ds["streamflow"].sel(station=6335003) == 3).all()
+
+
+def test_grdc_handler_batch(tmp_path, fake_grdc_catalogue):
+    fake_grdc_catalogue(tmp_path, 10)
+    dates = pd.date_range("2000-01-01", "2000-12-31")
+    for i in range(4):
+        write_grdc_daily_file(tmp_path, 6335000 + i, dates, np.full(len(dates), i))
+    nc_file = dailygrdc2netcdf("2000-01-01", "2000-12-31", str(tmp_path))
+    with xr.open_dataset(nc_file) as ds:
+        assert ds["streamflow"].encoding["chunksizes"] == (366, 1)
+
+    grdc_handler = GRDCDataHandler()
+    local_grdc_reader = LocalFileReader(grdc_handler)
+    aoi = AOI(
+        "station",
+        {"station_id": "6335002", "start_time": "2000-02-01", "end_time": "2000-02-29"},
+    )
+    data = local_grdc_reader.read(nc_file, aoi)
+    assert data["station"].item() == 6335002
+    assert data.sizes["time"] == 29
+    assert (data["streamflow"] == 2).all()
+
+    # many stations in one read, in the requested order
+    data = grdc_handler.read(nc_file, [6335003, 6335000], "2000-01-01", "2000-01-10")
+    assert data["station"].values.tolist() == [6335003, 6335000]
+    assert data["streamflow"].isel(time=0).values.tolist() == [3, 0]
+
+    # the open store is reused, and reopened after the file changes
+    ds_open = grdc_handler._open(nc_file)[0]
+    assert grdc_handler._open(nc_file)[0] is ds_open
+    write_grdc_daily_file(tmp_path, 6335004, dates, np.full(len(dates), 4))
+    dailygrdc2netcdf("2000-01-01", "2000-12-31", str(tmp_path))
+    # the cached handle was closed before the store was replaced
+    assert grdc_handler._stores == {}
+    data = grdc_handler.read(nc_file, [6335004], "2000-01-01", "2000-01-10")
+    assert (data["streamflow"] == 4).all()
+    grdc_handler.close()
+
+
+def test_station_store(tmp_path, fake_grdc_catalogue):
+    fake_grdc_catalogue(tmp_path, 10)
+    dates = pd.date_range("2000-01-01", "2000-12-31")
+    for i in range(3):
+        write_grdc_daily_file(tmp_path, 6335000 + i, dates, np.full(len(dates), i))
+    store = StationStore(str(tmp_path / "stations"))
+    dailygrdc2netcdf("2000-01-01", "2000-06-30", str(tmp_path), station_store=store)
+    # only the added dates are written again
+    dailygrdc2netcdf("2000-01-01", "2000-12-31", str(tmp_path), station_store=store)
+
+    iv = pd.DataFrame(
+        {
+            "site_no": ["01013500"] * 4,
+            "datetime": pd.date_range(
+                "2000-01-01 05:00", periods=4, freq="15min", tz="US/Eastern"
+            ),
+            "00065": [1.0, 2.0, np.nan, 4.0],
+            "00065_cd": ["A"] * 4,
+        }
+    )
+    _write_nwis_station_store(iv, store)
+
+    stats = store.stations()
+    grdc = stats[stats["source"] == "grdc"].set_index("station")
+    assert grdc.loc["6335002", "count"] == 366
+    assert grdc.loc["6335002", "mean"] == 2
+    assert grdc.loc["6335001", "lat"] == 0.1
+    assert grdc.loc["6335000", "end"] == pd.Timestamp("2000-12-31")
+    nwis = stats[stats["source"] == "nwis_iv"].iloc[0]
+    assert nwis["variable"] == "00065" and nwis["count"] == 3
+
+    df = store.read(
+        source="grdc", stations=[6335001], start_time="2000-03-01", end_time="2000-03-31"
+    )
+    assert len(df) == 31 and (df["value"] == 1).all()
+    # times are stored in UTC
+    df = store.read(source="nwis_iv")
+    assert df["time"].iloc[0] == pd.Timestamp("2000-01-01 10:00")
+
+    # stations 6335001 and 6335002 are located at (0.1, 0.1) and (0.2, 0.2)
+    hits = store.query([0.05, 0.05, 0.3, 0.3])
+    assert hits["station"].tolist() == ["6335001", "6335002"]
+    df = store.read(bbox=[0.15, 0.15, 0.3, 0.3], end_time="2000-01-31")
+    assert df["station"].unique().tolist() == ["6335002"]
+    assert len(df) == 31
+
+    # a new store instance sees the same data
+    assert len(StationStore(str(tmp_path / "stations")).stations()) == 4